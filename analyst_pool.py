@@ -0,0 +1,177 @@
+import asyncio
+import contextlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+
+class AnalystPool:
+    """
+    Bounded worker pool for analyst subtasks.
+
+    A subtask holds one of `max_workers` process-wide slots and one of its
+    tenant's slots while it retrieves and analyses, so a tenant fanning a
+    multi-company comparison out to many analysts cannot starve the others.
+    Retrieval and analysis each run under their own timeout.
+
+    Tenant ids come from clients, so only configured tenants get their own
+    slots; any other id shares the "default" tenant's, and sending a new id per
+    request does not get around the limit. The shared "default" tenant may use
+    every worker unless `tenant_limits` caps it. At most `max_tenants` tenants are
+    tracked, idle ones are dropped least recently used first.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        max_per_tenant: int = 4,
+        tenant_limits: Optional[Dict[str, int]] = None,
+        retrieval_timeout: float = 15,
+        analyst_timeout: float = 60,
+        tenants: Optional[Iterable[str]] = None,
+        max_tenants: int = 1024,
+    ):
+        """
+        Args:
+            max_workers (int): Subtasks running at once over all tenants.
+            max_per_tenant (int): Subtasks running at once per configured tenant.
+            tenant_limits (dict): Per-tenant overrides of `max_per_tenant`, a "default"
+                entry caps the shared tenant (otherwise limited by `max_workers` only).
+            retrieval_timeout (float): Seconds a subtask may spend retrieving context.
+            analyst_timeout (float): Seconds a subtask's analyst call may take.
+            tenants (iterable): Tenant ids with slots of their own, besides those in `tenant_limits`.
+            max_tenants (int): Tenants whose slots and counters are kept.
+        """
+        self.max_workers = max_workers
+        self.max_per_tenant = max_per_tenant
+        self.tenant_limits = dict(tenant_limits or {})
+        self.retrieval_timeout = retrieval_timeout
+        self.analyst_timeout = analyst_timeout
+        self.known_tenants = set(tenants or ()) | set(self.tenant_limits)
+        self.max_tenants = max_tenants
+        self._workers = asyncio.Semaphore(max_workers)
+        self._tenants: Dict[str, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+        self._counters: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+
+    def tenant(self, tenant_id: Optional[str]) -> str:
+        """
+        Returns:
+            str: The tenant whose slots a request with this id uses, "default" for
+                ids that are not configured.
+        """
+        return tenant_id if tenant_id in self.known_tenants else "default"
+
+    def _tenant_counters(self, tenant: str) -> Dict[str, int]:
+        # Called with the lock held.
+        counters = self._counters.get(tenant)
+        if counters is None:
+            counters = self._counters[tenant] = {
+                "subtasks": 0,
+                "queued": 0,
+                "running": 0,
+                "completed": 0,
+                "retrieval_timeouts": 0,
+                "analyst_timeouts": 0,
+                "failures": 0,
+                "abandoned": 0,
+            }
+            idle = [
+                key for key, value in self._counters.items()
+                if key != tenant and not value["queued"] and not value["running"]
+            ]
+            for key in idle[:max(0, len(self._counters) - self.max_tenants)]:
+                del self._counters[key]
+                self._tenants.pop(key, None)
+        self._counters.move_to_end(tenant)
+        return counters
+
+    def _incr(self, tenant: str, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._tenant_counters(tenant)[name] += value
+
+    def _limit(self, tenant: str) -> int:
+        if tenant in self.tenant_limits:
+            return self.tenant_limits[tenant]
+        # Unconfigured clients all share "default", a per-tenant cap there would cap the server.
+        return self.max_workers if tenant == "default" else self.max_per_tenant
+
+    def _tenant_slots(self, tenant: str) -> asyncio.Semaphore:
+        with self._lock:
+            self._tenant_counters(tenant)
+            if tenant not in self._tenants:
+                self._tenants[tenant] = asyncio.Semaphore(self._limit(tenant))
+            return self._tenants[tenant]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tenant: str = "default"):
+        # Take the tenant's slot first, so queued work of one tenant holds no global slot.
+        tenant_slots = self._tenant_slots(tenant)
+        self._incr(tenant, "queued")
+        try:
+            await tenant_slots.acquire()
+            try:
+                await self._workers.acquire()
+            except BaseException:
+                tenant_slots.release()
+                raise
+        finally:
+            self._incr(tenant, "queued", -1)
+        self._incr(tenant, "running")
+        try:
+            yield
+        finally:
+            self._incr(tenant, "running", -1)
+            self._workers.release()
+            tenant_slots.release()
+
+    async def run(self, tenant: str, retrieve, analyse) -> Dict[str, Any]:
+        """
+        Runs one subtask: `retrieve()` then `analyse(context)`, in a slot of the tenant.
+
+        A retrieval that times out or fails leaves the analyst without retrieved
+        context; an analyst that times out or fails leaves the subtask without analysis.
+
+        Returns:
+            dict: The subtask's `context` (list) and `analysis` (str, or None).
+        """
+        self._incr(tenant, "subtasks")
+        try:
+            async with self.slot(tenant):
+                try:
+                    context = await asyncio.wait_for(retrieve(), self.retrieval_timeout)
+                except asyncio.TimeoutError:
+                    self._incr(tenant, "retrieval_timeouts")
+                    context = []
+                except Exception:
+                    self._incr(tenant, "failures")
+                    context = []
+                try:
+                    analysis = await asyncio.wait_for(analyse(context), self.analyst_timeout)
+                except asyncio.TimeoutError:
+                    self._incr(tenant, "analyst_timeouts")
+                    analysis = None
+                except Exception:
+                    self._incr(tenant, "failures")
+                    analysis = None
+        except asyncio.CancelledError:
+            self._incr(tenant, "abandoned")
+            raise
+        if analysis is not None:
+            self._incr(tenant, "completed")
+        return {"context": context, "analysis": analysis}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: The pool limits and, per tenant, subtask counts by outcome and the
+                subtasks currently queued and running.
+        """
+        with self._lock:
+            tenants = {tenant: dict(counters) for tenant, counters in self._counters.items()}
+        return {
+            "max_workers": self.max_workers,
+            "max_per_tenant": self.max_per_tenant,
+            "tenant_limits": self.tenant_limits,
+            "tenants": tenants,
+        }
@@ -0,0 +1,157 @@
+import functools
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+import numpy as np
+import tiktoken
+
+from session_store import chunk_id
+
+
+@functools.lru_cache(maxsize=None)
+def encoding_for(model: str) -> "tiktoken.Encoding":
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Models newer than the installed tiktoken use the gpt-4o encoding.
+        return tiktoken.get_encoding("o200k_base")
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    # Cached: the leader and follow-up prompts of a request count the same chunks.
+    return len(encoding_for(model).encode(text, disallowed_special=()))
+
+
+def render_chunks(chunks: List[str]) -> str:
+    """
+    Numbers the chunks and separates them with blank lines, instead of the quotes,
+    brackets and escapes of a list repr.
+    """
+    return "\n\n".join(f"[{i}] {chunk}" for i, chunk in enumerate(chunks, start=1))
+
+
+class ContextPacker:
+    """
+    Assembles the context of a prompt from retrieved chunks.
+
+    Chunks are deduplicated by content hash, chunks whose embedding is at least
+    `near_duplicate` similar to a chunk already kept are dropped, and the rest are
+    packed, in retrieval order, into `budget` tokens counted with the model's
+    tokenizer. A chunk that does not fit is skipped so a shorter later one still can.
+    """
+
+    def __init__(
+        self,
+        embed_chunks: Optional[Callable[[List[str]], Awaitable[List[np.ndarray]]]] = None,
+        budget: int = 3000,
+        near_duplicate: float = 0.95,
+        model: str = "gpt-4o",
+    ):
+        """
+        Args:
+            embed_chunks (coroutine function): Returns the embeddings of a list of chunks.
+                Without it only exact duplicates are dropped.
+            budget (int): Tokens of context per prompt.
+            near_duplicate (float): Cosine similarity from which two chunks count as duplicates.
+            model (str): Model whose tokenizer counts the budget.
+        """
+        self.embed_chunks = embed_chunks
+        self.budget = budget
+        self.near_duplicate = near_duplicate
+        self.model = model
+        self._lock = threading.Lock()
+        self._counters = {
+            "packs": 0,
+            "chunks_in": 0,
+            "duplicates": 0,
+            "near_duplicates": 0,
+            "over_budget": 0,
+            "tokens_in": 0,
+            "tokens_out": 0,
+        }
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for name, value in increments.items():
+                self._counters[name] += value
+
+    def _truncate(self, text: str, budget: int) -> str:
+        encoding = encoding_for(self.model)
+        tokens = encoding.encode(text, disallowed_special=())
+        self._count(packs=1, chunks_in=1, tokens_in=len(tokens), tokens_out=min(len(tokens), budget))
+        return text if len(tokens) <= budget else encoding.decode(tokens[:budget])
+
+    def pack(self, chunks: Union[List[str], str], vectors: Optional[List[np.ndarray]] = None) -> Union[List[str], str]:
+        """
+        Args:
+            chunks (list or str): Retrieved chunks, best first, or web context as one string,
+                which is only cut to the budget.
+            vectors (list): Embeddings of the chunks, enables near-duplicate removal.
+
+        Returns:
+            The kept chunks in their original order, or the cut string.
+        """
+        if not isinstance(chunks, list):
+            return self._truncate(chunks, self.budget)
+
+        unique, unique_vectors, sizes = [], [], {}
+        tokens_in = 0
+        for i, chunk in enumerate(chunks):
+            key = chunk_id(" ".join(chunk.split()))
+            if key not in sizes:
+                # Each rendered chunk also costs its "[n] " label and the blank line before it.
+                sizes[key] = count_tokens(chunk, self.model) + 4
+                unique.append((chunk, sizes[key]))
+                if vectors is not None:
+                    unique_vectors.append(vectors[i])
+            tokens_in += sizes[key]
+        duplicates = len(chunks) - len(unique)
+
+        keep = list(range(len(unique)))
+        if vectors is not None and len(unique) > 1:
+            matrix = np.asarray(unique_vectors, dtype=np.float32)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+            similarity = matrix @ matrix.T
+            keep = []
+            for i in range(len(unique)):
+                if not keep or similarity[i, keep].max() < self.near_duplicate:
+                    keep.append(i)
+        near_duplicates = len(unique) - len(keep)
+
+        packed, used = [], 0
+        for i in keep:
+            chunk, tokens = unique[i]
+            if used + tokens <= self.budget:
+                packed.append(chunk)
+                used += tokens
+        self._count(
+            packs=1,
+            chunks_in=len(chunks),
+            duplicates=duplicates,
+            near_duplicates=near_duplicates,
+            over_budget=len(keep) - len(packed),
+            tokens_in=tokens_in,
+            tokens_out=used,
+        )
+        return packed
+
+    async def async_pack(self, chunks: Union[List[str], str]) -> Union[List[str], str]:
+        """
+        Async variant of `pack` that embeds the chunks with `embed_chunks` first.
+        """
+        vectors = None
+        if isinstance(chunks, list) and len(chunks) > 1 and self.embed_chunks is not None:
+            vectors = await self.embed_chunks(chunks)
+        return self.pack(chunks, vectors)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Chunks dropped as duplicates, near duplicates and over budget, and the
+                context tokens before and after packing.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        counters["token_savings"] = 1 - counters["tokens_out"] / counters["tokens_in"] if counters["tokens_in"] else 0.0
+        return counters
@@ -1,18 +1,60 @@
+import asyncio
+import json
 import openai
-from openai import OpenAI
 import numpy as np
+from llm_gateway import get_gateway
+from context_packing import render_chunks
+
+# Output schema of the structured decomposition: any number of subtasks, each naming
+# the subtasks whose answers it needs first.
+SUBTASK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "subtasks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "task": {"type": "string"},
+                    "depends_on": {"type": "array", "items": {"type": "integer"}},
+                },
+                "required": ["id", "task", "depends_on"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["subtasks"],
+    "additionalProperties": False,
+}
 
 
 class ConversationalPipeline:
 
-    def __init__(self, openai_api_key, model="gpt-4o"):
+    def __init__(self, openai_api_key, model="gpt-4o", session=None, packer=None, router=None):
         openai.api_key = openai_api_key
         self.api_key = openai_api_key
         self.model = model
-        self.client = OpenAI(api_key=self.api_key)
-
-
-    def call_openai(self, prompt, model="gpt-4"):
+        self.gateway = get_gateway(self.api_key)
+        # A session_store.Session: leader prompts then reference chunks sent in earlier
+        # turns and carry a summary of those turns.
+        self.session = session
+        # A context_packing.ContextPacker deduplicating and budgeting leader contexts.
+        self.packer = packer
+        # A model_router.ModelRouter picking each stage's model by `complexity`;
+        # without it every stage uses `model`.
+        self.router = router
+        self.complexity = "simple"
+
+
+    def _messages(self, prompt):
+        return [{"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt}]
+
+    def model_for(self, stage):
+        return self.router.model(stage, self.complexity) if self.router is not None else self.model
+
+    def call_openai(self, prompt, model=None, stage=None):
         # response = openai.ChatCompletion.create(
         #     model=model,
         #     messages=[{"role": "system", "content": "You are a helpful assistant."},
@@ -20,15 +62,52 @@ class ConversationalPipeline:
         # )
         # return response['choices'][0]['message']['content']
 
-        response = self.client.chat.completions.create(
-            messages=[{"role": "system", "content": "You are a helpful assistant."},
-                      {"role": "user", "content": prompt}],
-            model=self.model,
+        response = self.gateway.chat_completion(
+            messages=self._messages(prompt),
+            model=model or self.model_for(stage),
+            stage=stage,
         )
         return response.choices[0].message.content
 
-    def analyst_task(self, query, context):
-        analyst_prompt = f"""
+    async def async_call_openai(self, prompt, model=None, stage=None):
+        response = await self.gateway.async_chat_completion(
+            messages=self._messages(prompt),
+            model=model or self.model_for(stage),
+            stage=stage,
+        )
+        return response.choices[0].message.content
+
+    async def async_stream_openai(self, prompt, stage="leader"):
+        async for delta in self.gateway.async_stream_chat_completion(
+            messages=self._messages(prompt),
+            model=self.model_for(stage),
+            stage=stage,
+        ):
+            yield delta
+
+    def _render_context(self, context):
+        if self.session is not None:
+            context = self.session.compact(context)
+        return render_chunks(context) if isinstance(context, list) else context
+
+    def _leader_context(self, context):
+        if self.packer is not None:
+            context = self.packer.pack(context)
+        return self._render_context(context)
+
+    async def _async_leader_context(self, context):
+        if self.packer is not None:
+            context = await self.packer.async_pack(context)
+        return self._render_context(context)
+
+    def _memory(self):
+        summary = self.session.summary() if self.session is not None else ""
+        if not summary:
+            return ""
+        return f"Earlier in this conversation ([chunk <id>] marks context already discussed there):\n{summary}\n"
+
+    def _analyst_prompt(self, query, context):
+        return f"""
         You are an Analyst. Your task is to analyze the following query using the provided document context:
 
         Query: {query}
@@ -36,12 +115,18 @@ class ConversationalPipeline:
 
         Provide an informative response based on the query. If further clarification is needed, suggest a follow-up question. If no follow-up is needed, provide a conclusion.
         """
-        return self.call_openai(analyst_prompt)
 
-    def leader_task(self, response_1, response_2, query, context):
-        leader_prompt = f"""
+    def analyst_task(self, query, context):
+        return self.call_openai(self._analyst_prompt(query, context), stage="analyst")
+
+    async def async_analyst_task(self, query, context):
+        return await self.async_call_openai(self._analyst_prompt(query, context), stage="analyst")
+
+    def _leader_prompt(self, response_1, response_2, query, context):
+        return f"""
         You are the Leader. Your task is to unify and summarize the responses from Analyst 1 and Analyst 2 into a coherent final response, given the query and the context:
 
+        {self._memory()}
         Query: {query}
         Context: {context}
 
@@ -50,12 +135,46 @@ class ConversationalPipeline:
 
         Provide the unified response below.
         """
-        return self.call_openai(leader_prompt)
 
+    def leader_task(self, response_1, response_2, query, context):
+        return self.call_openai(self._leader_prompt(response_1, response_2, query, self._leader_context(context)), stage="leader")
+
+    async def _async_lead(self, prompt, on_token=None):
+        if on_token is None:
+            return await self.async_call_openai(prompt, stage="leader")
+        # Stream the unified answer so the caller can forward it token by token.
+        parts = []
+        async for delta in self.async_stream_openai(prompt):
+            parts.append(delta)
+            await on_token(delta)
+        return "".join(parts)
+
+    async def async_leader_task(self, response_1, response_2, query, context, on_token=None):
+        prompt = self._leader_prompt(response_1, response_2, query, await self._async_leader_context(context))
+        return await self._async_lead(prompt, on_token)
+
+    def _multi_leader_prompt(self, responses, query, context):
+        analyses = "\n".join(f"        Analyst {i} Response: {response}" for i, response in enumerate(responses, start=1))
+        return f"""
+        You are the Leader. Your task is to unify and summarize the responses of the Analysts into a coherent final response, given the query and the context:
+
+        {self._memory()}
+        Query: {query}
+        Context: {context}
 
+{analyses}
 
-    def check_follow_up(self, query, context, final_response):
-        follow_up_prompt = f"""
+        Provide the unified response below.
+        """
+
+    async def async_multi_leader_task(self, responses, query, context, on_token=None):
+        prompt = self._multi_leader_prompt(responses, query, await self._async_leader_context(context))
+        return await self._async_lead(prompt, on_token)
+
+
+
+    def _follow_up_prompt(self, query, context, final_response):
+        return f"""
         Based on the provided query, context, and final response, determine if the query has been fully answered.
 
         Query: {query}
@@ -64,11 +183,21 @@ class ConversationalPipeline:
 
         Output "Yes" if the query is fully answered, otherwise output "No."
         """
-        return self.call_openai(follow_up_prompt).strip()
 
-    def divide_correct_task_into_subtasks(self, query, context):
+    def check_follow_up(self, query, context, final_response):
+        return self.call_openai(self._follow_up_prompt(query, self._leader_context(context), final_response), stage="follow_up").strip()
+
+    async def async_check_follow_up(self, query, context, final_response):
+        context = await self._async_leader_context(context)
+        response = await self.async_call_openai(self._follow_up_prompt(query, context, final_response), stage="follow_up")
+        return response.strip()
 
-        divide_prompt = f"""
+    def _split_subtasks(self, response, first, second):
+        subtask_a, subtask_b = response.split(f"{first}:")[1].split(f"{second}:")
+        return subtask_a.strip(), subtask_b.strip()
+
+    def _divide_correct_prompt(self, query, context):
+        return f"""
         The user has a query and a context. Your first task is to determine whether the query is a simple query or complex one i.e., determine whether there is a need of dividing the query into simple ones or not.
         If the query is simple, then keep the subtask1 as initial query and subtask 2 as empty, else your next task is to divide this query into two distinct subtasks that can be worked on independently.
         Subtask 1: Focuses on one fundamental aspect of the query.
@@ -89,13 +218,17 @@ class ConversationalPipeline:
         Subtask 1: [In case of simple query, keep the initial query here else in case of complex query keep the first independent subtask with clear and actionable instructions]
         Subtask 2: [In case of simple query, keep this empty else in case of complex query keep the second distinct subtask that complements the first]
         """
-        response = self.call_openai(divide_prompt)
-        subtask_1, subtask_2 = response.split("Subtask 1:")[1].split("Subtask 2:")
-        return subtask_1.strip(), subtask_2.strip()
 
-    def divide_incorrect_task_into_subtasks(self, query):
+    def divide_correct_task_into_subtasks(self, query, context):
+        response = self.call_openai(self._divide_correct_prompt(query, context), stage="decompose")
+        return self._split_subtasks(response, "Subtask 1", "Subtask 2")
+
+    async def async_divide_correct_task_into_subtasks(self, query, context):
+        response = await self.async_call_openai(self._divide_correct_prompt(query, context), stage="decompose")
+        return self._split_subtasks(response, "Subtask 1", "Subtask 2")
 
-        divide_prompt = f"""
+    def _divide_incorrect_prompt(self, query):
+        return f"""
         The user has a query. Your first task is to determine whether the query is a simple query or complex one i.e., determine whether there is a need of dividing the query into simple ones or not.
         If the query is simple, then keep the subtask1 as initial query and subtask 2 as empty, else your next task is to divide this query into two distinct subtasks that can be worked on independently.
         Subtask 1: Focuses on one fundamental aspect of the query.
@@ -115,12 +248,17 @@ class ConversationalPipeline:
         Subtask 1: [In case of simple query, keep the initial query here else in case of complex query keep the first independent subtask with clear and actionable instructions]
         Subtask 2: [In case of simple query, keep this empty else in case of complex query keep the second distinct subtask that complements the first]
         """
-        response = self.call_openai(divide_prompt)
-        subtask_1, subtask_2 = response.split("Subtask 1:")[1].split("Subtask 2:")
-        return subtask_1.strip(), subtask_2.strip()
 
-    def generate_new_subtasks(self, query, subtask_1, subtask_2, context):
-        generate_new_subtasks_prompt = f"""
+    def divide_incorrect_task_into_subtasks(self, query):
+        response = self.call_openai(self._divide_incorrect_prompt(query), stage="decompose")
+        return self._split_subtasks(response, "Subtask 1", "Subtask 2")
+
+    async def async_divide_incorrect_task_into_subtasks(self, query):
+        response = await self.async_call_openai(self._divide_incorrect_prompt(query), stage="decompose")
+        return self._split_subtasks(response, "Subtask 1", "Subtask 2")
+
+    def _generate_new_subtasks_prompt(self, query, subtask_1, subtask_2, context):
+        return f"""
         You are provided with a query, its context, and two previously defined subtasks (Subtask 1 and Subtask 2). Your task is to generate two new subtasks: Subtask 3 and Subtask 4, ensuring they are:
 
         Distinct from both Subtask 1 and Subtask 2.
@@ -142,9 +280,150 @@ class ConversationalPipeline:
         Subtask 3: [Third independent subtask, distinct from Subtask 1 and Subtask 2, focusing on a new actionable aspect of the query]
         Subtask 4: [Fourth independent subtask, distinct from Subtask 1, Subtask 2, and Subtask 3, complementing the overall solution]
         """
-        response = self.call_openai(generate_new_subtasks_prompt)
-        subtask_3, subtask_4 = response.split("Subtask 3:")[1].split("Subtask 4:")
-        return subtask_3.strip(), subtask_4.strip()
+
+    def generate_new_subtasks(self, query, subtask_1, subtask_2, context):
+        response = self.call_openai(self._generate_new_subtasks_prompt(query, subtask_1, subtask_2, context), stage="decompose")
+        return self._split_subtasks(response, "Subtask 3", "Subtask 4")
+
+    async def async_generate_new_subtasks(self, query, subtask_1, subtask_2, context):
+        response = await self.async_call_openai(self._generate_new_subtasks_prompt(query, subtask_1, subtask_2, context), stage="decompose")
+        return self._split_subtasks(response, "Subtask 3", "Subtask 4")
+
+    def _decomposition_prompt(self, query, context=None, previous=None, max_subtasks=4):
+        context_line = f'Context: "{context}"' if context is not None else ""
+        previous_lines = ""
+        if previous:
+            previous_lines = "Previous subtasks, already answered. The new subtasks must cover aspects of the query they left unexplored and must not overlap with them:\n" + "\n".join(
+                f"- {subtask['task']}" for subtask in previous
+            )
+        return f"""
+        The user has a query. Determine whether it is simple or needs to be divided into subtasks.
+        If the query is simple, return a single subtask holding the initial query.
+        Otherwise divide it into at most {max_subtasks} distinct, non-redundant, actionable subtasks that together solve the query.
+        Number the subtasks from 1. In `depends_on`, list the ids of the earlier subtasks whose answers a subtask needs before it can be worked on,
+        and leave it empty for subtasks that can be worked on independently.
+        {previous_lines}
+        Query: "{query}"
+        {context_line}
+        """
+
+    def _parse_subtasks(self, response, query, max_subtasks=4):
+        """
+        Validates a structured decomposition. Subtasks may only depend on subtasks listed
+        before them, so the dependencies never form a cycle. A response that is not valid
+        JSON falls back to answering the query as a single subtask.
+        """
+        try:
+            items = json.loads(response)["subtasks"]
+        except (TypeError, ValueError, KeyError):
+            items = []
+        subtasks, ids = [], set()
+        for item in items[:max_subtasks]:
+            if not isinstance(item, dict) or not str(item.get("task", "")).strip() or item.get("id") in ids:
+                continue
+            depends_on = [d for d in item.get("depends_on") or [] if d in ids]
+            subtasks.append({"id": item["id"], "task": str(item["task"]).strip(), "depends_on": depends_on})
+            ids.add(item["id"])
+        return subtasks or [{"id": 1, "task": query, "depends_on": []}]
+
+    def _decomposition_request(self, query, context, previous, max_subtasks):
+        return {
+            "model": self.model_for("decompose"),
+            "stage": "decompose",
+            "messages": self._messages(self._decomposition_prompt(query, context, previous, max_subtasks)),
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "decomposition", "strict": True, "schema": SUBTASK_SCHEMA},
+            },
+        }
+
+    def decompose(self, query, context=None, previous=None, max_subtasks=4):
+        """
+        Structured alternative to the `divide_*` and `generate_new_subtasks` methods.
+
+        Args:
+            query (str): The user's query.
+            context (list): Retrieved chunks, if they are relevant to the query.
+            previous (list): Subtasks of an earlier round the new ones must not repeat.
+            max_subtasks (int): Upper bound on the number of subtasks.
+
+        Returns:
+            list: Subtask dicts with `id`, `task` and `depends_on` (ids of earlier subtasks).
+        """
+        response = self.gateway.chat_completion(**self._decomposition_request(query, context, previous, max_subtasks))
+        return self._parse_subtasks(response.choices[0].message.content, query, max_subtasks)
+
+    async def async_decompose(self, query, context=None, previous=None, max_subtasks=4):
+        response = await self.gateway.async_chat_completion(**self._decomposition_request(query, context, previous, max_subtasks))
+        return self._parse_subtasks(response.choices[0].message.content, query, max_subtasks)
+
+    async def async_analyse_subtasks(self, subtasks, retrieve, pool=None, tenant="default", deadline=None):
+        """
+        Retrieves context for and analyses any number of structured subtasks. Each
+        subtask starts as soon as the subtasks it depends on are finished and sees
+        their analyses; independent subtasks run concurrently, bounded by `pool`.
+
+        A subtask still running at `deadline` is cancelled, and subtasks that fail or
+        time out are left out, so the leader works with the analyses that made it.
+
+        Args:
+            subtasks (list): Subtasks from `decompose`.
+            retrieve (coroutine function): Returns the context of one subtask.
+            pool (AnalystPool): Worker pool with per-stage timeouts and per-tenant limits.
+                Without it all ready subtasks run at once, without timeouts.
+            tenant (str): Tenant whose pool slots the subtasks use.
+            deadline (float): Seconds after which unfinished subtasks are abandoned.
+
+        Returns:
+            tuple: The analyses that completed, in subtask order, and the retrieved context.
+        """
+        tasks = {}
+
+        def result_of(subtask_id):
+            task = tasks[subtask_id]
+            if not task.done() or task.cancelled() or task.exception() is not None:
+                return None
+            return task.result()
+
+        async def run(subtask):
+            dependencies = [tasks[d] for d in subtask["depends_on"] if d in tasks]
+            if dependencies:
+                await asyncio.wait(dependencies)
+            findings = []
+            for task in subtasks:
+                result = result_of(task["id"]) if task["id"] in subtask["depends_on"] else None
+                if result is not None and result["analysis"] is not None:
+                    findings.append(f"Answer to \"{task['task']}\": {result['analysis']}")
+
+            async def analyse(subtask_context):
+                return await self.async_analyst_task(subtask["task"], list(subtask_context) + findings)
+
+            if pool is None:
+                subtask_context = await retrieve(subtask["task"])
+                return {"context": subtask_context, "analysis": await analyse(subtask_context)}
+            return await pool.run(tenant, lambda: retrieve(subtask["task"]), analyse)
+
+        # Subtasks only depend on earlier ones, so their dependencies' tasks already exist.
+        for subtask in subtasks:
+            tasks[subtask["id"]] = asyncio.create_task(run(subtask))
+        try:
+            await asyncio.wait(tasks.values(), timeout=deadline)
+        finally:
+            pending = [task for task in tasks.values() if not task.done()]
+            for task in pending:
+                task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+        analyses, context = [], []
+        for subtask in subtasks:
+            result = result_of(subtask["id"])
+            if result is None:
+                continue
+            context.extend(result["context"])
+            if result["analysis"] is not None:
+                analyses.append(result["analysis"])
+        return analyses, context
 
     def run_pipeline(self, query, context_a, context_b, subtask_1, subtask_2):
 
@@ -155,10 +434,22 @@ class ConversationalPipeline:
 
         return final_response
 
-    def final_unification_task(self, combined_response, response_3, response_4, query, context):
-        unification_prompt = f"""
+    async def async_run_pipeline(self, query, context_a, context_b, subtask_1, subtask_2, on_token=None):
+        # The two analysts are independent, so they run concurrently.
+        response_1, response_2 = await asyncio.gather(
+            self.async_analyst_task(subtask_1, context_a),
+            self.async_analyst_task(subtask_2, context_b),
+        )
+
+        final_response = await self.async_leader_task(response_1, response_2, query, context_a + context_b, on_token=on_token)
+
+        return final_response
+
+    def _unification_prompt(self, combined_response, response_3, response_4, query, context):
+        return f"""
         You are the Leader. Your task is to unify and summarize all three analyst responses into a single, coherent, and comprehensive final response, given the query and the context:
 
+        {self._memory()}
         query: {query}
         context: {context}
 
@@ -168,7 +459,32 @@ class ConversationalPipeline:
 
         Provide the unified response below, ensuring clarity, accuracy, and coherence.
         """
-        return self.call_openai(unification_prompt)
+
+    def _multi_unification_prompt(self, combined_response, responses, query, context):
+        analyses = "\n".join(f"        Follow-up Analyst {i} Response: {response}" for i, response in enumerate(responses, start=1))
+        return f"""
+        You are the Leader. Your task is to unify and summarize the earlier combined response and the follow-up analyst responses into a single, coherent, and comprehensive final response, given the query and the context:
+
+        {self._memory()}
+        query: {query}
+        context: {context}
+
+        Combined Response: {combined_response}
+{analyses}
+
+        Provide the unified response below, ensuring clarity, accuracy, and coherence.
+        """
+
+    async def async_multi_unification_task(self, combined_response, responses, query, context):
+        context = await self._async_leader_context(context)
+        return await self.async_call_openai(self._multi_unification_prompt(combined_response, responses, query, context), stage="unification")
+
+    def final_unification_task(self, combined_response, response_3, response_4, query, context):
+        return self.call_openai(self._unification_prompt(combined_response, response_3, response_4, query, self._leader_context(context)), stage="unification")
+
+    async def async_final_unification_task(self, combined_response, response_3, response_4, query, context):
+        context = await self._async_leader_context(context)
+        return await self.async_call_openai(self._unification_prompt(combined_response, response_3, response_4, query, context), stage="unification")
 
 
     def run_pipeline_if_needed(self, query, context_c, context_d, subtask_3, subtask_4, final_response, context):
@@ -181,8 +497,18 @@ class ConversationalPipeline:
         context.extend(context_d)
 
 
-        final_follow_up_response = self.final_unification_task(final_response, response_3, response_4, query, context)
-        # final_response = f"{final_response}\n\nFollow-up Response:\n{final_follow_up_response}"
+        # The unified answer covers the first round too, it replaces the earlier answer.
+        return self.final_unification_task(final_response, response_3, response_4, query, context)
 
-        return final_response
+    async def async_run_pipeline_if_needed(self, query, context_c, context_d, subtask_3, subtask_4, final_response, context):
+
+        response_3, response_4 = await asyncio.gather(
+            self.async_analyst_task(subtask_3, context_c),
+            self.async_analyst_task(subtask_4, context_d),
+        )
+
+        context.extend(context_c)
+        context.extend(context_d)
 
+        # The unified answer covers the first round too, it replaces the earlier answer.
+        return await self.async_final_unification_task(final_response, response_3, response_4, query, context)
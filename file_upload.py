@@ -1,21 +1,385 @@
 # file_upload.py
-from fastapi import APIRouter, File, UploadFile, HTTPException
-import shutil
+from fastapi import APIRouter, File, UploadFile, HTTPException, Request
+from pydantic import BaseModel
+from ingestion import tracker, ContentManifest
+from typing import List
+import asyncio
+import hashlib
+import json
 import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
 
 router = APIRouter()
 UPLOAD_DIR = "/app/data"
+# Uploads are assembled here and renamed into UPLOAD_DIR once complete, so the
+# Pathway watcher never sees a half-written file. It must be on the same
+# filesystem as UPLOAD_DIR for the rename to be atomic, and outside of it.
+UPLOAD_TMP_DIR = "/app/.uploads"
+UPLOAD_MANIFEST = os.path.join(UPLOAD_TMP_DIR, "manifest.json")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_PART_SIZE = 64 * 1024 * 1024
+UPLOAD_MAX_PARTS = 10000
+# Resumable sessions, and temp files of interrupted requests, untouched for this
+# long are removed; the sweep runs at most every UPLOAD_SWEEP_INTERVAL seconds.
+UPLOAD_SESSION_TTL = 24 * 3600
+UPLOAD_SWEEP_INTERVAL = 600
+# Guards against archive bombs in bulk uploads.
+ARCHIVE_MAX_MEMBERS = 10000
+ARCHIVE_MAX_BYTES = 8 * 1024 * 1024 * 1024
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+# Content hashes of UPLOAD_DIR, so byte-identical documents are parsed and embedded once.
+manifest = ContentManifest(UPLOAD_DIR, UPLOAD_MANIFEST)
+
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+
+
+def safe_filename(filename):
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    if name in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    return name
+
+
+def publish(temp_path, filename, digest, save=True, replace=True):
+    name, duplicate = manifest.publish(temp_path, filename, digest, save=save, replace=replace)
+    ticket = tracker.create(name, os.path.join(UPLOAD_DIR, name))
+    result = {"filename": filename, "status": "duplicate" if duplicate else "uploaded", "ticket": ticket["ticket"]}
+    if duplicate:
+        result["duplicate_of"] = name
+    elif name != filename:
+        result["stored_as"] = name
+    return result
+
+
+def write_hashed(out, digest, data):
+    out.write(data)
+    digest.update(data)
+
+
+async def write_stream(chunks, path, max_size=None):
+    """
+    Writes an async iterable of byte chunks to path, hashing and writing off the event loop.
+
+    Returns:
+        tuple: Number of bytes written and their sha256 hex digest.
+    """
+    size = 0
+    buffer = bytearray()
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        async for chunk in chunks:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise HTTPException(status_code=413, detail="Part too large")
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(write_hashed, out, digest, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(write_hashed, out, digest, bytes(buffer))
+    return size, digest.hexdigest()
+
+
+def copy_hashed(src, path, max_size=None):
+    size = 0
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise HTTPException(status_code=413, detail="Archive too large")
+            write_hashed(out, digest, chunk)
+    return size, digest.hexdigest()
+
+
+def temp_file():
+    fd, temp_path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, suffix=".upload")
+    os.close(fd)
+    return temp_path
+
+
+async def read_upload(file):
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
 
 @router.post("/api/v1/users/uploadDocument")
-def upload_document(file: UploadFile = File(...)):
+async def upload_document(file: UploadFile = File(...)):
+    filename = safe_filename(file.filename)
+    temp_path = temp_file()
     try:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, 'wb') as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        return {"filename": file.filename, "status": "uploaded"}
+        size, digest = await write_stream(read_upload(file), temp_path)
+        return await asyncio.to_thread(publish, temp_path, filename, digest)
+    except HTTPException:
+        raise
     except Exception:
         raise HTTPException(status_code=500, detail="Something went wrong")
     finally:
-        file.file.close()
\ No newline at end of file
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        await file.close()
+
+
+# Resumable uploads: create a session, PUT the parts in any order (re-sending a
+# part replaces it), then complete the session to assemble and publish the file.
+# Sessions that are neither completed nor aborted expire after UPLOAD_SESSION_TTL.
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def sweep_uploads(ttl=UPLOAD_SESSION_TTL):
+    """
+    Removes resumable sessions with no new part for `ttl` seconds, and temp files
+    left behind by interrupted requests.
+
+    Returns:
+        int: Number of sessions and files removed.
+    """
+    cutoff = time.time() - ttl
+    removed = 0
+    for name in os.listdir(UPLOAD_TMP_DIR):
+        path = os.path.join(UPLOAD_TMP_DIR, name)
+        try:
+            # A part is renamed into its session directory when complete, which touches it.
+            if os.stat(path).st_mtime > cutoff:
+                continue
+            if UPLOAD_ID.match(name) and os.path.isdir(path):
+                shutil.rmtree(path)
+            elif name.endswith(".upload"):
+                os.remove(path)
+            else:
+                continue
+        except OSError:
+            continue
+        removed += 1
+    return removed
+
+
+def maybe_sweep_uploads():
+    global _last_sweep
+    with _sweep_lock:
+        if time.monotonic() - _last_sweep < UPLOAD_SWEEP_INTERVAL:
+            return
+        _last_sweep = time.monotonic()
+    sweep_uploads()
+
+
+def session_dir(upload_id):
+    if not UPLOAD_ID.match(upload_id):
+        raise HTTPException(status_code=404, detail="Unknown upload")
+    path = os.path.join(UPLOAD_TMP_DIR, upload_id)
+    if not os.path.isdir(path):
+        raise HTTPException(status_code=404, detail="Unknown upload")
+    return path
+
+
+def session_parts(path):
+    parts = {}
+    for name in os.listdir(path):
+        if name.endswith(".part"):
+            parts[int(name[:-len(".part")])] = os.path.getsize(os.path.join(path, name))
+    return dict(sorted(parts.items()))
+
+
+def session_info(upload_id, path):
+    with open(os.path.join(path, "session.json")) as f:
+        session = json.load(f)
+    parts = session_parts(path)
+    session.update(
+        upload_id=upload_id,
+        part_size=UPLOAD_PART_SIZE,
+        parts=[{"part_number": number, "size": size} for number, size in parts.items()],
+        received=sum(parts.values()),
+    )
+    return session
+
+
+def assemble(path, filename):
+    parts = session_parts(path)
+    if not parts:
+        raise HTTPException(status_code=400, detail="No parts uploaded")
+    if list(parts) != list(range(1, len(parts) + 1)):
+        raise HTTPException(status_code=400, detail="Missing parts")
+    temp_path = os.path.join(path, "assembled")
+    digest = hashlib.sha256()
+    with open(temp_path, "wb") as out:
+        for number in parts:
+            with open(os.path.join(path, f"{number}.part"), "rb") as part:
+                for chunk in iter(lambda: part.read(UPLOAD_CHUNK_SIZE), b""):
+                    write_hashed(out, digest, chunk)
+    result = publish(temp_path, filename, digest.hexdigest())
+    shutil.rmtree(path, ignore_errors=True)
+    return result
+
+
+@router.post("/api/v1/uploads")
+async def create_upload(request: UploadSessionRequest):
+    filename = safe_filename(request.filename)
+    await asyncio.to_thread(maybe_sweep_uploads)
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(UPLOAD_TMP_DIR, upload_id)
+    os.makedirs(path)
+    with open(os.path.join(path, "session.json"), "w") as f:
+        json.dump({"filename": filename}, f)
+    return session_info(upload_id, path)
+
+
+@router.get("/api/v1/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    return session_info(upload_id, session_dir(upload_id))
+
+
+@router.put("/api/v1/uploads/{upload_id}/parts/{part_number}")
+async def upload_part(upload_id: str, part_number: int, request: Request):
+    path = session_dir(upload_id)
+    if not 1 <= part_number <= UPLOAD_MAX_PARTS:
+        raise HTTPException(status_code=400, detail="Invalid part number")
+    part_path = os.path.join(path, f"{part_number}.part")
+    # Written under a temporary name so an interrupted part is never taken as received.
+    partial_path = f"{part_path}.{uuid.uuid4().hex}"
+    try:
+        size, digest = await write_stream(request.stream(), partial_path, UPLOAD_MAX_PART_SIZE)
+        os.replace(partial_path, part_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return {"upload_id": upload_id, "part_number": part_number, "size": size, "sha256": digest}
+
+
+@router.post("/api/v1/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str):
+    path = session_dir(upload_id)
+    session = session_info(upload_id, path)
+    return await asyncio.to_thread(assemble, path, session["filename"])
+
+
+@router.delete("/api/v1/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    shutil.rmtree(session_dir(upload_id), ignore_errors=True)
+    return {"upload_id": upload_id, "status": "aborted"}
+
+
+# Bulk ingestion: many files and/or zip and tar archives in one request. Every
+# file goes through the content manifest, so duplicates never reach UPLOAD_DIR.
+
+def member_filename(name):
+    # Archive paths are flattened, a/b/report.pdf becomes a_b_report.pdf.
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    if not parts or any(part.startswith(".") or part == "__MACOSX" for part in parts):
+        return None
+    return "_".join(parts)
+
+
+def archive_members(fileobj, name):
+    """
+    Yields (filename, file object) for the regular files of a zip or tar archive.
+    """
+    if name.lower().endswith(".zip"):
+        with zipfile.ZipFile(fileobj) as archive:
+            infos = [info for info in archive.infolist() if not info.is_dir()]
+            if len(infos) > ARCHIVE_MAX_MEMBERS:
+                raise HTTPException(status_code=413, detail="Too many files in archive")
+            for info in infos:
+                with archive.open(info) as member:
+                    yield info.filename, member
+    else:
+        with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+            count = 0
+            for info in archive:
+                if not info.isfile():
+                    continue
+                count += 1
+                if count > ARCHIVE_MAX_MEMBERS:
+                    raise HTTPException(status_code=413, detail="Too many files in archive")
+                yield info.name, archive.extractfile(info)
+
+
+def ingest_archive(fileobj, name, results):
+    # Appends to `results` as it goes, so members published before a failure are still reported.
+    remaining = ARCHIVE_MAX_BYTES
+    for member_name, member in archive_members(fileobj, name):
+        filename = member_filename(member_name)
+        if filename is None:
+            continue
+        temp_path = temp_file()
+        try:
+            size, digest = copy_hashed(member, temp_path, remaining)
+            remaining -= size
+            results.append(publish(temp_path, filename, digest, save=False, replace=False))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+async def ingest_file(file, results):
+    filename = safe_filename(file.filename)
+    if filename.lower().endswith(ARCHIVE_SUFFIXES):
+        await asyncio.to_thread(ingest_archive, file.file, filename, results)
+        return
+    temp_path = temp_file()
+    try:
+        size, digest = await write_stream(read_upload(file), temp_path)
+        # A different document under a name already in use is kept next to it, not over it.
+        results.append(await asyncio.to_thread(publish, temp_path, filename, digest, False, False))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+@router.post("/api/v1/users/uploadDocuments")
+async def upload_documents(files: List[UploadFile] = File(...)):
+    # One failing file or archive is reported in its own result and does not fail the batch.
+    results = []
+    try:
+        for file in files:
+            try:
+                await ingest_file(file, results)
+            except HTTPException as e:
+                results.append({"filename": file.filename, "status": "failed", "error": e.detail})
+            except (zipfile.BadZipFile, tarfile.TarError):
+                results.append({"filename": file.filename, "status": "failed", "error": "Invalid archive"})
+            except Exception:
+                results.append({"filename": file.filename, "status": "failed", "error": "Something went wrong"})
+    finally:
+        await asyncio.to_thread(manifest.save)
+        for file in files:
+            await file.close()
+    return {
+        "files": results,
+        "uploaded": sum(result["status"] == "uploaded" for result in results),
+        "duplicates": sum(result["status"] == "duplicate" for result in results),
+        "failed": sum(result["status"] == "failed" for result in results),
+    }
+
+
+@router.get("/api/v1/ingestion/stats")
+async def ingestion_stats():
+    return manifest.stats()
+
+
+@router.get("/api/v1/ingestion/{ticket_id}")
+async def ingestion_status(ticket_id: str):
+    ticket = await asyncio.to_thread(tracker.get, ticket_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Unknown ticket")
+    return ticket
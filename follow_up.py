@@ -0,0 +1,218 @@
+import math
+import re
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from keyword_index import tokenize
+from llm_gateway import get_gateway
+
+# Phrases with which analysts and the leader admit the context did not cover something.
+GAP = re.compile(
+    r"\b(?:not (?:provided|available|mentioned|included|specified|found|disclosed)"
+    r"|no (?:information|data|details|mention)"
+    r"|(?:does|do|did) not (?:contain|include|provide|mention|specify|cover)"
+    r"|insufficient|unable to (?:determine|find|answer|provide)|cannot be determined"
+    r"|further (?:clarification|information|research|analysis|details)|follow-up question"
+    r"|more (?:information|data|context|details) (?:is|are|would be) (?:needed|required))\b",
+    re.IGNORECASE,
+)
+STOPWORDS = set(
+    "the a an and or of in on for to from by with what which who whom how why when where is are was were "
+    "be been do does did can could should would will about as at its it this that these those their"
+    " there than then vs versus between compare".split()
+)
+
+POSSESSIVE = re.compile(r"['\u2019]s?$")
+PARTS = re.compile(r"[.,/&'\u2019-]")
+QUARTERS = {"first": "q1", "second": "q2", "third": "q3", "fourth": "q4"}
+
+
+def terms(text: str) -> set:
+    """
+    Returns:
+        set: The tokens of the text with possessives dropped ("tesla's" -> "tesla"),
+            "$" and "%" stripped, and compounds also split into their parts
+            ("year-over-year" -> "year", "over"), plurals reduced to their singular
+            and "third" also read as "q3", so a query and its answer match.
+    """
+    found = set()
+    for token in tokenize(text.replace("\u2019", "'")):
+        token = POSSESSIVE.sub("", token.strip("$%"))
+        for part in {token, *PARTS.split(token)}:
+            if not part:
+                continue
+            if len(part) > 3 and part.endswith("s") and not part.endswith("ss"):
+                part = part[:-1]
+            found.add(part)
+            if part in QUARTERS:
+                found.add(QUARTERS[part])
+    return found
+
+
+class FollowUpDecision(NamedTuple):
+    needs_follow_up: bool
+    confidence: float
+    source: str
+
+
+class FollowUpDecider:
+    """
+    Decides whether the leader's answer leaves the query open and a second
+    analyst round is needed.
+
+    A local classifier scores the answer and the analyses: gap phrases, analyses
+    that did not finish, query terms the answer never mentions, and a very short
+    answer. Only when its probability lies between `low` and `high` is a small
+    model asked, with its answer-token probability as the confidence. It also
+    records how often a second round actually changes the answer.
+    """
+
+    def __init__(self, openai_api_key: str, model: str = "gpt-4o-mini", low: float = 0.2, high: float = 0.8,
+                 changed_below: float = 0.8):
+        """
+        Args:
+            openai_api_key (str): Key of the small model.
+            model (str): Model asked when the local score is ambiguous.
+            low (float): Probabilities at or below it decide "fully answered" locally.
+            high (float): Probabilities at or above it decide "needs a second round" locally.
+            changed_below (float): Token overlap (Jaccard) under which a second round
+                counts as having changed the answer.
+        """
+        self.gateway = get_gateway(openai_api_key)
+        self.model = model
+        self.low = low
+        self.high = high
+        self.changed_below = changed_below
+        self._lock = threading.Lock()
+        self._counters = {
+            "decisions": 0,
+            "local": 0,
+            "model": 0,
+            "follow_ups": 0,
+            "confidence_total": 0.0,
+            "model_seconds": 0.0,
+            "second_rounds": 0,
+            "changed": 0,
+            "similarity_total": 0.0,
+        }
+        # [second rounds, changed answers] per decision source; "leader" is the legacy leader check.
+        self._changed_by_source = {"local": [0, 0], "model": [0, 0], "leader": [0, 0]}
+
+    def score(self, query: str, final_response: str, analyses: Optional[List[str]] = None,
+              expected_analyses: Optional[int] = None) -> float:
+        """
+        Returns:
+            float: Probability that the answer leaves the query open.
+        """
+        gaps = len(GAP.findall(final_response)) + sum(len(GAP.findall(analysis)) for analysis in analyses or [])
+        missing = max(0, (expected_analyses or 0) - len(analyses or []))
+        asked = {term for term in terms(query) if len(term) > 2 and term not in STOPWORDS}
+        coverage = len(asked & terms(final_response)) / len(asked) if asked else 1.0
+        short = len(final_response.split()) < 30
+        # Calibrated so a complete answer, short or not, scores under the default `low`.
+        z = -3.0 + 1.5 * min(gaps, 3) + 1.5 * missing + 3.0 * (1 - coverage) + 0.5 * short
+        return 1 / (1 + math.exp(-z))
+
+    def _messages(self, query: str, final_response: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": "You check whether an answer fully answers a question. Reply with one word: yes or no."},
+            {"role": "user", "content": f"Question: {query}\n\nAnswer: {final_response}\n\nDoes the answer fully answer the question?"},
+        ]
+
+    async def _ask_model(self, query: str, final_response: str) -> FollowUpDecision:
+        started = time.perf_counter()
+        response = await self.gateway.async_chat_completion(
+            model=self.model,
+            stage="follow_up",
+            messages=self._messages(query, final_response),
+            max_tokens=1,
+            temperature=0,
+            logprobs=True,
+            top_logprobs=5,
+        )
+        with self._lock:
+            self._counters["model_seconds"] += time.perf_counter() - started
+        choice = response.choices[0]
+        verdict = choice.message.content.strip().lower()
+        confidence = 0.5
+        logprobs = getattr(choice, "logprobs", None)
+        if logprobs is not None and logprobs.content:
+            # Probability mass of "yes" against "no" among the top answer tokens.
+            mass = {"yes": 0.0, "no": 0.0}
+            for candidate in logprobs.content[0].top_logprobs:
+                token = candidate.token.strip().lower()
+                if token in mass:
+                    mass[token] += math.exp(candidate.logprob)
+            if sum(mass.values()):
+                confidence = max(mass.values()) / sum(mass.values())
+        return FollowUpDecision(not verdict.startswith("yes"), confidence, "model")
+
+    async def decide(self, query: str, final_response: str, analyses: Optional[List[str]] = None,
+                     expected_analyses: Optional[int] = None) -> FollowUpDecision:
+        """
+        Args:
+            query (str): The user's question.
+            final_response (str): The leader's answer.
+            analyses (list): The analyst responses the answer was built from, if known.
+            expected_analyses (int): How many analyses were asked for.
+
+        Returns:
+            FollowUpDecision: Whether a second round is needed, the confidence of that
+                decision and whether it was made locally or by the model.
+        """
+        probability = self.score(query, final_response, analyses, expected_analyses)
+        if probability <= self.low or probability >= self.high:
+            decision = FollowUpDecision(probability >= self.high, max(probability, 1 - probability), "local")
+        else:
+            decision = await self._ask_model(query, final_response)
+        with self._lock:
+            self._counters["decisions"] += 1
+            self._counters[decision.source] += 1
+            self._counters["follow_ups"] += decision.needs_follow_up
+            self._counters["confidence_total"] += decision.confidence
+        return decision
+
+    def record_second_round(self, decision: FollowUpDecision, before: str, after: str) -> bool:
+        """
+        Records whether a second round changed the answer.
+
+        Returns:
+            bool: Whether the token overlap of the two answers is under `changed_below`.
+        """
+        before_terms, after_terms = terms(before), terms(after)
+        union = before_terms | after_terms
+        similarity = len(before_terms & after_terms) / len(union) if union else 1.0
+        changed = similarity < self.changed_below
+        with self._lock:
+            self._counters["second_rounds"] += 1
+            self._counters["changed"] += changed
+            self._counters["similarity_total"] += similarity
+            self._changed_by_source[decision.source][0] += 1
+            self._changed_by_source[decision.source][1] += changed
+        return changed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Decisions by source, the follow-up rate, mean confidence, mean model
+                latency in ms and, per source, how often a second round changed the answer.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            by_source = {source: list(values) for source, values in self._changed_by_source.items()}
+        decisions, rounds = counters["decisions"], counters["second_rounds"]
+        return {
+            "decisions": decisions,
+            "local": counters["local"],
+            "model": counters["model"],
+            "follow_up_rate": counters["follow_ups"] / decisions if decisions else 0.0,
+            "mean_confidence": counters["confidence_total"] / decisions if decisions else 0.0,
+            "model_ms": 1000 * counters["model_seconds"] / counters["model"] if counters["model"] else 0.0,
+            "second_rounds": rounds,
+            "changed_rate": counters["changed"] / rounds if rounds else 0.0,
+            "mean_similarity": counters["similarity_total"] / rounds if rounds else 0.0,
+            "changed_rate_by_source": {
+                source: changed / total if total else 0.0 for source, (total, changed) in by_source.items()
+            },
+        }
@@ -1,29 +1,209 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
 import openai
-from openai import OpenAI
+from llm_gateway import get_gateway
 
 class grade_doc:
   def __init__(self, openai_api_key: str, model="gpt-4"):
         openai.api_key = openai_api_key
         self.api_key = openai_api_key
-        self.client = OpenAI(api_key=self.api_key)
+        self.gateway = get_gateway(self.api_key)
         self.model = model
         self.grade_msg = f"""You are a grader assessing relevance of a retrieved document to a user question. \n
         If the document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
         It does not need to be a stringent test. The goal is to filter out erroneous retrievals. \n
         Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question."""
 
-  def grade_document(self, query, context):
+  def _grade_messages(self, query, context):
         prompt = f"""
         User Question : {query}
         Document : {context}"""
+        return [
+            {"role": "system", "content": self.grade_msg},
+            {"role": "user", "content": prompt}
+        ]
+
+  def grade_document(self, query, context, model=None):
+        response = self.gateway.chat_completion(
+            model=model or self.model,
+            stage="grade",
+            messages=self._grade_messages(query, context)
+        )
+        score = response.choices[0].message.content.strip().lower()
+        return score
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": self.grade_msg},
-                {"role": "user", "content": prompt}
-            ]
+  async def async_grade_document(self, query, context, model=None):
+        response = await self.gateway.async_chat_completion(
+            model=model or self.model,
+            stage="grade",
+            messages=self._grade_messages(query, context)
         )
         score = response.choices[0].message.content.strip().lower()
         return score
 
+
+class SimilarityGrader:
+  """
+  Grades retrieved chunks on CPU by the cosine similarity between the question
+  embedding and the chunk embeddings, and asks the LLM grader only when the
+  best score falls between the `low` and `high` thresholds.
+
+  Every LLM verdict is kept as a calibration sample. Until thresholds are set
+  (or calibrated from `min_samples` verdicts) every question is escalated, so
+  grading starts out exactly like the LLM grader.
+  """
+
+  def __init__(self, llm_grader, embed_query, embed_chunks, low=None, high=None,
+               target_precision=0.95, min_samples=50, max_samples=2000, reference_model="gpt-4"):
+        """
+        Args:
+            llm_grader (grade_doc): Grader used for ambiguous scores.
+            embed_query (coroutine function): Returns the embedding of a question.
+            embed_chunks (coroutine function): Returns the embeddings of a list of chunk texts.
+            low (float): Best scores at or below it are graded "no".
+            high (float): Best scores at or above it are graded "yes".
+            target_precision (float): Precision the calibrated thresholds must reach on the samples.
+            min_samples (int): LLM verdicts needed before calibrating.
+            reference_model (str): Model `benchmark` measures the local verdicts against.
+        """
+        self.llm_grader = llm_grader
+        self.embed_query = embed_query
+        self.embed_chunks = embed_chunks
+        self.low = low
+        self.high = high
+        self.target_precision = target_precision
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=max_samples)
+        self.recent = deque(maxlen=200)
+        self.reference_model = reference_model
+        self.calibrated = low is not None and high is not None
+        self._counters = {"local_yes": 0, "local_no": 0, "escalated": 0}
+
+  async def score(self, query, context):
+        """
+        Returns:
+            float: Best cosine similarity between the question and the chunks.
+        """
+        query_vector, chunk_vectors = await asyncio.gather(self.embed_query(query), self.embed_chunks(list(context)))
+        if not len(chunk_vectors):
+            return 0.0
+        matrix = np.asarray(chunk_vectors, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) + 1e-12
+        return float(np.max(matrix @ query_vector))
+
+  def local_verdict(self, score):
+        """
+        Returns:
+            str: "yes" or "no", or None when the score is ambiguous.
+        """
+        if self.high is not None and score >= self.high:
+            return "yes"
+        if self.low is not None and score <= self.low:
+            return "no"
+        return None
+
+  def calibrate(self):
+        """
+        Sets `high` to the lowest score above which the LLM said "yes" with the target
+        precision, and `low` to the highest score below which it said "no" likewise.
+        """
+        if len(self.samples) < self.min_samples:
+            return
+        scores = np.array([score for score, _ in self.samples])
+        labels = np.array([verdict == "yes" for _, verdict in self.samples], dtype=float)
+        order = np.argsort(scores)
+        scores, labels = scores[order], labels[order]
+        min_side = max(5, self.min_samples // 5)
+        # Precision of "yes" for the suffix starting at i and of "no" for the prefix ending at i.
+        yes_precision = np.cumsum(labels[::-1])[::-1] / np.arange(len(labels), 0, -1)
+        no_precision = np.cumsum(1 - labels) / np.arange(1, len(labels) + 1)
+        high = [i for i in range(len(scores) - min_side + 1) if yes_precision[i] >= self.target_precision]
+        if not high:
+            return
+        # Start the "yes" band on a "yes" sample and the "no" band below it on a "no" sample.
+        high = high[0]
+        while not labels[high]:
+            high += 1
+        low = [i for i in range(min_side - 1, high) if no_precision[i] >= self.target_precision]
+        if not low:
+            return
+        low = low[-1]
+        while labels[low]:
+            low -= 1
+        low, high = float(scores[low]), float(scores[high])
+        if low >= high:
+            return
+        self.low, self.high, self.calibrated = low, high, True
+
+  async def async_grade_document(self, query, context, model=None):
+        score = await self.score(query, context)
+        self.recent.append((query, list(context)))
+        verdict = self.local_verdict(score)
+        if verdict is not None:
+            self._counters["local_" + verdict] += 1
+            return verdict
+        self._counters["escalated"] += 1
+        verdict = await self.llm_grader.async_grade_document(query, context, model)
+        self.samples.append((score, "yes" if verdict.lower().startswith("yes") else "no"))
+        if not self.calibrated:
+            self.calibrate()
+        return verdict
+
+  async def benchmark(self, samples=50, model=None):
+        """
+        Grades recent questions with both graders.
+
+        Args:
+            samples (int): Recent questions to grade.
+            model (str): Model of the LLM verdicts, `reference_model` by default.
+
+        Returns:
+            dict: Agreement of the local verdicts with the LLM, the share decided locally,
+                mean latencies in ms and the model and thresholds they were measured with.
+        """
+        model = model or self.reference_model
+        pairs = list(self.recent)[-samples:]
+        agree, decided, local_time, llm_time = 0, 0, 0.0, 0.0
+        for query, context in pairs:
+            started = time.perf_counter()
+            score = await self.score(query, context)
+            local_time += time.perf_counter() - started
+            started = time.perf_counter()
+            llm_verdict = await self.llm_grader.async_grade_document(query, context, model)
+            llm_time += time.perf_counter() - started
+            llm_verdict = "yes" if llm_verdict.lower().startswith("yes") else "no"
+            self.samples.append((score, llm_verdict))
+            verdict = self.local_verdict(score)
+            if verdict is not None:
+                decided += 1
+                agree += verdict == llm_verdict
+        count = max(1, len(pairs))
+        report = {
+            "samples": len(pairs),
+            "agreement": agree / decided if decided else None,
+            "local_decided": decided / count,
+            "local_ms": 1000 * local_time / count,
+            "llm_ms": 1000 * llm_time / count,
+            "model": model,
+            "low": self.low,
+            "high": self.high,
+        }
+        # The benchmark verdicts cover the whole score range, recalibrate on them.
+        self.calibrate()
+        return report
+
+  def stats(self):
+        """
+        Returns:
+            dict: Local and escalated verdict counts and the current thresholds.
+        """
+        counters = dict(self._counters)
+        total = sum(counters.values())
+        counters["escalation_rate"] = counters["escalated"] / total if total else 0.0
+        counters.update(low=self.low, high=self.high, calibrated=self.calibrated, samples=len(self.samples))
+        return counters
@@ -1,14 +1,21 @@
 import openai
-from openai import OpenAI
-from typing import Dict, Any, Union
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from llm_gateway import get_gateway
+from typing import Dict, Any, List, Optional, Union
 
 
 class GuardrailChecker:
-    def __init__(self, openai_api_key: str, model="gpt-4"):
+    def __init__(self, openai_api_key: str, model="gpt-4", response_model=None):
         openai.api_key = openai_api_key
         self.api_key = openai_api_key
-        self.client = OpenAI(api_key=self.api_key)
+        self.gateway = get_gateway(self.api_key)
         self.model = model
+        # Model of the reply to a rejected message, `model` if not set.
+        self.response_model = response_model or model
         self.guardrail_system_message = """
         Your task is to evaluate whether the user's message complies with the company's communication policies.
 
@@ -27,43 +34,90 @@ class GuardrailChecker:
         - **'no'**: if the message violates any policy.
         """
 
-    def check_compliance(self, question: str) -> str:
+    def _compliance_messages(self, question: str) -> List[Dict[str, str]]:
+        prompt = f"User's message: {question}"
+        return [
+            {"role": "system", "content": self.guardrail_system_message},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _response_messages(self, question: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": "You are a helpful assistant. Provide a response to the user's query."},
+            {"role": "user", "content": question}
+        ]
+
+    def check_compliance(self, question: str, model: Optional[str] = None) -> str:
         """
         Checks if the user's query complies with company policies.
 
         Args:
             question (str): The user's message to be evaluated.
+            model (str): Model of this check, the checker's `model` if not given.
 
         Returns:
             str: 'yes' if the query complies, 'no' otherwise.
         """
-        prompt = f"User's message: {question}"
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": self.guardrail_system_message},
-                {"role": "user", "content": prompt}
-            ]
+        response = self.gateway.chat_completion(
+            model=model or self.model,
+            stage="guardrail",
+            messages=self._compliance_messages(question)
+        )
+        score = response.choices[0].message.content.strip().lower()
+        return score
+
+    async def async_check_compliance(self, question: str, model: Optional[str] = None) -> str:
+        """
+        Async variant of `check_compliance` that does not block the event loop.
+
+        Args:
+            question (str): The user's message to be evaluated.
+            model (str): Model of this check, the checker's `model` if not given.
+
+        Returns:
+            str: 'yes' if the query complies, 'no' otherwise.
+        """
+        response = await self.gateway.async_chat_completion(
+            model=model or self.model,
+            stage="guardrail",
+            messages=self._compliance_messages(question)
         )
         score = response.choices[0].message.content.strip().lower()
         return score
 
-    def generate_response(self, question: str) -> str:
+    def generate_response(self, question: str, model: Optional[str] = None) -> str:
         """
         Generates a response for the user's query if it violates policies.
 
         Args:
             question (str): The user's message.
+            model (str): Model of this reply, the checker's `response_model` if not given.
+
+        Returns:
+            str: A response generated by the LLM.
+        """
+        response = self.gateway.chat_completion(
+            model=model or self.response_model,
+            stage="guardrail_response",
+            messages=self._response_messages(question)
+        )
+        return response.choices[0].message.content
+
+    async def async_generate_response(self, question: str, model: Optional[str] = None) -> str:
+        """
+        Async variant of `generate_response`.
+
+        Args:
+            question (str): The user's message.
+            model (str): Model of this reply, the checker's `response_model` if not given.
 
         Returns:
             str: A response generated by the LLM.
         """
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant. Provide a response to the user's query."},
-                {"role": "user", "content": question}
-            ]
+        response = await self.gateway.async_chat_completion(
+            model=model or self.response_model,
+            stage="guardrail_response",
+            messages=self._response_messages(question)
         )
         return response.choices[0].message.content
 
@@ -98,4 +152,289 @@ class GuardrailChecker:
         if not generation:
             return "fine"
         else:
-            return "Inappropriate query"
\ No newline at end of file
+            return "Inappropriate query"
+
+
+# Local detectors. A "block" match is rejected outright, an "unsure" match is sent to the LLM check.
+PII_BLOCK = [
+    re.compile(r"\b\d{3}-\d{2}-\d{4}\b"),  # US social security number
+    re.compile(r"\b(?:sk|pk|rk)-[A-Za-z0-9_-]{20,}"),  # API keys
+    re.compile(r"\b(?:password|passwd|pin)\s*(?:is|:|=)\s*\S+", re.IGNORECASE),
+]
+PII_UNSURE = [
+    re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b"),  # email address
+    re.compile(r"(?:\+\d{1,3}[\s.-]?)?\(?\b\d{3}\)?[\s.-]\d{3}[\s.-]\d{4}\b"),  # phone number
+]
+CARD_NUMBER = re.compile(r"\b\d(?:[ -]?\d){12,18}\b")
+INJECTION_BLOCK = [
+    re.compile(
+        r"\b(?:ignore|disregard|forget|override)\b.{0,30}\b(?:previous|prior|above|earlier|all|your|the)\b"
+        r".{0,20}\b(?:instructions?|rules|prompts?|polic(?:y|ies)|guidelines|directions)\b",
+        re.IGNORECASE,
+    ),
+    re.compile(
+        r"\b(?:reveal|show|print|repeat|tell me|what(?: is|'s| are))\b.{0,30}\b(?:system|initial|hidden|original)"
+        r"\s+(?:prompt|instructions?|message)",
+        re.IGNORECASE,
+    ),
+    re.compile(r"\b(?:jailbreak|developer mode|DAN mode|do anything now)\b", re.IGNORECASE),
+]
+INJECTION_UNSURE = [
+    re.compile(r"\b(?:you are now|pretend (?:to be|you are)|act as|roleplay|impersonate)\b", re.IGNORECASE),
+    re.compile(r"\b(?:system prompt|instructions|your rules)\b", re.IGNORECASE),
+    re.compile(r"```|<script|\b(?:execute|eval|exec|sudo|rm -rf|os\.system|subprocess)\b", re.IGNORECASE),
+    re.compile(r"\b(?:fuck|shit|bitch|bastard|asshole|kill yourself)\b", re.IGNORECASE),
+]
+PLAIN_QUESTION = re.compile(
+    r"^(?:what|how|why|when|which|who|whom|whose|where|is|are|was|were|do|does|did|can|could|should|"
+    r"will|would|has|have|had|compare|list|summari[sz]e|explain|describe|give|show|tell|find|calculate)\b",
+    re.IGNORECASE,
+)
+# Only plain questions about filings and markets are approved locally; everything else,
+# and anything touching harmful topics even when phrased about money, goes to the LLM.
+DOMAIN_TERMS = re.compile(
+    r"\b(?:revenues?|sales|income|profits?|loss(?:es)?|margins?|earnings|eps|ebitda|cash ?flows?|balance sheet|"
+    r"assets?|liabilit(?:y|ies)|debt|equity|dividends?|buybacks?|shares?|stocks?|share price|market cap\w*|"
+    r"valuation|guidance|forecast|outlook|quarter(?:ly)?|q[1-4]|fy\d{0,4}|fiscal|annual|10-[kq]|filings?|"
+    r"reports?|segments?|expenses?|costs?|capex|operating|gross|net|investments?|investors?|ratio|yield|"
+    r"bonds?|interest rates?|inflation|ceo|cfo|executives?|board|risk factors?|acquisitions?|"
+    r"mergers?|subsidiar(?:y|ies)|headcount|employees|competitors?|market share)\b",
+    re.IGNORECASE,
+)
+HARMFUL = re.compile(
+    r"\b(?:bomb|explosives?|weapons?|guns?|firearms?|poison\w*|kill\w*|murder\w*|hurt|harm\w*|suicide|"
+    r"attack\w*|terror\w*|launder\w*|smuggl\w*|counterfeit\w*|scam\w*|steal\w*|stolen|embezzl\w*|"
+    r"fraud\w*|brib\w*|evade|evasion|insider trading|manipulat\w*|pump and dump|hack\w*|malware|"
+    r"phishing|ransomware|without getting caught|untraceable|racis\w*|sexis\w*|slurs?|jokes?|nazi\w*|"
+    r"hate|porn\w*|nude|sex\w*|drugs?|meth|cocaine|heroin|abuse\w*|stalk\w*|doxx?\w*)\b",
+    re.IGNORECASE,
+)
+WORD = re.compile(r"[^\W\d_]+")
+VOWELS = set("aeiouy")
+
+
+def normalize_query(question: str) -> str:
+    """
+    Case-folds the question and collapses whitespace and trailing punctuation, so
+    trivially different spellings of an approved question share an allowlist entry.
+    """
+    text = unicodedata.normalize("NFKC", question).casefold()
+    return " ".join(text.split()).strip(" ?!.")
+
+
+def luhn_valid(number: str) -> bool:
+    digits = [int(d) for d in number if d.isdigit()]
+    checksum = 0
+    for i, digit in enumerate(reversed(digits)):
+        if i % 2:
+            digit = digit * 2 - 9 if digit > 4 else digit * 2
+        checksum += digit
+    return checksum % 10 == 0
+
+
+def gibberish_score(question: str) -> float:
+    """
+    Returns:
+        float: Share of the words that look like keyboard mashing: no vowels, long
+            consonant runs or a character repeated four times. Tickers (short
+            all-caps words) are not counted.
+    """
+    words = [w for w in WORD.findall(question) if len(w) >= 4 and not (w.isupper() and len(w) <= 5)]
+    if not words:
+        return 0.0
+    garbled = 0
+    for word in words:
+        lower = word.lower()
+        run = longest = 0
+        for char in lower:
+            run = 0 if char in VOWELS else run + 1
+            longest = max(longest, run)
+        if not VOWELS & set(lower) or longest >= 5 or re.search(r"(.)\1{3}", lower):
+            garbled += 1
+    return garbled / len(words)
+
+
+class TieredGuardrail:
+    """
+    Puts CPU-only checks in front of a GuardrailChecker so only uncertain messages
+    pay for the LLM compliance call.
+
+    Tiers, in order: an allowlist of normalized queries the LLM approved before,
+    PII detectors, prompt-injection patterns, gibberish detection and a plain
+    finance question pass. Each tier either decides ('yes'/'no'), flags the
+    message as uncertain, or passes it on; flagged messages and messages no
+    tier decided always go to the LLM. The plain tier approves only short
+    questions about filings and markets that mention no harmful topic.
+    """
+
+    def __init__(
+        self,
+        checker: GuardrailChecker,
+        allowlist_size: int = 4096,
+        gibberish_block: float = 0.6,
+        gibberish_unsure: float = 0.25,
+        max_plain_words: int = 40,
+    ):
+        """
+        Args:
+            checker (GuardrailChecker): The LLM compliance check for uncertain messages.
+            allowlist_size (int): Approved queries to remember, least recently used dropped first.
+            gibberish_block (float): Gibberish score at which a message is rejected.
+            gibberish_unsure (float): Gibberish score at which a message goes to the LLM.
+            max_plain_words (int): Longer messages are never approved locally.
+        """
+        self.checker = checker
+        self.allowlist_size = allowlist_size
+        self.gibberish_block = gibberish_block
+        self.gibberish_unsure = gibberish_unsure
+        self.max_plain_words = max_plain_words
+        self._allowlist: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._tiers = ["allowlist", "pii", "injection", "gibberish", "plain", "llm"]
+        self._counters = {
+            tier: {"checks": 0, "yes": 0, "no": 0, "unsure": 0, "seconds": 0.0} for tier in self._tiers
+        }
+
+    def _record(self, tier: str, decision: Optional[str], started: float) -> None:
+        with self._lock:
+            counters = self._counters[tier]
+            counters["checks"] += 1
+            counters["seconds"] += time.perf_counter() - started
+            if decision is not None:
+                counters[decision] += 1
+
+    def _allowlist_tier(self, question: str) -> Optional[str]:
+        key = normalize_query(question)
+        with self._lock:
+            if key in self._allowlist:
+                self._allowlist.move_to_end(key)
+                return "yes"
+        return None
+
+    def _pii_tier(self, question: str) -> Optional[str]:
+        if any(pattern.search(question) for pattern in PII_BLOCK):
+            return "no"
+        if any(luhn_valid(match.group()) for match in CARD_NUMBER.finditer(question)):
+            return "no"
+        if any(pattern.search(question) for pattern in PII_UNSURE):
+            return "unsure"
+        return None
+
+    def _injection_tier(self, question: str) -> Optional[str]:
+        if any(pattern.search(question) for pattern in INJECTION_BLOCK):
+            return "no"
+        if any(pattern.search(question) for pattern in INJECTION_UNSURE):
+            return "unsure"
+        return None
+
+    def _gibberish_tier(self, question: str) -> Optional[str]:
+        if not WORD.search(question):
+            return "unsure"
+        score = gibberish_score(question)
+        if score >= self.gibberish_block:
+            return "no"
+        if score >= self.gibberish_unsure:
+            return "unsure"
+        return None
+
+    def _plain_tier(self, question: str) -> Optional[str]:
+        text = question.strip()
+        if HARMFUL.search(text):
+            return "unsure"
+        if len(text.split()) > self.max_plain_words or not (PLAIN_QUESTION.match(text) or text.endswith("?")):
+            return None
+        return "yes" if DOMAIN_TERMS.search(text) else None
+
+    def local_check(self, question: str) -> Optional[str]:
+        """
+        Runs the CPU tiers.
+
+        Returns:
+            str: 'yes' or 'no' if a local tier decided, None if the LLM has to.
+        """
+        unsure = False
+        for tier in self._tiers[:-1]:
+            if tier == "plain" and unsure:
+                break
+            started = time.perf_counter()
+            decision = getattr(self, f"_{tier}_tier")(question)
+            self._record(tier, decision, started)
+            if decision == "unsure":
+                unsure = True
+            elif decision is not None:
+                return decision
+        return None
+
+    def _approve(self, question: str, score: str) -> str:
+        if score == "yes":
+            with self._lock:
+                self._allowlist[normalize_query(question)] = None
+                self._allowlist.move_to_end(normalize_query(question))
+                if len(self._allowlist) > self.allowlist_size:
+                    self._allowlist.popitem(last=False)
+        return score
+
+    def check_compliance(self, question: str, model: Optional[str] = None) -> str:
+        """
+        Checks if the user's query complies with company policies, asking the LLM
+        only when no local tier decides.
+
+        Args:
+            question (str): The user's message to be evaluated.
+            model (str): Model of this check, the checker's `model` if not given.
+
+        Returns:
+            str: 'yes' if the query complies, 'no' otherwise.
+        """
+        decision = self.local_check(question)
+        if decision is not None:
+            return decision
+        started = time.perf_counter()
+        score = self.checker.check_compliance(question, model)
+        self._record("llm", "yes" if score == "yes" else "no", started)
+        return self._approve(question, score)
+
+    async def async_check_compliance(self, question: str, model: Optional[str] = None) -> str:
+        """
+        Async variant of `check_compliance`.
+
+        Args:
+            question (str): The user's message to be evaluated.
+            model (str): Model of this check, the checker's `model` if not given.
+
+        Returns:
+            str: 'yes' if the query complies, 'no' otherwise.
+        """
+        decision = self.local_check(question)
+        if decision is not None:
+            return decision
+        started = time.perf_counter()
+        score = await self.checker.async_check_compliance(question, model)
+        self._record("llm", "yes" if score == "yes" else "no", started)
+        return self._approve(question, score)
+
+    def generate_response(self, question: str, model: Optional[str] = None) -> str:
+        return self.checker.generate_response(question, model)
+
+    async def async_generate_response(self, question: str, model: Optional[str] = None) -> str:
+        return await self.checker.async_generate_response(question, model)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Per-tier check and decision counts and mean latency in ms, plus the
+                share of messages that skipped the LLM call.
+        """
+        with self._lock:
+            tiers = {tier: dict(counters) for tier, counters in self._counters.items()}
+            allowlisted = len(self._allowlist)
+        for counters in tiers.values():
+            seconds = counters.pop("seconds")
+            counters["mean_ms"] = 1000 * seconds / counters["checks"] if counters["checks"] else 0.0
+        messages = tiers["allowlist"]["checks"]
+        return {
+            "messages": messages,
+            "skipped_llm": 1 - tiers["llm"]["checks"] / messages if messages else 0.0,
+            "allowlist_entries": allowlisted,
+            "tiers": tiers,
+        }
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pathway.xpacks.llm.embedders import BaseEmbedder
+
+from inflight import InflightCalls
+
+
+class EmbeddingSnapshot:
+    """
+    On-disk snapshot of chunk embeddings keyed on the chunk text and embedder model.
+
+    Vectors are appended as float32 rows to a single file that is read through
+    `np.memmap`; a sqlite index maps each key to its row. Rows are indexed only
+    after they are flushed, so a crash never leaves the index pointing at a
+    partial vector.
+    """
+
+    def __init__(self, cache_dir: str = "./Cache/embeddings"):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self._db.commit()
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'dimension'").fetchone()
+        self.dimension: Optional[int] = row[0] if row else None
+        self._vectors = open(self.vectors_path, "ab")
+        self._map: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def _rows(self) -> np.memmap:
+        rows = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+        if self._map is None or len(self._map) < rows:
+            # The vector file only grows, remap to see rows appended since.
+            self._map = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension))
+        return self._map
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns:
+            dict: Vectors of the keys found in the snapshot.
+        """
+        found = {}
+        with self._lock:
+            if self.dimension is None:
+                return found
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(
+                    self._db.execute(f"SELECT key, row FROM vectors WHERE key IN ({placeholders})", batch).fetchall()
+                )
+            if not found:
+                return found
+            rows = self._rows()
+            return {key: np.array(rows[row]) for key, row in found.items()}
+
+    def put_many(self, keys: List[str], vectors: List[np.ndarray]) -> None:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = int(matrix.shape[1])
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('dimension', ?)", (self.dimension,))
+            elif matrix.shape[1] != self.dimension:
+                raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {matrix.shape[1]}")
+            first_row = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+            self._vectors.write(matrix.tobytes())
+            self._vectors.flush()
+            os.fsync(self._vectors.fileno())
+            self._db.executemany(
+                "INSERT OR REPLACE INTO vectors VALUES (?, ?)",
+                [(key, first_row + i) for i, key in enumerate(keys)],
+            )
+            self._db.commit()
+
+
+class SnapshotEmbedder(BaseEmbedder):
+    """
+    Embedder that serves chunks from an EmbeddingSnapshot and only calls the
+    wrapped embedder for chunks it has not seen, so a restart re-embeds just
+    the chunks of new or changed documents.
+
+    Works with embedders taking one text per call as well as batched ones.
+    """
+
+    def __init__(self, embedder: BaseEmbedder, cache_dir: str = "./Cache/embeddings"):
+        """
+        Args:
+            embedder (BaseEmbedder): The embedder to wrap, e.g. `embedders.OpenAIEmbedder`.
+            cache_dir (str): Directory of the snapshot files.
+        """
+        kwargs = {}
+        if getattr(embedder, "max_batch_size", None) is not None:
+            kwargs["max_batch_size"] = embedder.max_batch_size
+        super().__init__(return_type=np.ndarray, **kwargs)
+        self.embedder = embedder
+        self.snapshot = EmbeddingSnapshot(cache_dir)
+        # The model is part of the key, switching models starts from an empty snapshot.
+        self.model = str(getattr(embedder, "kwargs", {}).get("model"))
+        # A chunk embedded by two pipelines at once is sent to the API once.
+        self._inflight = InflightCalls()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def _key(self, text: str, kwargs: Dict[str, Any]) -> str:
+        payload = json.dumps([self.model, kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(f"{payload}\n{text}".encode("utf-8")).hexdigest()
+
+    async def _embed(self, texts: List[str], **kwargs) -> List[np.ndarray]:
+        if getattr(self.embedder, "max_batch_size", None) is not None:
+            vectors = self.embedder.__wrapped__(texts, **kwargs)
+            return list(await vectors if inspect.isawaitable(vectors) else vectors)
+        vectors = []
+        for text in texts:
+            vector = self.embedder.__wrapped__(text, **kwargs)
+            vectors.append(await vector if inspect.isawaitable(vector) else vector)
+        return vectors
+
+    async def __wrapped__(self, input, **kwargs) -> Any:
+        return await self._resolve(input, True, **kwargs)
+
+    async def _resolve(self, input, count: bool, **kwargs) -> Any:
+        batched = isinstance(input, list)
+        texts = input if batched else [input]
+        keys = [self._key(text, kwargs) for text in texts]
+        found = await asyncio.to_thread(self.snapshot.get_many, keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+
+        owned, waiting = {}, {}
+        for i in missing:
+            if keys[i] in owned or keys[i] in waiting:
+                continue
+            future, leader = self._inflight.claim(keys[i])
+            (owned if leader else waiting)[keys[i]] = (i, future)
+        if owned:
+
+            async def embed_owned() -> List[np.ndarray]:
+                vectors = await self._embed([texts[i] for i, _ in owned.values()], **kwargs)
+                await asyncio.to_thread(self.snapshot.put_many, list(owned), vectors)
+                return [np.asarray(vector) for vector in vectors]
+
+            # Shielded: chunks other pipelines wait on are embedded even if this caller is cancelled.
+            vectors = await asyncio.shield(self._inflight.spawn(list(owned), embed_owned))
+            found.update(zip(owned, vectors))
+        for key, (i, future) in waiting.items():
+            found[key] = await asyncio.wrap_future(future)
+        if count:
+            with self._lock:
+                self._counters["hits"] += len(keys) - len(owned)
+                self._counters["misses"] += len(owned)
+
+        results = [found[key] for key in keys]
+        return results if batched else results[0]
+
+    def follower(self) -> "SnapshotFollower":
+        """
+        Returns:
+            SnapshotFollower: An embedder for a second pipeline over the same chunks.
+        """
+        return SnapshotFollower(self)
+
+    def lookup(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Returns:
+            list: The snapshot vector of each text, None for texts never embedded.
+        """
+        keys = [self._key(text, {}) for text in texts]
+        found = self.snapshot.get_many(keys)
+        return [found.get(key) for key in keys]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Chunk hit/miss counters of this run and the snapshot size.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        counters["vectors"] = len(self.snapshot)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        return counters
+
+
+class SnapshotFollower(BaseEmbedder):
+    """
+    Embedder of a pipeline that follows the chunks a SnapshotEmbedder already
+    embeds, e.g. the local index next to the document store. It shares the
+    snapshot and the in-flight calls, so each chunk is embedded once, and does
+    not count towards the hit/miss stats, so each chunk is counted once.
+    """
+
+    def __init__(self, leader: SnapshotEmbedder):
+        kwargs = {}
+        if getattr(leader, "max_batch_size", None) is not None:
+            kwargs["max_batch_size"] = leader.max_batch_size
+        super().__init__(return_type=np.ndarray, **kwargs)
+        self.leader = leader
+
+    async def __wrapped__(self, input, **kwargs) -> Any:
+        return await self.leader._resolve(input, False, **kwargs)
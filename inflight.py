@@ -0,0 +1,80 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+
+class InflightCalls:
+    """
+    Lets concurrent callers of the same key share one call.
+
+    Futures are `concurrent.futures.Future`, so callers on different threads
+    and event loops (Pathway runs UDFs on its own loops) can wait on each other.
+    The shared call runs as its own task: a leader that is cancelled stops
+    waiting for it, and its followers still get the result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, concurrent.futures.Future] = {}
+
+    def claim(self, key: Hashable) -> Tuple[concurrent.futures.Future, bool]:
+        """
+        Returns:
+            tuple: The future of the key's call and whether the caller must make the call,
+                in which case it has to `finish` the key.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            return future, True
+
+    def finish(self, key: Hashable, result: Any = None, error: BaseException = None) -> None:
+        with self._lock:
+            future = self._calls.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def spawn(self, keys: List[Hashable], call: Callable[[], Awaitable[List[Any]]]) -> asyncio.Task:
+        """
+        Runs `call()` as its own task and finishes each of the claimed `keys` with
+        its result for that key (or its error) when the task is done.
+
+        Returns:
+            asyncio.Task: The task, which the leader awaits through `asyncio.shield`.
+        """
+        task = asyncio.ensure_future(call())
+
+        def done(task: asyncio.Task) -> None:
+            if task.cancelled():
+                error = asyncio.CancelledError()
+            else:
+                # Retrieved here, so an error nobody waits for any more is not reported.
+                error = task.exception()
+            if error is not None:
+                for key in keys:
+                    self.finish(key, error=error)
+            else:
+                for key, result in zip(keys, task.result()):
+                    self.finish(key, result)
+
+        task.add_done_callback(done)
+        return task
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Awaits `call()`, or the result of the same key's call already in flight.
+        """
+        future, leader = self.claim(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        async def single() -> List[Any]:
+            return [await call()]
+
+        return (await asyncio.shield(self.spawn([key], single)))[0]
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+# `_indexing_status` of a document the store has parsed, chunked and embedded
+# (documents it has only read are "INGESTED").
+INDEXED = "INDEXED"
+
+class IngestionTracker:
+    """
+    Tickets for uploaded documents, polled until the document store has indexed them.
+
+    The tracker knows nothing about Pathway itself: the module that owns the
+    document store registers an index probe returning the metadata of every
+    document (`RAGClient.list_documents`). A ticket moves to "ingesting" once
+    its path shows up there with a modification time at least as new as the
+    uploaded file, and to "indexed" once the store reports that version as
+    parsed, chunked and embedded (`_indexing_status` "INDEXED").
+    """
+
+    def __init__(self, max_tickets: int = 4096, probe_interval: float = 1.0):
+        self.max_tickets = max_tickets
+        self.probe_interval = probe_interval
+
+        self._lock = threading.Lock()
+        self._tickets: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._probe: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None
+        # path -> (modified_at, indexing status)
+        self._indexed: Dict[str, Tuple[int, Optional[str]]] = {}
+        self._probed_at = 0.0
+
+    def set_index_probe(self, probe: Callable[[], Iterable[Dict[str, Any]]]) -> None:
+        """
+        Args:
+            probe (callable): Returns the metadata dicts of the store's documents,
+                each with `path`, `modified_at` and `_indexing_status` keys.
+        """
+        self._probe = probe
+
+    def create(self, filename: str, path: str) -> Dict[str, Any]:
+        """
+        Opens a ticket for a file that has just been moved into the watched directory.
+
+        Args:
+            filename (str): Name the client uploaded the file as.
+            path (str): Final path of the file.
+
+        Returns:
+            dict: The new ticket.
+        """
+        path = os.path.realpath(path)
+        ticket = {
+            "ticket": uuid.uuid4().hex,
+            "filename": filename,
+            "path": path,
+            "size": os.path.getsize(path),
+            "modified_at": int(os.path.getmtime(path)),
+            "status": "pending",
+            "created_at": time.time(),
+            "indexed_at": None,
+        }
+        with self._lock:
+            self._tickets[ticket["ticket"]] = ticket
+            while len(self._tickets) > self.max_tickets:
+                self._tickets.popitem(last=False)
+        return dict(ticket)
+
+    def _refresh(self) -> None:
+        # Called without the lock held, list_documents is a blocking HTTP call.
+        if self._probe is None or time.monotonic() - self._probed_at < self.probe_interval:
+            return
+        try:
+            documents = list(self._probe())
+        except Exception:
+            # The document store may still be starting, tickets simply stay pending.
+            return
+        indexed = {}
+        for metadata in documents:
+            if metadata.get("path"):
+                indexed[os.path.realpath(metadata["path"])] = (
+                    int(metadata.get("modified_at") or 0),
+                    metadata.get("_indexing_status"),
+                )
+        self._indexed = indexed
+        self._probed_at = time.monotonic()
+
+    def get(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Args:
+            ticket_id (str): Ticket returned by `create`.
+
+        Returns:
+            dict: The ticket with its current status, or None for an unknown ticket.
+        """
+        with self._lock:
+            if ticket_id not in self._tickets:
+                return None
+            pending = self._tickets[ticket_id]["status"] != "indexed"
+        if pending:
+            self._refresh()
+        with self._lock:
+            ticket = self._tickets.get(ticket_id)
+            if ticket is None:
+                return None
+            if ticket["status"] != "indexed":
+                modified_at, status = self._indexed.get(ticket["path"], (0, None))
+                # An older version of the file, or one without modified_at, is not this upload.
+                if modified_at and modified_at >= ticket["modified_at"]:
+                    if status == INDEXED:
+                        ticket["status"] = "indexed"
+                        ticket["indexed_at"] = time.time()
+                    else:
+                        ticket["status"] = "ingesting"
+            ticket = dict(ticket)
+        ticket["elapsed"] = (ticket["indexed_at"] or time.time()) - ticket["created_at"]
+        return ticket
+
+
+tracker = IngestionTracker()
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentManifest:
+    """
+    Content hashes of the documents in the watched directory.
+
+    Every file is published through `publish`, which drops a file whose bytes
+    are already in the directory under any name, so the document store never
+    parses or embeds the same document twice. The manifest is kept on disk,
+    outside the watched directory, and reconciled with the directory on start
+    (only files whose size or mtime changed are re-hashed).
+    """
+
+    def __init__(self, data_dir: str, path: str):
+        self.data_dir = data_dir
+        self.path = path
+        self._lock = threading.Lock()
+        # filename -> {"sha256", "size", "mtime_ns"}
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._by_hash: Dict[str, str] = {}
+        self._counters = {"published": 0, "duplicates": 0, "bytes_saved": 0}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        for name in sorted(os.listdir(self.data_dir)):
+            if not os.path.isfile(os.path.join(self.data_dir, name)):
+                continue
+            stat = os.stat(os.path.join(self.data_dir, name))
+            entry = saved.get(name)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                entry = {
+                    "sha256": file_sha256(os.path.join(self.data_dir, name)),
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                }
+            self._files[name] = entry
+            # Duplicates that predate the manifest stay, the first name wins.
+            self._by_hash.setdefault(entry["sha256"], name)
+        self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            files = json.dumps(self._files)
+        temp_path = f"{self.path}.{uuid.uuid4().hex}"
+        with open(temp_path, "w") as f:
+            f.write(files)
+        os.replace(temp_path, self.path)
+
+    def _current(self, digest: str) -> Optional[str]:
+        name = self._by_hash.get(digest)
+        if name is None:
+            return None
+        try:
+            stat = os.stat(os.path.join(self.data_dir, name))
+        except OSError:
+            stat = None
+        entry = self._files[name]
+        if stat is None or stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            # Changed or removed behind our back, it no longer holds these bytes.
+            del self._by_hash[digest]
+            return None
+        return name
+
+    def _free_name(self, filename: str) -> str:
+        # report.pdf, report-1.pdf, report-2.pdf, ...
+        stem, ext = os.path.splitext(filename)
+        candidate, n = filename, 0
+        while candidate in self._files or os.path.exists(os.path.join(self.data_dir, candidate)):
+            n += 1
+            candidate = f"{stem}-{n}{ext}"
+        return candidate
+
+    def publish(self, temp_path: str, filename: str, digest: str, save: bool = True,
+                replace: bool = True) -> Tuple[str, bool]:
+        """
+        Moves a fully written temp file into the watched directory unless its content is already there.
+
+        Args:
+            temp_path (str): Temp file on the same filesystem as the watched directory.
+            filename (str): Name to publish the file under.
+            digest (str): sha256 hex digest of the file.
+            save (bool): Whether to write the manifest, batch callers save once at the end.
+            replace (bool): Whether different content under the same name is replaced;
+                otherwise it is published under the next free "name-<n>.ext".
+
+        Returns:
+            tuple: The name holding the content and whether the upload was a duplicate.
+        """
+        with self._lock:
+            existing = self._current(digest)
+            if existing is not None:
+                self._counters["duplicates"] += 1
+                self._counters["bytes_saved"] += os.path.getsize(temp_path)
+                os.remove(temp_path)
+                return existing, True
+            # fsync before the rename so the watcher never reads a file whose data is still in flight.
+            with open(temp_path, "rb+") as f:
+                os.fsync(f.fileno())
+            if not replace:
+                filename = self._free_name(filename)
+            final_path = os.path.join(self.data_dir, filename)
+            os.replace(temp_path, final_path)
+            stat = os.stat(final_path)
+            previous = self._files.get(filename)
+            if previous is not None and self._by_hash.get(previous["sha256"]) == filename:
+                del self._by_hash[previous["sha256"]]
+            self._files[filename] = {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            self._by_hash[digest] = filename
+            self._counters["published"] += 1
+        if save:
+            self.save()
+        return filename, False
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Published and deduplicated file counters and the number of distinct documents.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters["documents"] = len(self._by_hash)
+        return counters
@@ -0,0 +1,130 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List
+
+# Keeps tickers (BRK.B), filings (10-K), CUSIPs and figures (1,234.5, 12%) whole.
+TOKEN = re.compile(r"[$]?\w+(?:[.,/&'-]\w+)*%?")
+
+
+def tokenize(text: str) -> List[str]:
+    return [token.lower() for token in TOKEN.findall(text)]
+
+
+class BM25Index:
+    """
+    Incremental inverted index scoring chunks with Okapi BM25.
+
+    Follows the same chunks as the vector index through `on_change`, a
+    `pw.io.subscribe` callback, so exact identifiers that embeddings blur
+    (tickers, CUSIPs, figures) can still be matched.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[Any, int]] = defaultdict(dict)
+        self._docs: Dict[Any, Dict[str, Any]] = {}
+        self._terms: Dict[Any, Counter] = {}
+        self._total_length = 0
+        self._counters = {"searches": 0}
+
+    def add(self, key: Any, text: str, metadata: Dict[str, Any]) -> None:
+        terms = Counter(tokenize(text))
+        with self._lock:
+            if key in self._docs:
+                self._remove(key)
+            self._docs[key] = {"text": text, "metadata": metadata, "length": sum(terms.values())}
+            self._terms[key] = terms
+            self._total_length += self._docs[key]["length"]
+            for term, count in terms.items():
+                self._postings[term][key] = count
+
+    def _remove(self, key: Any) -> None:
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in self._terms.pop(key):
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+
+    def remove(self, key: Any) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def on_change(self, key, row: Dict[str, Any], time: int, is_addition: bool) -> None:
+        if is_addition:
+            metadata = row["metadata"]
+            self.add(key, row["text"], getattr(metadata, "value", metadata) or {})
+        else:
+            self.remove(key)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Args:
+            query (str): The question.
+            k (int): Number of chunks to return.
+
+        Returns:
+            list: Up to k dicts with `text`, `metadata` and `score`, best first.
+        """
+        with self._lock:
+            if not self._docs:
+                return []
+            average_length = self._total_length / len(self._docs)
+            scores: Dict[Any, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (len(self._docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, count in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._docs[key]["length"] / average_length)
+                    scores[key] += idf * count * (self.k1 + 1) / (count + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            self._counters["searches"] += 1
+            return [
+                {"text": self._docs[key]["text"], "metadata": self._docs[key]["metadata"], "score": score}
+                for key, score in best
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Chunk and term counts and the number of searches.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters["chunks"] = len(self._docs)
+            counters["terms"] = len(self._postings)
+        return counters
+
+
+def reciprocal_rank_fusion(*rankings: List[Dict[str, Any]], k: int = 60, limit: int = 3) -> List[Dict[str, Any]]:
+    """
+    Fuses ranked chunk lists, scoring each chunk by the sum of 1 / (k + rank).
+
+    Args:
+        *rankings (list): Ranked result lists, e.g. vector and BM25 results.
+        k (int): RRF damping constant.
+        limit (int): Number of chunks to return.
+
+    Returns:
+        list: The fused chunks, best first, each with an `rrf_score`.
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            # Chunks are matched on their text, the same chunk comes from both indexes.
+            entry = fused.setdefault(doc["text"], {**doc, "rrf_score": 0.0})
+            entry["rrf_score"] += 1 / (k + rank)
+    return sorted(fused.values(), key=lambda doc: doc["rrf_score"], reverse=True)[:limit]
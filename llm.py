@@ -1,20 +1,29 @@
-import openai
-from openai import OpenAI
+from llm_gateway import get_gateway
 
 class OpenAIClient:
     def __init__(self, api_key, model="gpt-4o"):
         self.api_key = api_key
         self.model = model
-        self.client = OpenAI(api_key=self.api_key)
+        self.gateway = get_gateway(self.api_key)
+
+    def _messages(self, prompt):
+        return [
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ]
 
     def get_completion(self, prompt):
-        response = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
+        response = self.gateway.chat_completion(
+            messages=self._messages(prompt),
+            model=self.model,
+        )
+        return response.choices[0].message.content
+
+    async def async_get_completion(self, prompt):
+        response = await self.gateway.async_chat_completion(
+            messages=self._messages(prompt),
             model=self.model,
         )
         return response.choices[0].message.content
\ No newline at end of file
@@ -0,0 +1,341 @@
+import asyncio
+import contextlib
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class LLMGateway:
+    """
+    Process-wide access point to the OpenAI API.
+
+    All chat completions go through one sync and one async client that share a
+    keep-alive connection pool, a concurrency limit and a single retry/backoff
+    policy, so callers do not pay a TLS handshake per request.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = LLM_KEEPALIVE_EXPIRY,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+    ):
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.http2 = _http2_available()
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "retries": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "queued": 0,
+            "http_requests": 0,
+            "connections_opened": 0,
+        }
+        # Per pipeline stage and model: calls, seconds and token usage.
+        self._stages: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._sync_slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = asyncio.Semaphore(max_concurrency)
+
+        # Retries are handled here, not by the SDK, so there is exactly one policy.
+        self.client = OpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=httpx.Client(
+                limits=self.limits,
+                http2=self.http2,
+                timeout=timeout,
+                event_hooks={"request": [self._on_request]},
+            ),
+        )
+        self.async_client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=self.limits,
+                http2=self.http2,
+                timeout=timeout,
+                event_hooks={"request": [self._async_on_request]},
+            ),
+        )
+
+    def _incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def _record_stage(self, stage: Optional[str], model: str, started: float, usage: Any) -> None:
+        with self._lock:
+            counters = self._stages.setdefault(stage or "unlabelled", {}).setdefault(model, {
+                "calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            })
+            counters["calls"] += 1
+            counters["seconds"] += time.perf_counter() - started
+            if usage is not None:
+                counters["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                counters["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.started":
+            self._incr("connections_opened")
+        elif event_name.endswith("send_request_headers.started"):
+            self._incr("http_requests")
+
+    async def _async_trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        self._trace(event_name, info)
+
+    def _on_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace
+
+    async def _async_on_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._async_trace
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps retrying workers from stampeding the API together.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @contextlib.contextmanager
+    def _sync_slot(self):
+        self._incr("queued")
+        try:
+            self._sync_slots.acquire()
+        finally:
+            self._incr("queued", -1)
+        self._incr("in_flight")
+        try:
+            yield
+        finally:
+            self._incr("in_flight", -1)
+            self._sync_slots.release()
+
+    @contextlib.asynccontextmanager
+    async def _async_slot(self):
+        # Counters stay correct when a queued call is cancelled, e.g. discarded speculative work.
+        self._incr("queued")
+        try:
+            await self._async_slots.acquire()
+        finally:
+            self._incr("queued", -1)
+        self._incr("in_flight")
+        try:
+            yield
+        finally:
+            self._incr("in_flight", -1)
+            self._async_slots.release()
+
+    def chat_completion(self, stage: Optional[str] = None, **kwargs: Any):
+        """
+        Creates a chat completion with the shared sync client.
+
+        Args:
+            stage (str): Pipeline stage the call is recorded under, e.g. "guardrail".
+            **kwargs: Arguments of `client.chat.completions.create`.
+
+        Returns:
+            ChatCompletion: The OpenAI response object.
+        """
+        started = time.perf_counter()
+        with self._sync_slot():
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._incr("requests")
+                    response = self.client.chat.completions.create(**kwargs)
+                    self._record_stage(stage, kwargs.get("model"), started, getattr(response, "usage", None))
+                    return response
+                except RETRYABLE_ERRORS:
+                    if attempt == self.max_retries:
+                        self._incr("errors")
+                        raise
+                    self._incr("retries")
+                    time.sleep(self._backoff(attempt))
+
+    async def async_chat_completion(self, stage: Optional[str] = None, **kwargs: Any):
+        """
+        Creates a chat completion with the shared async client.
+
+        Args:
+            stage (str): Pipeline stage the call is recorded under, e.g. "guardrail".
+            **kwargs: Arguments of `client.chat.completions.create`.
+
+        Returns:
+            ChatCompletion: The OpenAI response object.
+        """
+        started = time.perf_counter()
+        async with self._async_slot():
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._incr("requests")
+                    response = await self.async_client.chat.completions.create(**kwargs)
+                    self._record_stage(stage, kwargs.get("model"), started, getattr(response, "usage", None))
+                    return response
+                except RETRYABLE_ERRORS:
+                    if attempt == self.max_retries:
+                        self._incr("errors")
+                        raise
+                    self._incr("retries")
+                    await asyncio.sleep(self._backoff(attempt))
+
+    async def async_embedding(self, stage: Optional[str] = None, **kwargs: Any):
+        """
+        Creates embeddings with the shared async client.
+
+        Args:
+            stage (str): Pipeline stage the call is recorded under, e.g. "embedding".
+            **kwargs: Arguments of `client.embeddings.create`.
+
+        Returns:
+            CreateEmbeddingResponse: The OpenAI response object.
+        """
+        started = time.perf_counter()
+        async with self._async_slot():
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._incr("requests")
+                    response = await self.async_client.embeddings.create(**kwargs)
+                    self._record_stage(stage, kwargs.get("model"), started, getattr(response, "usage", None))
+                    return response
+                except RETRYABLE_ERRORS:
+                    if attempt == self.max_retries:
+                        self._incr("errors")
+                        raise
+                    self._incr("retries")
+                    await asyncio.sleep(self._backoff(attempt))
+
+    async def async_stream_chat_completion(self, stage: Optional[str] = None, **kwargs: Any) -> AsyncIterator[str]:
+        """
+        Streams a chat completion with the shared async client.
+
+        Only opening the stream is retried; once tokens have been yielded a failure
+        is raised to the caller.
+
+        Args:
+            stage (str): Pipeline stage the call is recorded under, e.g. "leader".
+            **kwargs: Arguments of `client.chat.completions.create`, without `stream`.
+
+        Yields:
+            str: The content deltas as they arrive.
+        """
+        started = time.perf_counter()
+        usage = None
+        async with self._async_slot():
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._incr("requests")
+                    # The last chunk then carries the token usage of the whole stream.
+                    stream = await self.async_client.chat.completions.create(
+                        stream=True, stream_options={"include_usage": True}, **kwargs
+                    )
+                    break
+                except RETRYABLE_ERRORS:
+                    if attempt == self.max_retries:
+                        self._incr("errors")
+                        raise
+                    self._incr("retries")
+                    await asyncio.sleep(self._backoff(attempt))
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            self._record_stage(stage, kwargs.get("model"), started, usage)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Pool and request counters used to size workers, and per stage and
+                model the calls, mean latency in ms and token usage.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        counters["connections_reused"] = max(0, counters["http_requests"] - counters["connections_opened"])
+        counters["http2"] = self.http2
+        counters["max_concurrency"] = self.max_concurrency
+        counters["max_connections"] = self.limits.max_connections
+        counters["max_keepalive_connections"] = self.limits.max_keepalive_connections
+        with self._lock:
+            stages = {
+                stage: {model: dict(model_counters) for model, model_counters in models.items()}
+                for stage, models in self._stages.items()
+            }
+        for models in stages.values():
+            for model_counters in models.values():
+                model_counters["mean_ms"] = 1000 * model_counters.pop("seconds") / model_counters["calls"]
+        counters["stages"] = stages
+        return counters
+
+
+_gateways: Dict[str, LLMGateway] = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(api_key: Optional[str] = None) -> LLMGateway:
+    """
+    Returns the process-wide gateway for an API key, creating it on first use.
+
+    Args:
+        api_key (str): OpenAI API key, defaults to the OPENAI_API_KEY environment variable.
+
+    Returns:
+        LLMGateway: The shared gateway.
+    """
+    api_key = api_key or os.environ["OPENAI_API_KEY"]
+    with _gateways_lock:
+        if api_key not in _gateways:
+            _gateways[api_key] = LLMGateway(api_key)
+        return _gateways[api_key]
+
+
+def gateway_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns:
+        dict: Stats of every gateway in the process, keyed by a masked API key.
+    """
+    with _gateways_lock:
+        gateways = list(_gateways.items())
+    return {f"...{api_key[-4:]}": gateway.stats() for api_key, gateway in gateways}
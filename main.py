@@ -6,6 +6,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from file_upload import router as file_upload_router
 from question_answering import router as question_answering_router
+from scraper import close_async_sessions
 
 app = FastAPI()
 app.add_middleware(
@@ -18,6 +19,7 @@ app.add_middleware(
 
 app.include_router(file_upload_router)
 app.include_router(question_answering_router)
+app.add_event_handler("shutdown", close_async_sessions)
 
 pw.set_license_key("Enter your Pathway License Key")
 SERP_API_KEY = "Enter your Serp API Key"
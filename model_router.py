@@ -0,0 +1,77 @@
+import re
+from typing import Any, Dict, List, Optional, Union
+
+from llm_gateway import gateway_stats
+
+COMPARISON = re.compile(r"\b(?:compare|comparison|versus|vs\.?|relative to|difference|between|against|rank)\b", re.IGNORECASE)
+# Tickers and capitalised names not at the start of the question, e.g. "TSLA", "Ford".
+ENTITY = re.compile(r"(?<!^)(?<![.?!] )\b(?:[A-Z]{2,5}\b|[A-Z][a-z]+)")
+YEAR = re.compile(r"\b(?:19|20)\d{2}\b|\bQ[1-4]\b|\bFY\d{2,4}\b")
+
+
+class ModelRouter:
+    """
+    Picks the model of each pipeline stage from a routing policy.
+
+    The policy maps a stage ("guardrail", "grade", "decompose", "analyst",
+    "leader", "follow_up", "unification"...) either to one model or to a
+    {"simple": ..., "complex": ...} pair chosen by the estimated complexity of the
+    question. Stages missing from the policy use `default`.
+
+    Routes are counted where the LLM is actually called: a stage's model may be
+    looked up for a guardrail or grading decision that is then made locally.
+    """
+
+    def __init__(self, policy: Dict[str, Union[str, Dict[str, str]]], default: str = "gpt-4o"):
+        """
+        Args:
+            policy (dict): Model, or models per complexity, of each stage.
+            default (str): Model of stages the policy does not name.
+        """
+        self.policy = policy
+        self.default = default
+
+    @staticmethod
+    def complexity(question: str, subtasks: Optional[List[Any]] = None) -> str:
+        """
+        Estimates how hard a question is from cheap signals: a comparison, several
+        companies or periods, a long question, or a decomposition into more than two
+        subtasks. Two or more signals make it "complex".
+
+        Returns:
+            str: "simple" or "complex".
+        """
+        entities = {match.group() for match in ENTITY.finditer(question)}
+        signals = [
+            bool(COMPARISON.search(question)),
+            len(entities) >= 2,
+            len(set(YEAR.findall(question))) >= 2,
+            len(question.split()) > 40,
+            bool(subtasks) and len([subtask for subtask in subtasks if subtask]) > 2,
+        ]
+        return "complex" if sum(signals) >= 2 else "simple"
+
+    def model(self, stage: str, complexity: str = "simple") -> str:
+        """
+        Returns:
+            str: The model the policy routes the stage to at this complexity.
+        """
+        route = self.policy.get(stage, self.default)
+        return route if isinstance(route, str) else route.get(complexity, route.get("simple", self.default))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: The policy and, per stage of the policy, the LLM calls the gateways made
+                with each model. Latency and tokens per stage and model are in the LLM
+                gateway stats.
+        """
+        routed: Dict[str, Dict[str, int]] = {}
+        for gateway in gateway_stats().values():
+            for stage, models in gateway["stages"].items():
+                if stage not in self.policy:
+                    continue
+                for model, counters in models.items():
+                    routed.setdefault(stage, {})
+                    routed[stage][model] = routed[stage].get(model, 0) + counters["calls"]
+        return {"policy": self.policy, "default": self.default, "routed": routed}
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import mmap
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import pathway as pw
+
+from inflight import InflightCalls
+
+
+class ParseCache:
+    """
+    Persistent store of parsed documents keyed on content hash and parser config.
+
+    Parsed element streams are appended to a single data file that is read back
+    through a memory map; a small sqlite index maps each key to its offset and
+    length. An entry is indexed only after its bytes are flushed, so a crash
+    never leaves the index pointing at a partial record.
+    """
+
+    def __init__(self, cache_dir: str = "./Cache/parsed"):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.data_path = os.path.join(cache_dir, "elements.bin")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS parsed (key TEXT PRIMARY KEY, offset INTEGER, length INTEGER)")
+        self._db.commit()
+        self._data = open(self.data_path, "ab+")
+        self._map: Optional[mmap.mmap] = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM parsed").fetchone()[0]
+
+    def get(self, key: str) -> Optional[List[Tuple[str, dict]]]:
+        """
+        Returns:
+            list: The cached (text, metadata) elements, or None on a miss.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT offset, length FROM parsed WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            offset, length = row
+            if self._map is None or len(self._map) < offset + length:
+                # The data file only grows, remap to see records appended since.
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            payload = self._map[offset:offset + length]
+        return [(text, metadata) for text, metadata in json.loads(payload)]
+
+    def put(self, key: str, elements: List[Tuple[str, dict]]) -> None:
+        payload = json.dumps([[text, metadata] for text, metadata in elements]).encode("utf-8")
+        with self._lock:
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(payload)
+            self._data.flush()
+            os.fsync(self._data.fileno())
+            self._db.execute("INSERT OR REPLACE INTO parsed VALUES (?, ?, ?)", (key, offset, len(payload)))
+            self._db.commit()
+
+
+class CachedParser(pw.UDF):
+    """
+    Wraps a Pathway parser UDF with a persistent, document-level ParseCache.
+
+    A document whose bytes and parser config were parsed before, in this or an
+    earlier run, is served from the cache instead of being parsed again, which
+    for OpenParse with LLM table parsing saves the gpt-4o calls per table.
+    """
+
+    def __init__(self, parser: pw.UDF, config: Dict[str, Any], cache_dir: str = "./Cache/parsed"):
+        """
+        Args:
+            parser (pw.UDF): The parser to wrap, e.g. `parsers.OpenParse`.
+            config (dict): Everything that changes the parser's output (algorithm,
+                model, prompt...). Changing it invalidates the cached documents.
+            cache_dir (str): Directory of the cache files.
+        """
+        super().__init__()
+        self.parser = parser
+        self.cache = ParseCache(cache_dir)
+        self.config_key = hashlib.sha256(
+            json.dumps([type(parser).__name__, config], sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        # The same document reaching the parser twice at once is parsed once.
+        self._inflight = InflightCalls()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "uncacheable": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _key(self, contents: bytes, kwargs: Dict[str, Any]) -> str:
+        digest = hashlib.sha256(self.config_key.encode("utf-8"))
+        digest.update(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(contents)
+        return digest.hexdigest()
+
+    async def _parse(self, key: str, contents: bytes, kwargs: Dict[str, Any]) -> List[Tuple[str, dict]]:
+        elements = await asyncio.to_thread(self.cache.get, key)
+        if elements is not None:
+            self._count("hits")
+            return elements
+
+        self._count("misses")
+        if inspect.iscoroutinefunction(self.parser.__wrapped__):
+            elements = await self.parser.__wrapped__(contents, **kwargs)
+        else:
+            elements = await asyncio.to_thread(self.parser.__wrapped__, contents, **kwargs)
+        try:
+            await asyncio.to_thread(self.cache.put, key, elements)
+        except (TypeError, ValueError):
+            # Metadata that does not round-trip through JSON is parsed every time.
+            self._count("uncacheable")
+        return elements
+
+    async def __wrapped__(self, contents: bytes, **kwargs) -> list[tuple[str, dict]]:
+        key = self._key(contents, kwargs)
+        return await self._inflight.run(key, lambda: self._parse(key, contents, kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Hit/miss counters of this run and the number of cached documents.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        counters["documents"] = len(self.cache)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        return counters
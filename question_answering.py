@@ -5,40 +5,149 @@ from pathway.xpacks.llm import llms, embedders, prompts, parsers, splitters
 from pathway.xpacks.llm.vector_store import VectorStoreServer
 from pathway.xpacks.llm.question_answering import RAGClient, AdaptiveRAGQuestionAnswerer
 from pathway.udfs import ExponentialBackoffRetryStrategy, DiskCache
-from guardrail import GuardrailChecker
-from grade import grade_doc
+from guardrail import GuardrailChecker, TieredGuardrail
+from grade import SimilarityGrader, grade_doc
 from conversational_agent import ConversationalPipeline
+from llm_gateway import gateway_stats
+from ingestion import tracker as ingestion_tracker
+from semantic_cache import SemanticCache
+from session_store import SessionStore
+from context_packing import ContextPacker
+from analyst_pool import AnalystPool
+from follow_up import FollowUpDecider, FollowUpDecision
+from model_router import ModelRouter
+from parse_cache import CachedParser
+from index_snapshot import SnapshotEmbedder
+from vector_index import QuantizedIndex, index_chunks, make_ann
+from keyword_index import BM25Index, reciprocal_rank_fusion
 from scraper import ContentScraper, GoogleSerperAPI
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import NamedTuple, Optional, Tuple, List, Union
+import asyncio
+import json
+import logging
+from collections import OrderedDict
 import threading
 import time
 import google.generativeai as genai  # Add this import
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # Configuration
 SERP_API_KEY = "Enter your Serp API Key"
 GEMINI_API_KEY = "Enter your Gemini API Key"
 OPENAI_API_KEY = "Enter your OpenAI API Key"
 SERPER_API_KEY = "Enter your Serper API Key"
+# Embedding model of the document store; questions and chunks embedded at query time use it too.
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Decide plain questions, PII, injection attempts and gibberish locally and send only
+# uncertain messages to the gpt-4 compliance check.
+TIERED_GUARDRAIL = True
+# Start the guardrail check, retrieval, grading and subtask decomposition together
+# and throw the speculative work away if the query turns out to be non-compliant.
+SPECULATIVE_EXECUTION = True
+# Serve repeated questions from a cache keyed on the question embedding.
+SEMANTIC_CACHE = True
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_MAX_ENTRIES = 1024
+SEMANTIC_CACHE_TTL = 3600
+# Web answers carry stock prices and go stale quickly.
+SEMANTIC_CACHE_WEB_TTL = 300
+# Keep parsed documents across restarts, keyed on their bytes and the parser config.
+PARSE_CACHE = True
+PARSE_CACHE_DIR = "./Cache/parsed"
+# Keep chunk embeddings across restarts so only new or changed chunks are embedded.
+INDEX_SNAPSHOT = True
+INDEX_SNAPSHOT_DIR = "./Cache/embeddings"
+# Serve retrieval from an in-process int8 index that follows the document store,
+# re-ranking the best LOCAL_INDEX_RERANK_FACTOR * k candidates exactly. It takes its
+# vectors from the embedding snapshot, so it needs INDEX_SNAPSHOT.
+LOCAL_INDEX = True
+LOCAL_INDEX_RERANK_FACTOR = 4
+# Candidate search of the local index: "exact" (full scan), "ivf" or "hnsw" (needs hnswlib).
+# NPROBE (ivf buckets scanned) and EF_SEARCH (hnsw beam width) trade latency for recall.
+LOCAL_INDEX_ANN = "ivf"
+LOCAL_INDEX_NPROBE = 8
+LOCAL_INDEX_EF_SEARCH = 64
+# Fuse BM25 keyword results with vector results (reciprocal rank fusion) so tickers,
+# CUSIPs and exact figures are found. Each side contributes HYBRID_CANDIDATES chunks.
+HYBRID_RETRIEVAL = True
+HYBRID_CANDIDATES = 10
+RETRIEVAL_K = 3
+# Grade retrieved chunks by question/chunk embedding similarity and ask gpt-4 only for
+# scores between GRADE_NO_THRESHOLD and GRADE_YES_THRESHOLD. Left as None, the
+# thresholds are calibrated from the first gpt-4 verdicts, escalating until then.
+LOCAL_GRADER = True
+GRADE_NO_THRESHOLD = None
+GRADE_YES_THRESHOLD = None
+# Model the grade benchmark measures the local grader's agreement and latency against.
+GRADE_REFERENCE_MODEL = "gpt-4"
+# Deduplicate leader contexts (exact and embedding near-duplicates) and pack them into
+# CONTEXT_TOKEN_BUDGET gpt-4o tokens.
+CONTEXT_PACKING = True
+CONTEXT_TOKEN_BUDGET = 3000
+CONTEXT_NEAR_DUPLICATE = 0.95
+# Decompose questions into a variable number of subtasks with JSON-schema output and
+# dependency hints; independent subtasks are retrieved and analysed concurrently.
+STRUCTURED_DECOMPOSITION = True
+MAX_SUBTASKS = 4
+# Analyst fan-out: subtasks running at once overall and per tenant (ANALYST_TENANT_LIMITS
+# overrides the latter per tenant id), per-stage timeouts in seconds, and the deadline
+# after which the leader goes ahead with the analyses that finished. Only tenant ids in
+# ANALYST_TENANTS or ANALYST_TENANT_LIMITS get their own share; other ids share "default",
+# which is limited by ANALYST_MAX_WORKERS only unless ANALYST_TENANT_LIMITS caps it.
+ANALYST_MAX_WORKERS = 8
+ANALYST_MAX_PER_TENANT = 4
+ANALYST_TENANTS = []
+ANALYST_TENANT_LIMITS = {}
+ANALYST_RETRIEVAL_TIMEOUT = 15
+ANALYST_TIMEOUT = 60
+ANALYST_DEADLINE = 90
+# Decide whether an answer needs a second analyst round with a local classifier, asking
+# the "follow_up" model only when it is unsure, instead of a gpt-4o call with the whole context.
+FOLLOW_UP_DECIDER = True
+# Model of each LLM stage: one model, or one per question complexity ("simple"/"complex",
+# see ModelRouter.complexity). Classification stages get a small model, synthesis gpt-4o.
+MODEL_ROUTING = {
+    "guardrail": "gpt-4o-mini",
+    "guardrail_response": "gpt-4o-mini",
+    "grade": "gpt-4o-mini",
+    "follow_up": "gpt-4o-mini",
+    "decompose": {"simple": "gpt-4o-mini", "complex": "gpt-4o"},
+    "analyst": {"simple": "gpt-4o-mini", "complex": "gpt-4o"},
+    "leader": "gpt-4o",
+    "unification": "gpt-4o",
+    "table_parse": "gpt-4o",
+}
+# Remember each session's turns: leader prompts reference chunks sent in earlier turns
+# and carry a summary of them, and repeated subtask retrievals are reused while the
+# documents are unchanged. Session ids are generated here and returned in responses.
+SESSION_MEMORY = True
+SESSION_TTL = 1800
+SESSION_MAX_TURNS = 5
+# How long to wait at import for the document store's REST server to answer.
+SERVER_STARTUP_TIMEOUT = 60
 
 os.environ['GEMINI_API_KEY'] = GEMINI_API_KEY
 os.environ["TESSDATA_PREFIX"] = "/usr/share/tesseract/tessdata/"
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
 pw.set_license_key("Enter your Pathway License Key")
+model_router = ModelRouter(MODEL_ROUTING)
 genai.configure(api_key=GEMINI_API_KEY)
 
 # Setup Pathway components
 folder = pw.io.fs.read(path="./data/", format="binary", with_metadata=True)
 text_splitter = splitters.TokenCountSplitter(max_tokens=400)
-embedder = embedders.OpenAIEmbedder(cache_strategy=DiskCache())
+embedder = embedders.OpenAIEmbedder(model=EMBEDDING_MODEL, cache_strategy=DiskCache())
 sources = [folder]
 
+table_model = model_router.model("table_parse")
 chat = llms.OpenAIChat(
-    model="gpt-4o",
+    model=table_model,
     retry_strategy=ExponentialBackoffRetryStrategy(max_retries=6),
     cache_strategy=DiskCache(),
     temperature=0.05,
@@ -50,14 +159,50 @@ table_args = {
     "prompt": prompts.DEFAULT_MD_TABLE_PARSE_PROMPT,
 }
 parser = parsers.OpenParse(table_args=table_args)
+if PARSE_CACHE:
+    parser = CachedParser(
+        parser,
+        config={
+            "parsing_algorithm": table_args["parsing_algorithm"],
+            "model": table_model,
+            "temperature": 0.05,
+            "prompt": table_args["prompt"],
+        },
+        cache_dir=PARSE_CACHE_DIR,
+    )
+    logger.info("Parse cache: %d documents cached in %s", len(parser.cache), PARSE_CACHE_DIR)
+
+index_embedder = embedder
+if INDEX_SNAPSHOT:
+    index_embedder = SnapshotEmbedder(embedder, cache_dir=INDEX_SNAPSHOT_DIR)
+    logger.info("Embedding snapshot: %d chunks cached in %s", len(index_embedder.snapshot), INDEX_SNAPSHOT_DIR)
 
 doc_store = VectorStoreServer(
     *sources,
-    embedder=embedder,
+    embedder=index_embedder,
     splitter=text_splitter,
     parser=parser
 )
 
+if LOCAL_INDEX and not INDEX_SNAPSHOT:
+    # Without the snapshot every chunk would be embedded a second time for the local index.
+    logger.warning("LOCAL_INDEX needs INDEX_SNAPSHOT, retrieving from the document store instead")
+    LOCAL_INDEX = False
+
+# The local indexes follow the store's own parsed and split chunks, documents are parsed once.
+if LOCAL_INDEX:
+    chunks = index_chunks(doc_store.chunked_docs, index_embedder.follower())
+    local_index = QuantizedIndex(
+        exact_vectors=index_embedder.lookup,
+        rerank_factor=LOCAL_INDEX_RERANK_FACTOR,
+        ann=make_ann(LOCAL_INDEX_ANN, nprobe=LOCAL_INDEX_NPROBE, ef_search=LOCAL_INDEX_EF_SEARCH),
+    )
+    pw.io.subscribe(chunks, on_change=local_index.on_change)
+
+if HYBRID_RETRIEVAL:
+    keyword_index = BM25Index()
+    pw.io.subscribe(doc_store.chunked_docs.select(pw.this.text, pw.this.metadata), on_change=keyword_index.on_change)
+
 app_rag = AdaptiveRAGQuestionAnswerer(
     llm=chat,
     indexer=doc_store,
@@ -73,99 +218,538 @@ def start_server():
 server_thread = threading.Thread(target=start_server, name="AdaptiveRAGQuestionAnswerer")
 server_thread.daemon = True
 server_thread.start()
-time.sleep(2)
 
 client = RAGClient(host=app_host, port=app_port)
 
+def wait_for_server(timeout=SERVER_STARTUP_TIMEOUT, interval=0.25):
+    # Poll the REST server instead of sleeping and hoping it is up.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return client.statistics()
+        except Exception:
+            time.sleep(interval)
+    logger.warning("Document store did not answer within %ss, continuing", timeout)
+
+def data_documents():
+    return sum(len(names) for _, _, names in os.walk("./data/"))
+
+wait_for_server()
+
+def report_parse_cache(documents, timeout=3600):
+    # Log hits/misses once every document present at startup has gone through the parser.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = parser.stats()
+        if stats["hits"] + stats["misses"] >= documents:
+            break
+        time.sleep(1)
+    logger.info("Parse cache after startup: %s", parser.stats())
+
+if PARSE_CACHE:
+    threading.Thread(target=report_parse_cache, args=(data_documents(),), daemon=True).start()
+
+# Upload tickets are resolved against the documents the store has parsed and embedded.
+ingestion_tracker.set_index_probe(lambda: client.list_documents(keys=["path", "modified_at", "_indexing_status"]))
+
+answer_cache = SemanticCache(
+    OPENAI_API_KEY,
+    model=EMBEDDING_MODEL,
+    data_dir="./data/",
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl=SEMANTIC_CACHE_TTL,
+    web_ttl=SEMANTIC_CACHE_WEB_TTL,
+)
+
+guardrail = TieredGuardrail(GuardrailChecker(
+    OPENAI_API_KEY, model=model_router.model("guardrail"), response_model=model_router.model("guardrail_response")
+))
+
+analyst_pool = AnalystPool(
+    max_workers=ANALYST_MAX_WORKERS,
+    max_per_tenant=ANALYST_MAX_PER_TENANT,
+    tenant_limits=ANALYST_TENANT_LIMITS,
+    tenants=ANALYST_TENANTS,
+    retrieval_timeout=ANALYST_RETRIEVAL_TIMEOUT,
+    analyst_timeout=ANALYST_TIMEOUT,
+)
+follow_up = FollowUpDecider(OPENAI_API_KEY, model=model_router.model("follow_up"))
+sessions = SessionStore(ttl=SESSION_TTL, max_turns=SESSION_MAX_TURNS)
+
 class QueryRequest(BaseModel):
     question: str
+    session_id: Optional[str] = None
+    tenant_id: Optional[str] = None
 
-@router.post("/api/v1/users")
-async def ask_questions(request: QueryRequest):
-    question = request.question
-    guard = GuardrailChecker(OPENAI_API_KEY)
-    grader = grade_doc(OPENAI_API_KEY)
-    if question.lower() == "exit":
-        return JSONResponse(content={"message": "Exiting the app."}, status_code=200)
-    
-    if guard.check_compliance(question) == "no":
-        return JSONResponse(content={"message": "Inappropriate query " + guard.generate_response(question)}, status_code=200)
-    
-    docs = client.retrieve(question)
+query_embeddings = OrderedDict()
+
+async def embed_query(query):
+    # The cache lookup and local retrieval embed the same question, do it once.
+    if query in query_embeddings:
+        query_embeddings.move_to_end(query)
+        return query_embeddings[query]
+    embedding = await answer_cache.embed(query)
+    query_embeddings[query] = embedding
+    if len(query_embeddings) > 256:
+        query_embeddings.popitem(last=False)
+    return embedding
+
+async def embed_chunks(texts):
+    # Indexed chunks are already in the embedding snapshot, embed only the others.
+    vectors = await asyncio.to_thread(index_embedder.lookup, texts) if INDEX_SNAPSHOT else [None] * len(texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    for i, vector in zip(missing, await answer_cache.embed_many([texts[i] for i in missing])):
+        vectors[i] = vector
+    return vectors
+
+similarity_grader = SimilarityGrader(
+    grade_doc(OPENAI_API_KEY, model=model_router.model("grade")),
+    embed_query,
+    embed_chunks,
+    low=GRADE_NO_THRESHOLD,
+    high=GRADE_YES_THRESHOLD,
+    reference_model=GRADE_REFERENCE_MODEL,
+)
+
+context_packer = ContextPacker(embed_chunks, budget=CONTEXT_TOKEN_BUDGET, near_duplicate=CONTEXT_NEAR_DUPLICATE)
+
+async def retrieve_vectors(query, k):
+    if LOCAL_INDEX and len(local_index):
+        return await asyncio.to_thread(local_index.search, await embed_query(query), k)
+    # RAGClient is a blocking HTTP client, keep it off the event loop.
+    return await asyncio.to_thread(client.retrieve, query, k)
+
+async def retrieve_texts(query, session=None):
+    if session is not None:
+        version = await asyncio.to_thread(answer_cache.documents_version)
+        texts = session.retrieved(query, version)
+        if texts is not None:
+            return texts
+    if HYBRID_RETRIEVAL and len(keyword_index):
+        vector_docs, keyword_docs = await asyncio.gather(
+            retrieve_vectors(query, HYBRID_CANDIDATES),
+            asyncio.to_thread(keyword_index.search, query, HYBRID_CANDIDATES),
+        )
+        docs = reciprocal_rank_fusion(vector_docs, keyword_docs, limit=RETRIEVAL_K)
+    else:
+        docs = await retrieve_vectors(query, RETRIEVAL_K)
     texts = [item['text'] for item in docs]
-    
-    status = grader.grade_document(question, texts)
-    leader_analyst = ConversationalPipeline(OPENAI_API_KEY)
+    if session is not None:
+        session.remember_retrieval(query, texts, version)
+    return texts
+
+async def no_emit(event, data):
+    pass
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
+class Prelude(NamedTuple):
+    compliant: bool
+    texts: List[str]
+    status: str
+    # (subtask_1, subtask_2), or the subtask dicts of a structured decomposition.
+    subtasks: Optional[Union[Tuple[str, str], List[dict]]]
+
+def discard(task):
+    # Cancel speculative work and swallow whatever it ended with.
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+async def divide_correct(leader_analyst, question, texts):
+    if STRUCTURED_DECOMPOSITION:
+        return await leader_analyst.async_decompose(question, texts, max_subtasks=MAX_SUBTASKS)
+    return await leader_analyst.async_divide_correct_task_into_subtasks(question, texts)
+
+async def divide_incorrect(leader_analyst, question):
+    if STRUCTURED_DECOMPOSITION:
+        return await leader_analyst.async_decompose(question, max_subtasks=MAX_SUBTASKS)
+    return await leader_analyst.async_divide_incorrect_task_into_subtasks(question)
+
+async def serial_prelude(question, guard, grader, leader_analyst, emit=no_emit):
+    if await guard.async_check_compliance(question, leader_analyst.model_for("guardrail")) == "no":
+        return Prelude(False, [], "", None)
+    await emit("stage", {"stage": "guardrail"})
+    texts = await retrieve_texts(question)
+    await emit("stage", {"stage": "retrieval"})
+    status = await grader.async_grade_document(question, texts, leader_analyst.model_for("grade"))
+    await emit("stage", {"stage": "grade", "relevant": status.lower() == "yes"})
     if status.lower() == "yes":
-        subtask_1, subtask_2 = leader_analyst.divide_correct_task_into_subtasks(question, texts)
-        context_a = client.retrieve(subtask_1)
-        context_a = [item['text'] for item in context_a]
-        context_b = []
+        subtasks = await divide_correct(leader_analyst, question, texts)
+    else:
+        subtasks = await divide_incorrect(leader_analyst, question)
+    await emit("stage", {"stage": "decomposition", "subtasks": list(subtasks)})
+    return Prelude(True, texts, status, subtasks)
+
+async def speculative_prelude(question, guard, grader, leader_analyst, emit=no_emit):
+    """
+    Runs the guardrail check concurrently with retrieval, grading and both subtask
+    decompositions. The decomposition that does not match the grade is cancelled,
+    and everything is cancelled if the guardrail rejects the query.
+    """
+    async def grade_and_divide():
+        texts = await retrieve_texts(question)
+        await emit("stage", {"stage": "retrieval"})
+        correct_split = asyncio.create_task(divide_correct(leader_analyst, question, texts))
+        try:
+            status = await grader.async_grade_document(question, texts, leader_analyst.model_for("grade"))
+        except BaseException:
+            discard(correct_split)
+            raise
+        await emit("stage", {"stage": "grade", "relevant": status.lower() == "yes"})
+        if status.lower() != "yes":
+            discard(correct_split)
+            return texts, status, None
+        return texts, status, await correct_split
+
+    compliance = asyncio.create_task(guard.async_check_compliance(question, leader_analyst.model_for("guardrail")))
+    graded = asyncio.create_task(grade_and_divide())
+    incorrect_split = asyncio.create_task(divide_incorrect(leader_analyst, question))
+    speculative = [graded, incorrect_split]
+    try:
+        if await compliance == "no":
+            for task in speculative:
+                discard(task)
+            return Prelude(False, [], "", None)
+        await emit("stage", {"stage": "guardrail"})
+        texts, status, subtasks = await graded
+        if subtasks is None:
+            subtasks = await incorrect_split
+        else:
+            discard(incorrect_split)
+        await emit("stage", {"stage": "decomposition", "subtasks": list(subtasks)})
+        return Prelude(True, texts, status, subtasks)
+    except BaseException:
+        for task in speculative:
+            discard(task)
+        raise
+
+@router.get("/api/v1/llm/stats")
+async def llm_stats():
+    return JSONResponse(content=gateway_stats(), status_code=200)
+
+@router.get("/api/v1/llm/routing")
+async def llm_routing():
+    return JSONResponse(content=model_router.stats(), status_code=200)
+
+async def follow_up_decision(leader_analyst, question, context, final_response, analyses=None, expected_analyses=None):
+    if FOLLOW_UP_DECIDER:
+        return await follow_up.decide(question, final_response, analyses, expected_analyses)
+    # The leader's check says "Yes" when the query is fully answered; a second round is for "No".
+    status = await leader_analyst.async_check_follow_up(question, context, final_response)
+    return FollowUpDecision(status.lower().startswith("no"), 1.0, "leader")
+
+def follow_up_event(decision, second_round):
+    return {"stage": "follow_up", "second_round": second_round, "confidence": decision.confidence, "source": decision.source}
+
+async def answer_question(question, texts, status, subtasks, leader_analyst, emit=no_emit, session=None, tenant="default"):
+    """
+    Runs the leader-analyst rounds for a compliant, graded question.
+
+    Returns the final response and whether it was built from web search.
+    Subtask retrievals repeated within `session` are reused. Progress and the leader's answer tokens are reported through `emit`.
+    """
+    if STRUCTURED_DECOMPOSITION:
+        return await answer_structured(question, texts, status, subtasks, leader_analyst, emit, session, tenant)
+
+    async def on_token(delta):
+        await emit("token", {"text": delta})
+
+    if status.lower() == "yes":
+        subtask_1, subtask_2 = subtasks
         if subtask_2:
-            context_b = client.retrieve(subtask_2)
-            context_b = [item['text'] for item in context_b]
-        final_response = leader_analyst.run_pipeline(question, context_a, context_b, subtask_1, subtask_2)
-        follow_up_status = leader_analyst.check_follow_up(question, context_a + context_b, final_response)
-        if follow_up_status == "Yes":
-            subtask_3, subtask_4 = leader_analyst.generate_new_subtasks(question, subtask_1, subtask_2, texts)
-            context_c = client.retrieve(subtask_3)
-            context_c = [item['text'] for item in context_c]
-            context_d = client.retrieve(subtask_4)
-            context_d = [item['text'] for item in context_d]
+            context_a, context_b = await asyncio.gather(retrieve_texts(subtask_1, session), retrieve_texts(subtask_2, session))
+        else:
+            context_a, context_b = await retrieve_texts(subtask_1, session), []
+        await emit("stage", {"stage": "context"})
+        final_response = await leader_analyst.async_run_pipeline(question, context_a, context_b, subtask_1, subtask_2, on_token=on_token)
+        await emit("stage", {"stage": "leader"})
+        decision = await follow_up_decision(leader_analyst, question, context_a + context_b, final_response)
+        await emit("stage", follow_up_event(decision, decision.needs_follow_up))
+        if decision.needs_follow_up:
+            subtask_3, subtask_4 = await leader_analyst.async_generate_new_subtasks(question, subtask_1, subtask_2, texts)
+            context_c, context_d = await asyncio.gather(retrieve_texts(subtask_3, session), retrieve_texts(subtask_4, session))
             context = context_a + context_b
-            final_response = leader_analyst.run_pipeline_if_needed(question, context_c, context_d, subtask_3, subtask_4, final_response, context)
-            return JSONResponse(content={"message": final_response}, status_code=200)
-        return JSONResponse(content={"message": final_response}, status_code=200)
+            second_response = await leader_analyst.async_run_pipeline_if_needed(question, context_c, context_d, subtask_3, subtask_4, final_response, context)
+            follow_up.record_second_round(decision, final_response, second_response)
+            final_response = second_response
+            await emit("stage", {"stage": "second_round"})
+        return final_response, False
     else:
         web_scraper = GoogleSerperAPI(SERPER_API_KEY)
         flag = 0
         if web_scraper.initialised & flag:
-            subtask_1, subtask_2 = leader_analyst.divide_incorrect_task_into_subtasks(question)
-            context_a = web_scraper.search(subtask_1)
+            subtask_1, subtask_2 = subtasks
+            context_a = await web_scraper.async_search(subtask_1)
             context_b = ""
             if subtask_2:
-                context_b = web_scraper.search(subtask_2)
-            final_response = leader_analyst.run_pipeline(question, context_a, context_b, subtask_1, subtask_2)
+                context_b = await web_scraper.async_search(subtask_2)
+            await emit("stage", {"stage": "context"})
+            final_response = await leader_analyst.async_run_pipeline(question, context_a, context_b, subtask_1, subtask_2, on_token=on_token)
+            await emit("stage", {"stage": "leader"})
             context = context_a + context_b
-            follow_up_status = leader_analyst.check_follow_up(question, context, final_response)
-            if follow_up_status == "Yes" and subtask_2:
-                subtask_3, subtask_4 = leader_analyst.generate_new_subtasks(question, subtask_1, subtask_2, texts)
-                context_c = web_scraper.search(subtask_3)
+            decision = await follow_up_decision(leader_analyst, question, context, final_response)
+            await emit("stage", follow_up_event(decision, decision.needs_follow_up and bool(subtask_2)))
+            if decision.needs_follow_up and subtask_2:
+                subtask_3, subtask_4 = await leader_analyst.async_generate_new_subtasks(question, subtask_1, subtask_2, texts)
+                context_c = await web_scraper.async_search(subtask_3)
                 context_d = ""
                 if subtask_4:
-                    context_d = web_scraper.search(subtask_4)
-                final_response = leader_analyst.run_pipeline_if_needed(question, context_c, context_d, subtask_3, subtask_4, final_response, context)
-                return JSONResponse(content={"message": final_response}, status_code=200)
-            return JSONResponse(content={"message": final_response}, status_code=200)
+                    context_d = await web_scraper.async_search(subtask_4)
+                second_response = await leader_analyst.async_run_pipeline_if_needed(question, context_c, context_d, subtask_3, subtask_4, final_response, context)
+                follow_up.record_second_round(decision, final_response, second_response)
+                final_response = second_response
+                await emit("stage", {"stage": "second_round"})
+            return final_response, True
         else:
             web_scraper = ContentScraper(SERP_API_KEY)
-            subtask_1, subtask_2 = leader_analyst.divide_incorrect_task_into_subtasks(question)
-            source_description_list_a, ai_overview_context_a = web_scraper.search_google(subtask_1)
-            all_content_a, context_a = web_scraper.get_content_from_urls(source_description_list_a)
-            stock_info_a = web_scraper.get_stock_price(subtask_1)
-            source_description_list_b, ai_overview_context_b = web_scraper.search_google(subtask_2)
-            all_content_b, context_b = web_scraper.get_content_from_urls(source_description_list_b)
-            stock_info_b = web_scraper.get_stock_price(subtask_2)
-            context_a.extend(ai_overview_context_a)
-            context_a.extend(stock_info_a)
-            context_b.extend(ai_overview_context_b)
-            context_b.extend(stock_info_b)
-            final_response = leader_analyst.run_pipeline(question, context_a, context_b, subtask_1, subtask_2)
+            subtask_1, subtask_2 = subtasks
+            context_a, context_b = await web_scraper.async_build_contexts([subtask_1, subtask_2])
+            await emit("stage", {"stage": "context"})
+            final_response = await leader_analyst.async_run_pipeline(question, context_a, context_b, subtask_1, subtask_2, on_token=on_token)
+            await emit("stage", {"stage": "leader"})
             context = context_a + context_b
-            follow_up_status = leader_analyst.check_follow_up(question, context, final_response)
-            if follow_up_status == "Yes" and subtask_2:
-                subtask_3, subtask_4 = leader_analyst.generate_new_subtasks(question, subtask_1, subtask_2, texts)
-                source_description_list_c, ai_overview_context_c = web_scraper.search_google(subtask_3)
-                all_content_c, context_c = web_scraper.get_content_from_urls(source_description_list_c)
-                stock_info_c = web_scraper.get_stock_price(subtask_3)
-                source_description_list_d, ai_overview_context_d = web_scraper.search_google(subtask_4)
-                all_content_d, context_d = web_scraper.get_content_from_urls(source_description_list_d)
-                stock_info_d = web_scraper.get_stock_price(subtask_4)
-                context_c.extend(ai_overview_context_c)
-                context_c.extend(stock_info_c)
-                context_d.extend(ai_overview_context_d)
-                context_d.extend(stock_info_d)
-                final_response = leader_analyst.run_pipeline_if_needed(question, context_c, context_d, subtask_3, subtask_4, final_response, context)
-                return JSONResponse(content={"message": final_response}, status_code=200)
-            return JSONResponse(content={"message": final_response}, status_code=200)
+            decision = await follow_up_decision(leader_analyst, question, context, final_response)
+            await emit("stage", follow_up_event(decision, decision.needs_follow_up and bool(subtask_2)))
+            if decision.needs_follow_up and subtask_2:
+                subtask_3, subtask_4 = await leader_analyst.async_generate_new_subtasks(question, subtask_1, subtask_2, texts)
+                context_c, context_d = await web_scraper.async_build_contexts([subtask_3, subtask_4])
+                second_response = await leader_analyst.async_run_pipeline_if_needed(question, context_c, context_d, subtask_3, subtask_4, final_response, context)
+                follow_up.record_second_round(decision, final_response, second_response)
+                final_response = second_response
+                await emit("stage", {"stage": "second_round"})
+            return final_response, True
+
+async def answer_structured(question, texts, status, subtasks, leader_analyst, emit=no_emit, session=None, tenant="default"):
+    """
+    `answer_question` for structured decompositions: any number of subtasks, with
+    the independent ones retrieved and analysed concurrently in the tenant's share
+    of the analyst pool.
+    """
+    async def on_token(delta):
+        await emit("token", {"text": delta})
+
+    web = status.lower() != "yes"
+    if web:
+        web_scraper = ContentScraper(SERP_API_KEY)
+
+        async def retrieve(task):
+            contexts = await web_scraper.async_build_contexts([task])
+            return contexts[0]
+    else:
+        async def retrieve(task):
+            return await retrieve_texts(task, session)
+
+    responses, context = await leader_analyst.async_analyse_subtasks(
+        subtasks, retrieve, pool=analyst_pool, tenant=tenant, deadline=ANALYST_DEADLINE
+    )
+    await emit("stage", {"stage": "context"})
+    final_response = await leader_analyst.async_multi_leader_task(responses, question, context, on_token=on_token)
+    await emit("stage", {"stage": "leader"})
+    decision = await follow_up_decision(leader_analyst, question, context, final_response, responses, len(subtasks))
+    second_round = decision.needs_follow_up and (not web or len(subtasks) > 1)
+    await emit("stage", follow_up_event(decision, second_round))
+    if second_round:
+        new_subtasks = await leader_analyst.async_decompose(question, texts, previous=subtasks, max_subtasks=MAX_SUBTASKS)
+        new_responses, new_context = await leader_analyst.async_analyse_subtasks(
+            new_subtasks, retrieve, pool=analyst_pool, tenant=tenant, deadline=ANALYST_DEADLINE
+        )
+        second_response = await leader_analyst.async_multi_unification_task(final_response, new_responses, question, context + new_context)
+        follow_up.record_second_round(decision, final_response, second_response)
+        final_response = second_response
+        await emit("stage", {"stage": "second_round"})
+    return final_response, web
+
+@router.get("/api/v1/ready")
+async def ready():
+    # Readiness probe: ready once every document in ./data/ has been indexed.
+    try:
+        stats = await asyncio.to_thread(client.statistics)
+    except Exception:
+        return JSONResponse(content={"ready": False, "reason": "document store is not up"}, status_code=503)
+    documents = await asyncio.to_thread(data_documents)
+    indexed = (stats or {}).get("file_count", 0)
+    is_ready = indexed >= documents
+    content = {"ready": is_ready, "indexed_documents": indexed, "documents": documents}
+    if INDEX_SNAPSHOT:
+        content["embedding_snapshot"] = index_embedder.stats()
+    if LOCAL_INDEX:
+        content["local_index_chunks"] = len(local_index)
+    return JSONResponse(content=content, status_code=200 if is_ready else 503)
+
+@router.get("/api/v1/index/stats")
+async def index_stats():
+    if not LOCAL_INDEX:
+        raise HTTPException(status_code=404, detail="Local index is disabled")
+    content = local_index.stats()
+    if HYBRID_RETRIEVAL:
+        content["keyword_index"] = keyword_index.stats()
+    return JSONResponse(content=content, status_code=200)
+
+@router.get("/api/v1/index/benchmark")
+async def index_benchmark(k: int = 10, queries: int = 100):
+    # recall@k of the ANN backend against exact search over the indexed corpus.
+    if not LOCAL_INDEX:
+        raise HTTPException(status_code=404, detail="Local index is disabled")
+    return JSONResponse(content=await asyncio.to_thread(local_index.benchmark, k, queries), status_code=200)
+
+@router.get("/api/v1/parse-cache/stats")
+async def parse_cache_stats():
+    if not PARSE_CACHE:
+        raise HTTPException(status_code=404, detail="Parse cache is disabled")
+    return JSONResponse(content=await asyncio.to_thread(parser.stats), status_code=200)
+
+@router.get("/api/v1/grade/stats")
+async def grade_stats():
+    if not LOCAL_GRADER:
+        raise HTTPException(status_code=404, detail="Local grader is disabled")
+    return JSONResponse(content=similarity_grader.stats(), status_code=200)
+
+@router.get("/api/v1/grade/benchmark")
+async def grade_benchmark(samples: int = 50):
+    # Agreement and latency of the local grader against GRADE_REFERENCE_MODEL on recent questions.
+    if not LOCAL_GRADER:
+        raise HTTPException(status_code=404, detail="Local grader is disabled")
+    return JSONResponse(content=await similarity_grader.benchmark(samples), status_code=200)
+
+@router.get("/api/v1/guardrail/stats")
+async def guardrail_stats():
+    if not TIERED_GUARDRAIL:
+        raise HTTPException(status_code=404, detail="Tiered guardrail is disabled")
+    return JSONResponse(content=guardrail.stats(), status_code=200)
+
+@router.get("/api/v1/analysts/stats")
+async def analyst_stats():
+    return JSONResponse(content=analyst_pool.stats(), status_code=200)
+
+@router.get("/api/v1/follow-up/stats")
+async def follow_up_stats():
+    return JSONResponse(content=follow_up.stats(), status_code=200)
+
+@router.get("/api/v1/context/stats")
+async def context_stats():
+    if not CONTEXT_PACKING:
+        raise HTTPException(status_code=404, detail="Context packing is disabled")
+    return JSONResponse(content=context_packer.stats(), status_code=200)
+
+@router.get("/api/v1/sessions/stats")
+async def session_stats():
+    if not SESSION_MEMORY:
+        raise HTTPException(status_code=404, detail="Session memory is disabled")
+    return JSONResponse(content=sessions.stats(), status_code=200)
+
+@router.delete("/api/v1/sessions/{session_id}")
+async def end_session(session_id: str):
+    if not sessions.drop(session_id):
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return JSONResponse(content={"session_id": session_id}, status_code=200)
+
+@router.get("/api/v1/cache/stats")
+async def cache_stats():
+    return JSONResponse(content=answer_cache.stats(), status_code=200)
+
+def open_session(session_id):
+    # Unknown or expired ids start a new session under a server-generated id.
+    if not SESSION_MEMORY:
+        return None
+    return sessions.get(session_id) or sessions.create()
+
+async def answer(question, emit=no_emit, session=None, tenant_id=None):
+    """
+    Answers one question end to end and returns the message sent to the user.
+    """
+    if session is None:
+        return await answer_turn(question, emit, None, tenant_id)
+    async with session.turn_lock:
+        return await answer_turn(question, emit, session, tenant_id)
+
+async def answer_turn(question, emit, session, tenant_id):
+    guard = guardrail if TIERED_GUARDRAIL else GuardrailChecker(OPENAI_API_KEY)
+    grader = similarity_grader if LOCAL_GRADER else grade_doc(OPENAI_API_KEY)
+    packer = context_packer if CONTEXT_PACKING else None
+    leader_analyst = ConversationalPipeline(OPENAI_API_KEY, session=session, packer=packer, router=model_router)
+    # Every stage of this request, from the guardrail on, is routed by the question's complexity.
+    leader_analyst.complexity = model_router.complexity(question)
+    if question.lower() == "exit":
+        return "Exiting the app."
+
+    # Answers that build on earlier turns of a session are not interchangeable between users.
+    use_cache = SEMANTIC_CACHE and (session is None or not session.turns)
+    if use_cache:
+        embedding = await embed_query(question)
+        cached_response = answer_cache.lookup(question, embedding)
+        if cached_response is not None:
+            if await guard.async_check_compliance(question, leader_analyst.model_for("guardrail")) == "no":
+                return "Inappropriate query " + await guard.async_generate_response(question, leader_analyst.model_for("guardrail_response"))
+            await emit("stage", {"stage": "cache"})
+            if session is not None:
+                session.end_turn(question, None, cached_response)
+            return cached_response
+    
+    prelude = speculative_prelude if SPECULATIVE_EXECUTION else serial_prelude
+    compliant, texts, status, subtasks = await prelude(question, guard, grader, leader_analyst, emit)
+    if not compliant:
+        return "Inappropriate query " + await guard.async_generate_response(question, leader_analyst.model_for("guardrail_response"))
+
+    # A decomposition into many subtasks routes the analysts to the larger model.
+    leader_analyst.complexity = model_router.complexity(question, subtasks)
+    final_response, web = await answer_question(
+        question, texts, status, subtasks, leader_analyst, emit, session, analyst_pool.tenant(tenant_id)
+    )
+    if use_cache:
+        answer_cache.store(question, embedding, final_response, web=web)
+    if session is not None:
+        session.end_turn(question, subtasks, final_response)
+    return final_response
+
+@router.post("/api/v1/users")
+async def ask_questions(request: QueryRequest):
+    session = open_session(request.session_id)
+    content = {"message": await answer(request.question, session=session, tenant_id=request.tenant_id)}
+    if session is not None:
+        content["session_id"] = session.session_id
+    return JSONResponse(content=content, status_code=200)
+
+@router.post("/api/v1/users/stream")
+async def ask_questions_stream(request: QueryRequest):
+    """
+    Server-Sent Events variant of `ask_questions`: `stage` events as each step
+    finishes, `token` events with the leader's answer as it is generated, then a
+    `done` event carrying the complete message.
+    """
+    events = asyncio.Queue()
+    session = open_session(request.session_id)
+
+    async def emit(event, data):
+        await events.put(sse_event(event, data))
+
+    async def produce():
+        try:
+            message = await answer(request.question, emit, session, request.tenant_id)
+            done = {"message": message}
+            if session is not None:
+                done["session_id"] = session.session_id
+            await emit("done", done)
+        except Exception:
+            await emit("error", {"message": "Something went wrong"})
+        finally:
+            await events.put(None)
+
+    async def stream():
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            # Stop the pipeline if the client disconnects.
+            task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,35 +1,205 @@
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import os
-from serpapi.google_search import GoogleSearch as search
-import os
+from serpapi.serp_api_client import SerpApiClient
+from serpapi.search_cache import MemorySearchCache, SqliteSearchCache, TieredSearchCache
+import asyncio
 import aiohttp
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from html.parser import HTMLParser
 from typing import Any, Dict, List, Optional
 
+# Length of the <p> extract kept per page.
+SCRAPE_MAX_CHARS = 800
+# Stop reading a page after this many bytes even if the extract is still short.
+SCRAPE_MAX_BYTES = 1024 * 1024
+SCRAPE_CHUNK_SIZE = 16 * 1024
+# (connect, read) timeout for a single page.
+SCRAPE_TIMEOUT = (3.05, 5)
+# Wall-clock budget for all pages of one get_content_from_urls call.
+SCRAPE_DEADLINE = 8.0
+# Return as soon as this many pages produced content (None waits for all of them).
+SCRAPE_MIN_RESULTS = 3
+SCRAPE_LIMIT_PER_HOST = 4
+SCRAPE_MAX_CONNECTIONS = 64
+SCRAPE_MAX_WORKERS = 16
+# Timeout for a single SerpApi search, and the connection pool kept to serpapi.com.
+SERPAPI_TIMEOUT = 15
+SERPAPI_MAX_CONNECTIONS = 32
+# Repeated searches are served from memory, then from disk, before paying for a SerpApi query.
+SERPAPI_CACHE_PATH = "./Cache/serpapi.sqlite"
+SERPAPI_CACHE_MAX_ENTRIES = 4096
+
+_pool_lock = threading.Lock()
+_session = None
+_executor = None
+_async_sessions = {}
+
+SerpApiClient.cache = TieredSearchCache(
+    MemorySearchCache(max_entries=SERPAPI_CACHE_MAX_ENTRIES),
+    SqliteSearchCache(SERPAPI_CACHE_PATH),
+)
+
+
+def get_session():
+    """Returns the process-wide requests session used for scraping."""
+    global _session
+    with _pool_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=SCRAPE_MAX_CONNECTIONS, pool_maxsize=SCRAPE_LIMIT_PER_HOST, pool_block=True)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.mount(SerpApiClient.BACKEND, HTTPAdapter(pool_maxsize=SERPAPI_MAX_CONNECTIONS))
+        return _session
+
+
+def get_executor():
+    """Returns the process-wide thread pool that runs blocking fetches."""
+    global _executor
+    with _pool_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SCRAPE_MAX_WORKERS, thread_name_prefix="scraper")
+        return _executor
+
+
+def get_async_session():
+    """Returns the aiohttp session of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    with _pool_lock:
+        # Sessions of loops that closed without `close_async_sessions` cannot be awaited
+        # any more; their transports went with the loop, so only release the objects.
+        for stale in [stale for stale in _async_sessions if stale.is_closed()]:
+            _async_sessions.pop(stale).detach()
+        session = _async_sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=SCRAPE_MAX_CONNECTIONS, limit_per_host=SCRAPE_LIMIT_PER_HOST)
+            timeout = aiohttp.ClientTimeout(sock_connect=SCRAPE_TIMEOUT[0], sock_read=SCRAPE_TIMEOUT[1])
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            _async_sessions[loop] = session
+        return session
+
+
+async def close_async_sessions():
+    """Closes the aiohttp session of the running event loop, e.g. on application shutdown."""
+    with _pool_lock:
+        session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+class _ParagraphProbe(HTMLParser):
+    # Counts the <p> text seen so far so a streamed download can stop early.
+
+    def __init__(self):
+        super().__init__()
+        self.depth = 0
+        self.chars = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "p":
+            self.depth += 1
+
+    def handle_endtag(self, tag):
+        if tag == "p" and self.depth:
+            self.depth -= 1
+
+    def handle_data(self, data):
+        if self.depth:
+            self.chars += len(data) + 1
+
+
 class ContentScraper:
     def __init__(self, serp_api_key):
         self.serp_api_key = serp_api_key
+        # One client serves every search; per-call parameters never touch its params_dict.
+        self.serp_client = SerpApiClient(
+            {"api_key": serp_api_key}, timeout=SERPAPI_TIMEOUT, session=get_session(), async_session=get_async_session
+        )
+
+    def _extract_paragraphs(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        paragraphs = soup.find_all('p')
+        content = ' '.join(paragraph.text for paragraph in paragraphs)
+        return content[:SCRAPE_MAX_CHARS]
 
-    def scrape_content(self, url):
+    def _decode(self, body, encoding):
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            paragraphs = soup.find_all('p')
-            content = ' '.join(paragraph.text for paragraph in paragraphs)
-            return content[:800]
+            return body.decode(encoding or "utf-8", errors="replace")
+        except LookupError:
+            # A charset Python does not know, e.g. "charset=foo-bar".
+            return body.decode("utf-8", errors="replace")
+
+    def scrape_content(self, url, stop=None):
+        """
+        Streams the page and stops once the <p> extract is long enough, or early
+        when `stop` (a threading.Event) is set, so a fetch past the deadline frees
+        its pool worker at the next chunk.
+        """
+        if stop is not None and stop.is_set():
+            return None
+        try:
+            with get_session().get(url, stream=True, timeout=SCRAPE_TIMEOUT) as response:
+                response.raise_for_status()
+                probe = _ParagraphProbe()
+                body = bytearray()
+                for chunk in response.iter_content(chunk_size=SCRAPE_CHUNK_SIZE):
+                    if stop is not None and stop.is_set():
+                        return None
+                    body.extend(chunk)
+                    probe.feed(self._decode(chunk, response.encoding))
+                    if probe.chars >= SCRAPE_MAX_CHARS or len(body) >= SCRAPE_MAX_BYTES:
+                        break
+                return self._extract_paragraphs(self._decode(bytes(body), response.encoding))
         except requests.RequestException:
             return None
 
-    def search_google(self, query):
-        params = {
-            "engine": "google_finance",
-            "q": query,
-            "api_key": self.serp_api_key
-        }
+    async def async_scrape_content(self, url):
+        try:
+            async with get_async_session().get(url) as response:
+                response.raise_for_status()
+                probe = _ParagraphProbe()
+                body = bytearray()
+                async for chunk in response.content.iter_chunked(SCRAPE_CHUNK_SIZE):
+                    body.extend(chunk)
+                    probe.feed(self._decode(chunk, response.charset))
+                    if probe.chars >= SCRAPE_MAX_CHARS or len(body) >= SCRAPE_MAX_BYTES:
+                        break
+            return self._extract_paragraphs(self._decode(bytes(body), response.charset))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+    def _search(self, engine, query):
+        try:
+            return self.serp_client.search({"engine": engine, "q": query})
+        except (requests.RequestException, ValueError):
+            # A failed or timed out search contributes no context instead of failing the request.
+            return {}
 
-        store = search(params).get_dict()
+    def search_batch(self, searches):
+        """
+        Runs several SerpApi searches concurrently on the shared session.
+
+        Args:
+            searches (list): (engine, query) pairs.
+
+        Returns:
+            list: The result dicts, in the order of `searches` (empty for failed searches).
+        """
+        futures = [get_executor().submit(self._search, engine, query) for engine, query in searches]
+        return [future.result() for future in futures]
+
+    async def async_search_batch(self, searches):
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(
+            loop.run_in_executor(get_executor(), self._search, engine, query)
+            for engine, query in searches
+        ))
 
+    def _parse_google_finance(self, store):
         source_description_list = []
 
         if 'knowledge_graph' in store and store['knowledge_graph'] is not None:
@@ -61,31 +231,72 @@ class ContentScraper:
 
         return source_description_list, ai_overview_context
 
-    def get_content_from_urls(self, source_description_list):
-        urls = [item["source"] for item in source_description_list]
+    def search_google(self, query):
+        store = self._search("google_finance", query)
+        return self._parse_google_finance(store)
+
+    async def async_search_google(self, query):
+        store, = await self.async_search_batch([("google_finance", query)])
+        return self._parse_google_finance(store)
+
+    def _collect(self, urls, contents):
         all_content = []
         context = []
-
         for url in urls:
-            content = self.scrape_content(url)
+            content = contents.get(url)
             if content:
                 all_content.append({"url": url, "content": content})
                 context.append(content)
-
         return all_content, context
-    
-    def get_stock_price(self, query):
+
+    def get_content_from_urls(self, source_description_list, deadline=SCRAPE_DEADLINE, min_results=SCRAPE_MIN_RESULTS):
         """
-        Gets stock price information if present in the store dictionary.
-        Returns a list containing a formatted statement with stock price information.
+        Fetches the pages concurrently on the shared session and returns once
+        `min_results` pages produced content or `deadline` seconds have passed.
+        Results keep the order of `source_description_list`.
         """
-        params = {
-            "engine": "google",
-            "q": query,
-            "api_key": self.serp_api_key
-        }
+        urls = list(dict.fromkeys(item["source"] for item in source_description_list if item["source"]))
+        stop = threading.Event()
+        futures = {get_executor().submit(self.scrape_content, url, stop): url for url in urls}
+        contents = {}
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                content = future.result()
+                if content:
+                    contents[futures[future]] = content
+                    if min_results and len(contents) >= min_results:
+                        break
+        except FuturesTimeoutError:
+            pass
+        # cancel() only drops queued fetches; running ones stop at their next chunk.
+        stop.set()
+        for future in futures:
+            future.cancel()
 
-        store = search(params).get_dict()
+        return self._collect(urls, contents)
+
+    async def async_get_content_from_urls(self, source_description_list, deadline=SCRAPE_DEADLINE, min_results=SCRAPE_MIN_RESULTS):
+        urls = list(dict.fromkeys(item["source"] for item in source_description_list if item["source"]))
+        tasks = {asyncio.create_task(self.async_scrape_content(url)): url for url in urls}
+        contents = {}
+        pending = set(tasks)
+        stop_at = time.monotonic() + deadline
+        try:
+            while pending and not (min_results and len(contents) >= min_results):
+                remaining = stop_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        contents[tasks[task]] = task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return self._collect(urls, contents)
+
+    def _parse_stock_price(self, store):
         stock_info = []
         if "answer_box" in store and store["answer_box"]:
             answer_box = store["answer_box"]
@@ -108,6 +319,56 @@ class ContentScraper:
         # Return empty list if stock price information is not found
         return stock_info
 
+    def get_stock_price(self, query):
+        """
+        Gets stock price information if present in the store dictionary.
+        Returns a list containing a formatted statement with stock price information.
+        """
+        store = self._search("google", query)
+        return self._parse_stock_price(store)
+
+    async def async_get_stock_price(self, query):
+        store, = await self.async_search_batch([("google", query)])
+        return self._parse_stock_price(store)
+
+    def _search_pairs(self, queries):
+        searches = []
+        for query in queries:
+            searches.append(("google_finance", query))
+            searches.append(("google", query))
+        return searches
+
+    def _merge_context(self, context, ai_overview_context, stock_info):
+        context.extend(ai_overview_context)
+        context.extend(stock_info)
+        return context
+
+    def build_contexts(self, queries):
+        """
+        Collects the web context of several subtasks: scraped page extracts, followed
+        by the AI overview snippets and the stock price statements. All searches are
+        issued as one concurrent batch.
+        """
+        stores = self.search_batch(self._search_pairs(queries))
+        contexts = []
+        for finance_store, google_store in zip(stores[::2], stores[1::2]):
+            source_description_list, ai_overview_context = self._parse_google_finance(finance_store)
+            all_content, context = self.get_content_from_urls(source_description_list)
+            contexts.append(self._merge_context(context, ai_overview_context, self._parse_stock_price(google_store)))
+        return contexts
+
+    async def async_build_contexts(self, queries):
+        stores = await self.async_search_batch(self._search_pairs(queries))
+        parsed = [self._parse_google_finance(store) for store in stores[::2]]
+        pages = await asyncio.gather(*(
+            self.async_get_content_from_urls(source_description_list)
+            for source_description_list, _ in parsed
+        ))
+        contexts = []
+        for (_, ai_overview_context), (all_content, context), google_store in zip(parsed, pages, stores[1::2]):
+            contexts.append(self._merge_context(context, ai_overview_context, self._parse_stock_price(google_store)))
+        return contexts
+
 
 
 
@@ -0,0 +1,252 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from llm_gateway import get_gateway
+
+# Figures, years, periods and tickers/company names: questions that differ in any of
+# them ask for different numbers however close their embeddings are.
+PERIOD = re.compile(r"\b(?:(q[1-4]|h[12])|fy|(first|second|third|fourth) quarter)", re.IGNORECASE)
+NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+WORD = re.compile(r"[A-Za-z][A-Za-z&.'\u2019-]*")
+QUARTERS = {"first": "q1", "second": "q2", "third": "q3", "fourth": "q4"}
+# Capitalised words that start questions rather than name anything.
+COMMON_WORDS = set(
+    "what which who how why when where is are was were do does did can could should would will "
+    "the a an and or of in on for to by with please tell show give list compare find i".split()
+)
+
+
+class KeyTerms(NamedTuple):
+    figures: frozenset
+    names: frozenset
+    words: frozenset
+
+
+def key_terms(question: str) -> KeyTerms:
+    """
+    Returns:
+        KeyTerms: The numbers and periods of the question ("Q3", "third quarter" ->
+            "q3", "FY"), its capitalised words and tickers, and all its words.
+    """
+    figures = set()
+    for match in PERIOD.finditer(question):
+        figures.add(QUARTERS[match.group(2).lower()] if match.group(2) else (match.group(1) or "fy").lower())
+    rest = PERIOD.sub(" ", question)
+    figures.update(number.replace(",", "") for number in NUMBER.findall(rest))
+    names, words = set(), set()
+    for word in WORD.findall(rest):
+        normalised = re.sub(r"['\u2019]s?$|[.'\u2019-]+$", "", word).lower()
+        words.add(normalised)
+        if word[0].isupper() and normalised not in COMMON_WORDS:
+            names.add(normalised)
+    return KeyTerms(frozenset(figures), frozenset(names), frozenset(words))
+
+
+def same_key_terms(a: KeyTerms, b: KeyTerms) -> bool:
+    """
+    Returns:
+        bool: Whether two questions name the same figures and periods exactly, and
+            each names no company or ticker the other does not mention.
+    """
+    return a.figures == b.figures and a.names <= b.words and b.names <= a.words
+
+
+class SemanticCache:
+    """
+    Response cache keyed on the embedding of the user's question.
+
+    A question whose cosine similarity to a cached one is at least `threshold`,
+    and which names the same figures, periods and companies (`key_terms`), gets
+    the cached response. Entries expire after their TTL, the least recently
+    used entry is evicted when the cache is full, and the whole cache is dropped
+    whenever the documents under `data_dir` change.
+    """
+
+    def __init__(
+        self,
+        openai_api_key: str,
+        model: str = "text-embedding-3-small",
+        data_dir: str = "./data/",
+        threshold: float = 0.95,
+        max_entries: int = 1024,
+        ttl: float = 3600,
+        web_ttl: float = 300,
+        fingerprint_interval: float = 5.0,
+    ):
+        # Its own client through the gateway: the document store's embedder creates
+        # its client lazily on Pathway's event loops, not on the server's.
+        self.gateway = get_gateway(openai_api_key)
+        self.model = model
+        self.data_dir = data_dir
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.web_ttl = web_ttl
+        self.fingerprint_interval = fingerprint_interval
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: list = []
+        self._fingerprint = self._data_fingerprint()
+        self._fingerprint_checked = time.monotonic()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "term_mismatches": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def _data_fingerprint(self) -> int:
+        files = []
+        for root, _, names in os.walk(self.data_dir):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((os.path.join(root, name), stat.st_mtime_ns, stat.st_size))
+        return hash(tuple(sorted(files)))
+
+    def _check_documents(self) -> None:
+        now = time.monotonic()
+        if now - self._fingerprint_checked < self.fingerprint_interval:
+            return
+        self._fingerprint_checked = now
+        fingerprint = self._data_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            if self._entries:
+                self._counters["invalidations"] += 1
+            self._entries.clear()
+            self._matrix = None
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._counters["expirations"] += len(expired)
+            self._matrix = None
+
+    async def embed_many(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Embeds texts in one request, with the document store's embedding model.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: The L2-normalised embeddings, in the order of `texts`.
+        """
+        if not texts:
+            return []
+        response = await self.gateway.async_embedding(model=self.model, input=list(texts), stage="embedding")
+        embeddings = []
+        for item in sorted(response.data, key=lambda item: item.index):
+            embedding = np.asarray(item.embedding, dtype=np.float32)
+            embeddings.append(embedding / (np.linalg.norm(embedding) or 1.0))
+        return embeddings
+
+    async def embed(self, question: str) -> np.ndarray:
+        """
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            np.ndarray: The L2-normalised embedding.
+        """
+        return (await self.embed_many([question]))[0]
+
+    def documents_version(self) -> int:
+        """
+        Returns:
+            int: Fingerprint of the documents under `data_dir`, re-checked at most
+                every `fingerprint_interval` seconds.
+        """
+        with self._lock:
+            self._check_documents()
+            return self._fingerprint
+
+    def lookup(self, question: str, embedding: np.ndarray) -> Optional[str]:
+        """
+        Args:
+            question (str): The user's question.
+            embedding (np.ndarray): Normalised question embedding from `embed`.
+
+        Returns:
+            str: The cached response of the most similar question with the same key
+                terms, or None on a miss.
+        """
+        with self._lock:
+            self._check_documents()
+            self._expire()
+            if not self._entries:
+                self._counters["misses"] += 1
+                return None
+            if self._matrix is None:
+                self._matrix_ids = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[key]["embedding"] for key in self._matrix_ids])
+            scores = self._matrix @ embedding
+            terms = key_terms(question)
+            similar = False
+            for best in np.argsort(-scores):
+                if scores[best] < self.threshold:
+                    break
+                similar = True
+                key = self._matrix_ids[int(best)]
+                if same_key_terms(self._entries[key]["terms"], terms):
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return self._entries[key]["response"]
+            if similar:
+                self._counters["term_mismatches"] += 1
+            self._counters["misses"] += 1
+            return None
+
+    def store(self, question: str, embedding: np.ndarray, response: str, web: bool = False) -> None:
+        """
+        Caches a final response.
+
+        Args:
+            question (str): The user's question.
+            embedding (np.ndarray): Normalised question embedding from `embed`.
+            response (str): The final response.
+            web (bool): Whether the response was built from web search, which uses the shorter TTL.
+        """
+        ttl = self.web_ttl if web else self.ttl
+        with self._lock:
+            self._entries[self._next_id] = {
+                "question": question,
+                "terms": key_terms(question),
+                "embedding": embedding,
+                "response": response,
+                "expires_at": time.monotonic() + ttl,
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+            self._matrix = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Hit/miss counters, hit rate and current size.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters["entries"] = len(self._entries)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        return counters
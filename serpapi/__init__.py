@@ -1,4 +1,5 @@
 from .serp_api_client import SerpApiClient
+from .search_cache import SearchCache, MemorySearchCache, SqliteSearchCache, TieredSearchCache
 from .baidu_search import BaiduSearch
 from .google_search import GoogleSearch
 from .yahoo_search import YahooSearch
@@ -1,3 +1,5 @@
+import asyncio
+from collections import deque
 from serpapi.serp_api_client_exception import SerpApiClientException
 
 DEFAULT_START = 0 
@@ -15,16 +17,19 @@ class Pagination:
     self.end = end
     self.num = num
 
+    # copy of the client parameters, the client itself is not modified
+    self.params = dict(self.client.params_dict)
+
     # use value from the client
     if self.start == DEFAULT_START:
-      if 'start' in self.client.params_dict:
-        self.start = self.client.params_dict['start']
+      if 'start' in self.params:
+        self.start = self.params['start']
     if self.end == DEFAULT_END:
-      if 'end' in self.client.params_dict:
-        self.end = self.client.params_dict['end']
+      if 'end' in self.params:
+        self.end = self.params['end']
     if self.num == DEFAULT_num:
-      if 'num' in self.client.params_dict:
-        self.num = self.client.params_dict['num']
+      if 'num' in self.params:
+        self.num = self.params['num']
 
     # basic check
     if self.start > self.end:
@@ -37,17 +42,17 @@ class Pagination:
     return self
 
   def update(self):
-    self.client.params_dict['start'] = self.start
-    self.client.params_dict['num'] = self.num
+    self.params['start'] = self.start
+    self.params['num'] = self.num
     if self.start > 0:
-      self.client.params_dict['start'] += 1
+      self.params['start'] += 1
 
   def __next__(self):
     # update parameter
     self.update()
 
     # execute request
-    result = self.client.get_dict()
+    result = self.client.search(self.params)
 
     # stop if backend miss to return serpapi_pagination
     if not 'serpapi_pagination' in result:
@@ -65,3 +70,95 @@ class Pagination:
     self.start += self.num
 
     return result
+
+
+# Paginate response in SerpApi asynchronously, prefetching the next pages
+class AsyncPagination:
+  """AsyncPagination fetches up to `prefetch` pages concurrently while the caller
+  consumes the current one. It works on a copy of the client parameters and uses
+  async_search, so the client is never modified and can be shared.
+  ```python
+  async for page in client.async_pagination(prefetch = 4):
+    ...
+  ```
+  """
+
+  def __init__(self, client, start = DEFAULT_START, end = DEFAULT_END, num = DEFAULT_num, prefetch = 4):
+    self.client = client
+    self.params = dict(client.params_dict)
+    self.start = start
+    self.end = end
+    self.num = num
+    self.prefetch = prefetch
+
+    # use value from the client
+    if self.start == DEFAULT_START:
+      if 'start' in self.params:
+        self.start = self.params['start']
+    if self.end == DEFAULT_END:
+      if 'end' in self.params:
+        self.end = self.params['end']
+    if self.num == DEFAULT_num:
+      if 'num' in self.params:
+        self.num = self.params['num']
+
+    # basic check
+    if self.start > self.end:
+        raise SerpApiClientException("start: {} must be less than end: {}".format(self.start, self.end))
+    if(self.start + self.num) > self.end:
+        raise SerpApiClientException("start + num: {} + {} must be less than end: {}".format(self.start, self.num, self.end))
+    if self.prefetch < 1:
+        raise SerpApiClientException("prefetch: {} must be at least 1".format(self.prefetch))
+
+    self._next_start = self.start
+    self._pending = deque()
+    self._done = False
+
+  def page_params(self, start):
+    """Returns:
+        Copy of the parameters for the page beginning at start
+    """
+    params = dict(self.params)
+    params['start'] = start + 1 if start > 0 else start
+    params['num'] = self.num
+    return params
+
+  def _schedule(self):
+    # pages past end are never returned, so they are not fetched either
+    while not self._done and len(self._pending) < self.prefetch and self._next_start + self.num <= self.end:
+      self._pending.append(asyncio.ensure_future(self.client.async_search(self.page_params(self._next_start))))
+      self._next_start += self.num
+
+  def _discard(self):
+    self._done = True
+    while self._pending:
+      task = self._pending.popleft()
+      task.cancel()
+      task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+  async def aclose(self):
+    """Cancel the prefetched pages"""
+    self._discard()
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    self._schedule()
+    if not self._pending:
+      raise StopAsyncIteration
+
+    try:
+      result = await self._pending.popleft()
+    except BaseException:
+      self._discard()
+      raise
+
+    # stop if backend miss to return serpapi_pagination or there is no next page
+    if not 'serpapi_pagination' in result or not 'next' in result['serpapi_pagination']:
+      self._discard()
+      raise StopAsyncIteration
+
+    # keep the prefetch window full while the caller works on this page
+    self._schedule()
+    return result
@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# parameters that identify the caller rather than the search
+PRIVATE_PARAMS = ('api_key', 'serp_api_key')
+
+DEFAULT_TTL = 3600
+# google_finance quotes and google answer boxes (stock prices) go stale quickly
+ENGINE_TTLS = {
+    'google_finance': 60,
+    'google_scholar': 7 * 24 * 3600,
+}
+ANSWER_BOX_TTL = 60
+
+
+class _InflightCall(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SearchCache(ABC):
+    """SearchCache stores raw SerpApi responses keyed on the normalized search parameters.
+    Set it on the client class to share it between every search:
+    ```python
+    from serpapi import SerpApiClient, MemorySearchCache
+    SerpApiClient.cache = MemorySearchCache()
+    ```
+
+    Identical searches running at the same time share one upstream request.
+    Subclasses implement get_entry and set_entry.
+    """
+
+    def __init__(self, default_ttl = DEFAULT_TTL, engine_ttls = None, answer_box_ttl = ANSWER_BOX_TTL):
+        self.default_ttl = default_ttl
+        self.engine_ttls = dict(ENGINE_TTLS if engine_ttls is None else engine_ttls)
+        self.answer_box_ttl = answer_box_ttl
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._async_inflight = {}
+        self._stats_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'collapsed': 0}
+
+    @abstractmethod
+    def get_entry(self, key):
+        """Returns:
+            (value, expires_at) tuple or None when the key is missing or expired
+        """
+
+    @abstractmethod
+    def set_entry(self, key, value, expires_at):
+        pass
+
+    def make_key(self, path, params):
+        """Returns:
+            Hash of the path and the parameters without the api key
+        """
+        normalized = {k: str(v) for k, v in params.items() if k not in PRIVATE_PARAMS}
+        payload = json.dumps([path, normalized], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, params, text):
+        """Returns:
+            Time to live in seconds of a response
+        """
+        engine = params.get('engine')
+        if engine == 'google' and '"answer_box"' in text:
+            return self.answer_box_ttl
+        return self.engine_ttls.get(engine, self.default_ttl)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def fetch(self, path, params, loader):
+        """Return the cached response text or load it with loader
+        Parameters:
+            path (string): API path
+            params (dict): request parameters
+            loader (callable): returns the requests.Response of the search
+        Returns:
+            string: response text
+        """
+        key = self.make_key(path, params)
+        entry = self.get_entry(key)
+        if entry is not None:
+            self._count('hits')
+            return entry[0]
+
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _InflightCall()
+                self._inflight[key] = call
+
+        if not leader:
+            self._count('collapsed')
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self._count('misses')
+        try:
+            response = loader()
+            call.result = response.text
+            if response.status_code == 200:
+                ttl = self.ttl_for(params, call.result)
+                self.set_entry(key, call.result, time.time() + ttl)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            call.event.set()
+
+    async def async_fetch(self, path, params, loader):
+        """Async variant of fetch
+        Parameters:
+            path (string): API path
+            params (dict): request parameters
+            loader (coroutine function): returns (status, text) of the search
+        Returns:
+            string: response text
+        """
+        key = self.make_key(path, params)
+        entry = self.get_entry(key)
+        if entry is not None:
+            self._count('hits')
+            return entry[0]
+
+        inflight_key = (id(asyncio.get_running_loop()), key)
+        call = self._async_inflight.get(inflight_key)
+        if call is not None:
+            self._count('collapsed')
+            return await asyncio.shield(call)
+
+        self._count('misses')
+        # The search runs as its own task, so a caller that is cancelled (e.g.
+        # discarded speculative work) stops waiting without cancelling it for
+        # the followers of the same search, which still get its result.
+        call = asyncio.ensure_future(self._async_load(key, params, loader))
+        self._async_inflight[inflight_key] = call
+
+        def done(call):
+            del self._async_inflight[inflight_key]
+            if not call.cancelled():
+                # retrieved here so a search nobody waits for any more is not reported
+                call.exception()
+        call.add_done_callback(done)
+        return await asyncio.shield(call)
+
+    async def _async_load(self, key, params, loader):
+        status, text = await loader()
+        if status == 200:
+            self.set_entry(key, text, time.time() + self.ttl_for(params, text))
+        return text
+
+
+class MemorySearchCache(SearchCache):
+    """In-process LRU cache"""
+
+    def __init__(self, max_entries = 4096, **kwargs):
+        super(MemorySearchCache, self).__init__(**kwargs)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set_entry(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteSearchCache(SearchCache):
+    """On-disk cache shared between processes and restarts"""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path, **kwargs):
+        super(SqliteSearchCache, self).__init__(**kwargs)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS search (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+        self._db.commit()
+
+    def get_entry(self, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, expires_at FROM search WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+        return row
+
+    def set_entry(self, key, value, expires_at):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO search VALUES (?, ?, ?)', (key, value, expires_at))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._db.execute('DELETE FROM search WHERE expires_at <= ?', (time.time(),))
+            self._db.commit()
+
+
+class TieredSearchCache(SearchCache):
+    """Memory tier in front of a disk tier"""
+
+    def __init__(self, memory, disk, **kwargs):
+        super(TieredSearchCache, self).__init__(**kwargs)
+        self.memory = memory
+        self.disk = disk
+
+    def get_entry(self, key):
+        entry = self.memory.get_entry(key)
+        if entry is None:
+            entry = self.disk.get_entry(key)
+            if entry is not None:
+                self.memory.set_entry(key, entry[0], entry[1])
+        return entry
+
+    def set_entry(self, key, value, expires_at):
+        self.memory.set_entry(key, value, expires_at)
+        self.disk.set_entry(key, value, expires_at)
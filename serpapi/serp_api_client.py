@@ -1,6 +1,9 @@
+import asyncio
 import requests
 import json
-from serpapi.pagination import Pagination
+import threading
+import aiohttp
+from serpapi.pagination import Pagination, AsyncPagination
 from serpapi.serp_api_client_exception import SerpApiClientException
 
 GOOGLE_ENGINE = 'google'
@@ -31,43 +34,136 @@ class SerpApiClient(object):
 
     BACKEND = "https://serpapi.com"
     SERP_API_KEY = None
+    # optional serpapi.search_cache.SearchCache shared by every search
+    cache = None
 
-    def __init__(self, params_dict, engine = None, timeout = 60000):
+    def __init__(self, params_dict, engine = None, timeout = 60000, session = None, async_session = None):
         self.params_dict = params_dict
         self.engine = engine
         self.timeout = timeout
+        # long-lived requests.Session, created on first use unless one is shared in
+        self.session = session
+        # callable returning the aiohttp.ClientSession of the running loop, when sessions are shared in
+        self.async_session = async_session
+        self._session_lock = threading.Lock()
+        self._async_sessions = {}
 
-    def construct_url(self, path = "/search"):
-        self.params_dict['source'] = 'python'
+    def get_session(self):
+        """Returns:
+            requests.Session owned by this client
+        """
+        with self._session_lock:
+            if self.session is None:
+                self.session = requests.Session()
+            return self.session
+
+    def get_async_session(self):
+        """Returns:
+            aiohttp.ClientSession of the running event loop
+        """
+        if self.async_session is not None:
+            return self.async_session()
+        loop = asyncio.get_running_loop()
+        with self._session_lock:
+            # sessions of loops that closed without close() cannot be awaited any more,
+            # their transports went with the loop, so only release the objects
+            for stale in [stale for stale in self._async_sessions if stale.is_closed()]:
+                self._async_sessions.pop(stale).detach()
+            session = self._async_sessions.get(loop)
+            if session is None or session.closed:
+                session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+                self._async_sessions[loop] = session
+            return session
+
+    async def close(self):
+        """Close the aiohttp session of the running event loop, shared sessions are left to their owner"""
+        with self._session_lock:
+            session = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def construct_url(self, path = "/search", params = None):
+        """Returns:
+            URL and a new parameter dict for the request, params_dict is left untouched
+        """
+        parameter = dict(self.params_dict if params is None else params)
+        parameter['source'] = 'python'
         if self.SERP_API_KEY:
-            self.params_dict['serp_api_key'] = self.SERP_API_KEY
+            parameter['serp_api_key'] = self.SERP_API_KEY
         if self.engine:
-            if not 'engine' in self.params_dict:
-                self.params_dict['engine'] = self.engine
-        if not 'engine' in self.params_dict:
+            if not 'engine' in parameter:
+                parameter['engine'] = self.engine
+        if not 'engine' in parameter:
             raise SerpApiClientException("engine must be defined in params_dict or engine")
-        return self.BACKEND + path, self.params_dict
+        return self.BACKEND + path, parameter
 
-    def get_response(self, path = '/search'):
+    def get_response(self, path = '/search', params = None):
         """Returns:
             Response object provided by requests.get
         """
         url = None
         try:
-            url, parameter = self.construct_url(path)
+            url, parameter = self.construct_url(path, params)
             # print(url)
-            response = requests.get(url, parameter, timeout=self.timeout)
+            response = self.get_session().get(url, parameter, timeout=self.timeout)
             return response
         except requests.HTTPError as e:
             print("fail: " + url)
             print(e, e.response.status_code)
             raise e
 
-    def get_results(self, path='/search'):
+    def get_results(self, path='/search', params = None):
         """Returns:
             Response text field
         """
-        return self.get_response(path).text
+        if self.cache is None or path != '/search':
+            return self.get_response(path, params).text
+        url, parameter = self.construct_url(path, params)
+        return self.cache.fetch(path, parameter, lambda: self.get_response(path, params))
+
+    async def async_get_results(self, path='/search', params = None):
+        """Returns:
+            Response text field, fetched with aiohttp
+        """
+        url, parameter = self.construct_url(path, params)
+        # aiohttp only accepts str, int and float query values
+        query = {k: v if isinstance(v, (str, int, float)) and not isinstance(v, bool) else str(v)
+                 for k, v in parameter.items()}
+
+        async def load():
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            async with self.get_async_session().get(url, params=query, timeout=timeout) as response:
+                return response.status, await response.text()
+
+        if self.cache is None or path != '/search':
+            status, text = await load()
+            return text
+        return await self.cache.async_fetch(path, parameter, load)
+
+    def _json_params(self, params = None):
+        parameter = dict(self.params_dict)
+        if params:
+            parameter.update(params)
+        parameter["output"] = "json"
+        return parameter
+
+    def search(self, params = None):
+        """Run a search without modifying the client
+        Parameters:
+            params (dict): per-call parameters, merged over params_dict
+        Returns:
+            dict: formatted JSON search results
+        """
+        return json.loads(self.get_results(params=self._json_params(params)))
+
+    async def async_search(self, params = None):
+        """Run a search with aiohttp without modifying the client
+        Parameters:
+            params (dict): per-call parameters, merged over params_dict
+        Returns:
+            dict: formatted JSON search results
+        """
+        return json.loads(await self.async_get_results(params=self._json_params(params)))
 
     def get_html(self):
         """Returns:
@@ -79,15 +175,13 @@ class SerpApiClient(object):
         """Returns:
             Formatted JSON search results using json package
         """
-        self.params_dict["output"] = "json"
-        return json.loads(self.get_results())
+        return self.search()
 
     def get_raw_json(self):
         """Returns:
             Formatted JSON search result as string
         """
-        self.params_dict["output"] = "json"
-        return self.get_results()
+        return self.get_results(params=self._json_params())
 
     def get_dictionary(self):
         """Returns:
@@ -163,11 +257,12 @@ class SerpApiClient(object):
         Returns:
             dict: Location matching q
         """
-        self.params_dict = {}
-        self.params_dict["output"] = "json"
-        self.params_dict["q"] = q
-        self.params_dict["limit"] = limit
-        buffer = self.get_results('/locations.json')
+        params = {
+            "output": "json",
+            "q": q,
+            "limit": limit,
+        }
+        buffer = self.get_results('/locations.json', params)
         return json.loads(buffer)
     
     def pagination(self, start = 0, end = 1000000000, page_size = 10):
@@ -175,3 +270,9 @@ class SerpApiClient(object):
             Generator to iterate the search results pagination
         """
         return Pagination(self, start, end, page_size)
+
+    def async_pagination(self, start = 0, end = 1000000000, page_size = 10, prefetch = 4):
+        """Return:
+            Async iterator over the search results pagination, prefetching `prefetch` pages
+        """
+        return AsyncPagination(self, start, end, page_size, prefetch)
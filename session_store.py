@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+def chunk_id(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+
+
+def compact_answer(answer: str, max_chars: int = 400) -> str:
+    """
+    Cuts an answer down to its leading sentences, at most `max_chars` long.
+    """
+    answer = " ".join(answer.split())
+    if len(answer) <= max_chars:
+        return answer
+    cut = answer[:max_chars]
+    end = max(cut.rfind(". "), cut.rfind("? "), cut.rfind("! "))
+    return cut[:end + 1] if end > 0 else cut.rstrip() + "..."
+
+
+class Session:
+    """
+    Memory of one conversation: its turns, the chunks retrieved for them and the
+    chunk ids retrieved per query.
+
+    Chunks already shown to the leader in an earlier turn are rendered as
+    `[chunk <id>]` references in later leader prompts, next to a rolling summary
+    of the earlier answers, instead of being sent again in full. A turn holds
+    `turn_lock` from start to `end_turn`, so concurrent requests on one session
+    run one after the other.
+    """
+
+    def __init__(self, session_id: str, max_turns: int = 5, summary_chars: int = 400):
+        self.session_id = session_id
+        self.max_turns = max_turns
+        self.summary_chars = summary_chars
+        self.turns: List[Dict[str, Any]] = []
+        self.chunks: Dict[str, str] = {}
+        # query -> (index version, chunk ids); reused only while the version is unchanged.
+        self.retrievals: Dict[str, Tuple[Any, List[str]]] = {}
+        # Chunks shown in the turns kept in the summary, and in the turn being answered.
+        self.seen: set = set()
+        self.pending: set = set()
+        self.expires_at = 0.0
+        self.turn_lock = asyncio.Lock()
+        self._lock = threading.Lock()
+        self._counters = {"referenced_chunks": 0, "saved_chars": 0, "reused_retrievals": 0}
+
+    @staticmethod
+    def _query_key(query: str) -> str:
+        return re.sub(r"\s+", " ", query.casefold()).strip(" ?!.")
+
+    def retrieved(self, query: str, version: Any = None) -> Optional[List[str]]:
+        """
+        Args:
+            query (str): The retrieval query.
+            version: Version of the indexed documents, a retrieval made under another
+                version is not reused.
+
+        Returns:
+            list: The chunk texts retrieved for the same query earlier in the session, or None.
+        """
+        with self._lock:
+            retrieval = self.retrievals.get(self._query_key(query))
+            if retrieval is None or retrieval[0] != version:
+                return None
+            self._counters["reused_retrievals"] += 1
+            return [self.chunks[i] for i in retrieval[1]]
+
+    def remember_retrieval(self, query: str, texts: List[str], version: Any = None) -> None:
+        with self._lock:
+            ids = []
+            for text in texts:
+                self.chunks.setdefault(chunk_id(text), text)
+                ids.append(chunk_id(text))
+            self.retrievals[self._query_key(query)] = (version, ids)
+
+    def compact(self, context: Union[List[str], str]) -> Union[List[str], str]:
+        """
+        Replaces chunks the leader saw in earlier turns by their references.
+
+        Args:
+            context (list or str): Retrieved chunks, or web context as one string.
+
+        Returns:
+            The context with repeated chunks referenced, of the same type.
+        """
+        if not isinstance(context, list):
+            return context
+        compacted = []
+        with self._lock:
+            for text in context:
+                key = chunk_id(text)
+                self.chunks.setdefault(key, text)
+                if key in self.seen:
+                    reference = f"[chunk {key}]"
+                    self._counters["referenced_chunks"] += 1
+                    self._counters["saved_chars"] += max(0, len(text) - len(reference))
+                    compacted.append(reference)
+                else:
+                    self.pending.add(key)
+                    compacted.append(text)
+        return compacted
+
+    def summary(self) -> str:
+        """
+        Returns:
+            str: The questions and compacted answers of the last turns, empty for a new session.
+        """
+        with self._lock:
+            turns = list(self.turns)
+        return "\n".join(f"Q: {turn['question']}\nA: {turn['answer']}" for turn in turns)
+
+    def end_turn(self, question: str, subtasks, answer: str) -> None:
+        with self._lock:
+            self.turns.append({
+                "question": question,
+                "subtasks": [subtask for subtask in (subtasks or []) if subtask],
+                "chunk_ids": sorted(self.pending),
+                "answer": compact_answer(answer, self.summary_chars),
+            })
+            del self.turns[:-self.max_turns]
+            self.seen = {key for turn in self.turns for key in turn["chunk_ids"]}
+            self.pending = set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            counters["turns"] = len(self.turns)
+            counters["chunks"] = len(self.chunks)
+        return counters
+
+
+class SessionStore:
+    """
+    Conversation sessions keyed by an id the server generates.
+
+    The id is an unguessable token returned to the client, which sends it back
+    to continue the conversation; clients cannot pick ids. Sessions expire `ttl` seconds after their last turn and the least recently
+    used session is dropped when more than `max_sessions` are open.
+    """
+
+    def __init__(self, max_sessions: int = 1024, ttl: float = 1800, max_turns: int = 5, summary_chars: int = 400):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.summary_chars = summary_chars
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._counters = {"created": 0, "resumed": 0, "evictions": 0, "expirations": 0}
+        self._totals = {"referenced_chunks": 0, "saved_chars": 0, "reused_retrievals": 0}
+
+    def _retire(self, session: Session) -> None:
+        for name, value in session.stats().items():
+            if name in self._totals:
+                self._totals[name] += value
+
+    def _expire(self, now: float) -> None:
+        for key in [key for key, session in self._sessions.items() if session.expires_at <= now]:
+            self._retire(self._sessions.pop(key))
+            self._counters["expirations"] += 1
+
+    def create(self) -> Session:
+        """
+        Returns:
+            Session: A new session under a fresh random id.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session_id = secrets.token_urlsafe(24)
+            session = Session(session_id, self.max_turns, self.summary_chars)
+            session.expires_at = now + self.ttl
+            self._sessions[session_id] = session
+            self._counters["created"] += 1
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                self._retire(evicted)
+                self._counters["evictions"] += 1
+            return session
+
+    def get(self, session_id: Optional[str]) -> Optional[Session]:
+        """
+        Returns:
+            Session: The open session with this id, or None if it is unknown or expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                return None
+            self._sessions.move_to_end(session_id)
+            self._counters["resumed"] += 1
+            session.expires_at = now + self.ttl
+            return session
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._retire(session)
+        return session is not None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Session counters and, over open and retired sessions, the chunks sent
+                as references, the prompt characters saved and the retrievals reused.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            totals = dict(self._totals)
+            sessions = list(self._sessions.values())
+        counters["sessions"] = len(sessions)
+        for session in sessions:
+            for name, value in session.stats().items():
+                if name in totals:
+                    totals[name] += value
+        counters.update(totals)
+        return counters
@@ -0,0 +1,408 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pathway as pw
+
+
+def _json_value(value: Any) -> Any:
+    return value.value if isinstance(value, pw.Json) else value
+
+
+def index_chunks(chunks: pw.Table, embedder: pw.UDF) -> pw.Table:
+    """
+    Embeds the chunks VectorStoreServer indexes, so a local index can follow them.
+
+    Args:
+        chunks (pw.Table): The document store's `chunked_docs`, so every document is
+            parsed and split once, by the store's own pipeline.
+        embedder (pw.UDF): Serves the vectors the store's embedder computes, e.g.
+            `SnapshotEmbedder.follower()`, so chunks are not embedded twice.
+
+    Returns:
+        pw.Table: One row per chunk with `text`, `metadata` and `embedding` columns.
+    """
+    return chunks.select(pw.this.text, pw.this.metadata, embedding=embedder(pw.this.text))
+
+
+def _hnswlib_available() -> bool:
+    try:
+        import hnswlib  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class IVFPartitioner:
+    """
+    Inverted-file ANN backend: rows are bucketed under their nearest k-means
+    centroid and a query scans only the `nprobe` buckets closest to it.
+
+    Trained once the index holds `min_train` chunks and retrained whenever it
+    has grown `retrain_factor` times since; in between, new rows are appended
+    to their nearest bucket.
+    """
+
+    def __init__(
+        self,
+        nlist: int = 0,
+        nprobe: int = 8,
+        min_train: int = 4096,
+        retrain_factor: int = 4,
+        sample_size: int = 65536,
+        iterations: int = 10,
+    ):
+        """
+        Args:
+            nlist (int): Number of buckets, 0 picks sqrt(chunks) at training time.
+            nprobe (int): Buckets scanned per query, the recall/latency knob.
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.retrain_factor = retrain_factor
+        self.sample_size = sample_size
+        self.iterations = iterations
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._arrays: Dict[int, np.ndarray] = {}
+        self._trained_size = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.centroids is not None
+
+    def needs_build(self, size: int) -> bool:
+        if self.centroids is None:
+            return size >= self.min_train
+        return size >= self.retrain_factor * self._trained_size
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(vectors[start:start + 8192] @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), 8192)
+        ])
+
+    def build(self, vectors: np.ndarray, rows: np.ndarray) -> None:
+        rng = np.random.default_rng(0)
+        nlist = min(len(vectors), self.nlist or max(1, int(np.sqrt(len(vectors)))))
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), self.sample_size), replace=False)]
+        # Spherical k-means, the embeddings are compared by dot product.
+        self.centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = self._assign(sample)
+            for bucket in range(nlist):
+                members = sample[assignment == bucket]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    self.centroids[bucket] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._lists = [[] for _ in range(nlist)]
+        for row, bucket in zip(rows, self._assign(vectors)):
+            self._lists[bucket].append(int(row))
+        self._arrays = {}
+        self._trained_size = len(vectors)
+
+    def add(self, row: int, vector: np.ndarray) -> None:
+        bucket = int(np.argmax(self.centroids @ vector))
+        self._lists[bucket].append(row)
+        self._arrays.pop(bucket, None)
+
+    def remove(self, row: int) -> None:
+        # Dead rows are filtered by the index, buckets are rebuilt on compaction.
+        pass
+
+    def candidates(self, query: np.ndarray, n: int) -> np.ndarray:
+        scores = self.centroids @ query
+        probes = np.argpartition(-scores, min(self.nprobe, len(scores)) - 1)[:self.nprobe]
+        arrays = []
+        for bucket in probes:
+            if bucket not in self._arrays:
+                self._arrays[bucket] = np.asarray(self._lists[bucket], dtype=np.int64)
+            arrays.append(self._arrays[bucket])
+        return np.concatenate(arrays)
+
+
+class HNSWPartitioner:
+    """
+    HNSW graph ANN backend on hnswlib, over the dequantized vectors.
+
+    Rows are inserted into the graph as they arrive and deleted rows are
+    marked as such; `ef_search` is the recall/latency knob.
+    """
+
+    def __init__(self, ef_search: int = 64, ef_construction: int = 200, m: int = 16, min_build: int = 1):
+        if not _hnswlib_available():
+            raise ImportError("The hnsw backend needs hnswlib: pip install hnswlib")
+        self.ef_search = ef_search
+        self.ef_construction = ef_construction
+        self.m = m
+        self.min_build = min_build
+        self.graph = None
+
+    @property
+    def ready(self) -> bool:
+        return self.graph is not None
+
+    def needs_build(self, size: int) -> bool:
+        return self.graph is None and size >= self.min_build
+
+    def build(self, vectors: np.ndarray, rows: np.ndarray) -> None:
+        import hnswlib
+
+        graph = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        graph.init_index(max_elements=max(1024, 2 * len(vectors)), ef_construction=self.ef_construction, M=self.m)
+        graph.add_items(vectors, rows)
+        self.graph = graph
+
+    def add(self, row: int, vector: np.ndarray) -> None:
+        if self.graph.get_current_count() == self.graph.get_max_elements():
+            self.graph.resize_index(2 * self.graph.get_max_elements())
+        self.graph.add_items(vector[None, :], [row])
+
+    def remove(self, row: int) -> None:
+        self.graph.mark_deleted(row)
+
+    def candidates(self, query: np.ndarray, n: int) -> np.ndarray:
+        # n never exceeds the live chunks, which are exactly the graph's undeleted rows.
+        self.graph.set_ef(max(self.ef_search, n))
+        labels, _ = self.graph.knn_query(query, k=n)
+        return labels[0].astype(np.int64)
+
+
+def make_ann(backend: str, nprobe: int = 8, ef_search: int = 64):
+    """
+    Returns:
+        IVFPartitioner, HNSWPartitioner or None for `backend` "ivf", "hnsw" or "exact".
+    """
+    if backend == "ivf":
+        return IVFPartitioner(nprobe=nprobe)
+    if backend == "hnsw":
+        return HNSWPartitioner(ef_search=ef_search)
+    if backend == "exact":
+        return None
+    raise ValueError(f"Unknown ANN backend {backend!r}, expected 'exact', 'ivf' or 'hnsw'")
+
+
+class QuantizedIndex:
+    """
+    In-process vector index over int8-quantized embeddings with exact re-ranking.
+
+    Each vector is stored as int8 codes with one float32 scale in contiguous
+    arrays, a quarter of the float32 size. A query scans the codes block by
+    block, keeps the `rerank_factor * k` best approximate scores and re-ranks
+    them with exact dot products. Full-precision vectors come from
+    `exact_vectors` (e.g. the on-disk embedding snapshot) so they do not have
+    to stay in memory; without it they are kept in memory.
+
+    Rows are added and removed through `on_change`, a `pw.io.subscribe` callback.
+    With an `ann` backend a query only scores the rows it proposes.
+    """
+
+    def __init__(
+        self,
+        exact_vectors: Optional[Callable[[List[str]], List[Optional[np.ndarray]]]] = None,
+        rerank_factor: int = 4,
+        block_size: int = 65536,
+        ann=None,
+    ):
+        self.exact_vectors = exact_vectors
+        # Optional IVFPartitioner or HNSWPartitioner choosing the rows a query scans.
+        self.ann = ann
+        self.rerank_factor = rerank_factor
+        self.block_size = block_size
+
+        self._lock = threading.Lock()
+        self._codes: Optional[np.ndarray] = None
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._docs: List[Optional[Dict[str, Any]]] = []
+        self._vectors: List[Optional[np.ndarray]] = []
+        self._slots: Dict[Any, int] = {}
+        self._size = 0
+        self._counters = {"searches": 0, "reranked": 0}
+
+    @staticmethod
+    def quantize(vector: np.ndarray):
+        """
+        Returns:
+            tuple: The int8 codes and the float32 scale of a vector.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return np.round(vector / scale).astype(np.int8), np.float32(scale)
+
+    def _grow(self, dimension: int) -> None:
+        capacity = max(1024, 2 * len(self._scales))
+        codes = np.zeros((capacity, dimension), dtype=np.int8)
+        scales = np.zeros(capacity, dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        if self._codes is not None:
+            codes[:self._size] = self._codes[:self._size]
+            scales[:self._size] = self._scales[:self._size]
+            alive[:self._size] = self._alive[:self._size]
+        self._codes, self._scales, self._alive = codes, scales, alive
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self._alive[:self._size])
+        self._codes[:len(keep)] = self._codes[keep]
+        self._scales[:len(keep)] = self._scales[keep]
+        self._alive[:self._size] = False
+        self._alive[:len(keep)] = True
+        self._docs = [self._docs[i] for i in keep]
+        if self.exact_vectors is None:
+            self._vectors = [self._vectors[i] for i in keep]
+        new_slots = {old: new for new, old in enumerate(keep)}
+        self._slots = {key: new_slots[old] for key, old in self._slots.items()}
+        self._size = len(keep)
+
+    def add(self, key: Any, text: str, metadata: Dict[str, Any], vector: np.ndarray) -> None:
+        codes, scale = self.quantize(vector)
+        with self._lock:
+            if key in self._slots:
+                self._remove(key)
+            if self._codes is None or self._size == len(self._scales):
+                self._grow(len(codes))
+            slot = self._size
+            self._codes[slot] = codes
+            self._scales[slot] = scale
+            self._alive[slot] = True
+            self._docs.append({"text": text, "metadata": metadata})
+            if self.exact_vectors is None:
+                self._vectors.append(np.asarray(vector, dtype=np.float32))
+            self._slots[key] = slot
+            self._size += 1
+            if self.ann is not None:
+                if self.ann.needs_build(len(self._slots)):
+                    self._build_ann()
+                elif self.ann.ready:
+                    self.ann.add(slot, codes.astype(np.float32) * scale)
+
+    def _build_ann(self) -> None:
+        rows = np.flatnonzero(self._alive[:self._size])
+        self.ann.build(self._dequantize(rows), rows)
+
+    def _remove(self, key: Any) -> None:
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        self._alive[slot] = False
+        self._docs[slot] = None
+        if self.exact_vectors is None:
+            self._vectors[slot] = None
+        if self.ann is not None and self.ann.ready:
+            self.ann.remove(slot)
+        if self._size > 1024 and self._size - len(self._slots) > self._size // 4:
+            self._compact()
+            if self.ann is not None and self.ann.ready:
+                # Slots moved, rebuild over the compacted rows.
+                self._build_ann()
+
+    def remove(self, key: Any) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def on_change(self, key, row: Dict[str, Any], time: int, is_addition: bool) -> None:
+        if is_addition:
+            self.add(key, row["text"], _json_value(row["metadata"]) or {}, row["embedding"])
+        else:
+            self.remove(key)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _dequantize(self, rows: np.ndarray) -> np.ndarray:
+        return self._codes[rows].astype(np.float32) * self._scales[rows, None]
+
+    def search(self, query: np.ndarray, k: int = 3, exact: bool = False) -> List[Dict[str, Any]]:
+        """
+        Args:
+            query (np.ndarray): Query embedding.
+            k (int): Number of chunks to return.
+            exact (bool): Scan every chunk even when an ANN backend is set.
+
+        Returns:
+            list: Up to k dicts with `text`, `metadata` and `dist` (negated exact dot product),
+                best first, like `RAGClient.retrieve`.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            if not self._slots:
+                return []
+            n = min(len(self._slots), k * self.rerank_factor)
+            if self.ann is not None and self.ann.ready and not exact:
+                rows = self.ann.candidates(query, n)
+                rows = rows[self._alive[rows]]
+                scores = (self._codes[rows].astype(np.float32) @ query) * self._scales[rows]
+            else:
+                rows = np.arange(self._size)
+                scores = np.empty(self._size, dtype=np.float32)
+                for start in range(0, self._size, self.block_size):
+                    end = min(start + self.block_size, self._size)
+                    scores[start:end] = (self._codes[start:end].astype(np.float32) @ query) * self._scales[start:end]
+                scores[~self._alive[:self._size]] = -np.inf
+            if not len(rows):
+                return []
+            n = min(n, len(rows))
+            best = np.argpartition(-scores, n - 1)[:n]
+            candidates, scores = rows[best], scores[best]
+            docs = [self._docs[i] for i in candidates]
+            vectors = None if self.exact_vectors is not None else [self._vectors[i] for i in candidates]
+            self._counters["searches"] += 1
+            self._counters["reranked"] += n
+
+        if vectors is None:
+            vectors = self.exact_vectors([doc["text"] for doc in docs])
+        exact_scores = np.array([
+            float(vector @ query) if vector is not None else float(score)
+            for score, vector in zip(scores, vectors)
+        ])
+        order = np.argsort(-exact_scores)[:k]
+        return [{**docs[i], "dist": -float(exact_scores[i])} for i in order]
+
+    def benchmark(self, k: int = 10, queries: int = 100, seed: int = 0) -> Dict[str, Any]:
+        """
+        Measures the ANN backend against exact search, using stored chunks as queries.
+
+        Returns:
+            dict: recall@k of the ANN results and the mean latency of both searches in ms.
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._alive[:self._size])
+            rows = np.random.default_rng(seed).choice(rows, min(queries, len(rows)), replace=False)
+            sample = self._dequantize(rows)
+        recall, ann_time, exact_time = 0.0, 0.0, 0.0
+        for query in sample:
+            started = time.perf_counter()
+            truth = self.search(query, k, exact=True)
+            exact_time += time.perf_counter() - started
+            started = time.perf_counter()
+            found = self.search(query, k)
+            ann_time += time.perf_counter() - started
+            truth_texts = [doc["text"] for doc in truth]
+            recall += len(set(truth_texts) & {doc["text"] for doc in found}) / max(1, len(truth_texts))
+        count = max(1, len(sample))
+        return {
+            "backend": type(self.ann).__name__ if self.ann is not None else "exact",
+            "k": k,
+            "queries": len(sample),
+            "chunks": len(self),
+            f"recall@{k}": recall / count,
+            "ann_ms": 1000 * ann_time / count,
+            "exact_ms": 1000 * exact_time / count,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: Chunk count, memory of the quantized vectors vs float32 and search counters.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters["chunks"] = len(self._slots)
+            dimension = 0 if self._codes is None else self._codes.shape[1]
+            counters["quantized_bytes"] = self._size * (dimension + 4)
+            counters["float32_bytes"] = self._size * dimension * 4
+            counters["ann"] = type(self.ann).__name__ if self.ann is not None else "exact"
+            counters["ann_ready"] = self.ann is not None and self.ann.ready
+        return counters